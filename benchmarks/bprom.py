@@ -0,0 +1,109 @@
+"""
+A local stand-in for BPROM, so the promoter stage can be benchmarked without sending genomes to softberry.  The pipeline
+is pointed at it with --bprom-url, or promoters.bpromURL.
+
+A request for a genome whose predictions are in promoterPredictions at the top of the repository is answered with them,
+the forward file for the genome and the reverse file for its reverse complement, so the stage gets real BPROM output.
+Any other sequence is answered with the predictions of stubs/tools.py.  Either way the answer is wrapped in the <pre>
+element promoters.cachedBPROM looks for.
+
+Run with python or Jython 2.5, either as a thread of the benchmarks, see serve, or on its own:
+
+  python bprom.py [PORT]
+"""
+
+import os
+import sys
+import hashlib
+import threading
+
+try:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn
+  from cgi import parse_qs
+except ImportError:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn
+  from urllib.parse import parse_qs
+
+"""Top of the repository."""
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(root, "benchmarks", "stubs"))
+import tools
+
+def key(sequence):
+  """
+  Returns the hash canned predictions are found by for sequence.
+  """
+  return hashlib.sha1(sequence.encode("ascii")).hexdigest()
+
+def loadCanned(predictions = os.path.join(root, "promoterPredictions"), genomes = os.path.join(root, "genomes")):
+  """
+  predictions: Directory of BPROM predictions named GENOME.forward.bprom and GENOME.reverse.bprom.
+  genomes:     Directory of the genomes, named GENOME.fas.
+
+  return:      A dictionary that maps the key of every strand of a genome with predictions to them.
+  """
+  result = {}
+  for fileName in sorted(os.listdir(predictions)):
+    if not fileName.endswith(".forward.bprom"):
+      continue
+    name = fileName[:-len(".forward.bprom")]
+    if not os.path.isfile(os.path.join(genomes, name + ".fas")):
+      continue
+    genome = tools.readGenome(os.path.join(genomes, name + ".fas"))
+    for strand, sequence in (("forward", genome), ("reverse", tools.reverseComplement(genome))):
+      if os.path.isfile(os.path.join(predictions, name + "." + strand + ".bprom")):
+        input = open(os.path.join(predictions, name + "." + strand + ".bprom"), "r")
+        result[key(sequence)] = input.read()
+        input.close()
+  return result
+
+class Handler(BaseHTTPRequestHandler):
+  """
+  Answers a POST of DATA=SEQUENCE the way BPROM does.
+  """
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+    if not isinstance(body, str):
+      body = body.decode("ascii")
+    sequence = "".join(parse_qs(body).get("DATA", [""])[0].split()).upper()
+    predictions = self.server.canned.get(key(sequence))
+    if predictions is None:
+      predictions = tools.formatPromoters(sequence)
+    self.server.requests += 1
+    response = "<html><body><pre>\n" + predictions + "\n</pre></body></html>\n"
+    self.send_response(200)
+    self.send_header("Content-Type", "text/html")
+    self.send_header("Content-Length", str(len(response)))
+    self.end_headers()
+    self.wfile.write(response.encode("ascii"))
+
+  def log_message(self, format, *arguments):
+    pass
+
+class Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+def serve(port = 0):
+  """
+  port:   Port to listen on, any free port if it's 0.
+
+  return: A 2-tuple, the server, running in a daemon thread until the benchmarks exit, and the address to request
+          predictions from.  The server counts the requests it answers in requests.
+  """
+  server = Server(("127.0.0.1", port), Handler)
+  server.canned = loadCanned()
+  server.requests = 0
+  thread = threading.Thread(target = server.serve_forever)
+  thread.setDaemon(True)
+  thread.start()
+  return server, "http://127.0.0.1:%d/bprom.pl" % server.server_address[1]
+
+if __name__ == "__main__":
+  server = Server(("127.0.0.1", len(sys.argv) > 1 and int(sys.argv[1]) or 8000), Handler)
+  server.canned = loadCanned()
+  server.requests = 0
+  print("Answering requests for promoters at http://127.0.0.1:%d/bprom.pl" % server.server_address[1])
+  server.serve_forever()
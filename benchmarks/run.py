@@ -0,0 +1,695 @@
+"""
+Offline benchmarks of the pipeline.  Every external program is replaced by a deterministic stub in benchmarks/stubs and
+BPROM by the local stand-in in benchmarks/bprom.py, so the benchmarks need neither the programs nor a network, and the
+genes and signals found only change when the code does.
+
+For every genome the stages that don't run external programs are benchmarked on their own, with the searches answered
+by the blast stub in between, and then the whole pipeline is run with Pipeline.run and timed stage by stage from the
+trace of the run.  The wall time, cpu time, and peak memory of every stage are printed, and a digest of what every stage
+found is compared with the baseline of the genome in benchmarks/baselines, so a change that makes a stage faster but
+changes its results is caught.
+
+Run from the top of the repository with Jython, the stubs are run with the python on the PATH:
+
+  jython -Dpython.path=src/main/python benchmarks/run.py [OPTIONS]
+
+   --genomes DIR    Directory of the genomes to benchmark.  Defaults to genomes.
+   --genome NAME    Only benchmark the genome NAME, may be given more than once.
+   --work DIR       Directory the pipeline is run in.  Defaults to a new temporary directory.
+   --keep           Keep the work directory once the benchmarks are done.
+   --repeat N       Run everything N times and keep the fastest run of each stage.  Defaults to 1.
+   --stages-only    Only benchmark the stages on their own.
+   --pipeline-only  Only benchmark the whole pipeline.
+   --search BACKEND Search backend every search of the pipeline uses, xml, tabular, or local.  Defaults to tabular,
+                    the backend the baselines were recorded with, a run with another backend may need --update.
+   --update         Write the digests of this run as the new baselines.
+   --report FILE    Write the measurements to FILE, a tab separated line for every stage of every genome.
+   --compare FILE   Print the change in the wall time of every stage since the report FILE was written.
+
+The exit status is 1 if the results of any stage changed from its baseline.
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import getopt
+import hashlib
+import tempfile
+import threading
+from java.lang import Runtime
+from java.lang import System
+
+"""Top of the repository."""
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+"""Directory of the stub programs."""
+stubs = os.path.join(root, "benchmarks", "stubs")
+
+"""Directory of the baselines, a file for each genome."""
+baselines = os.path.join(root, "benchmarks", "baselines")
+
+sys.path[:0] = [os.path.join(root, "src", "main", "python"), stubs, os.path.join(root, "benchmarks")]
+import tools
+import bprom
+
+"""Directories the pipeline caches results in, emptied before every run of the pipeline so nothing is restored."""
+cacheDirectories = ["initialBlasts", "extendedBlasts", "extensionDatabases", "intergenicBlasts", "promoterPredictions",
+                    "checkpoints", "blastCache", "prefilterIndexes", "workspaces"]
+
+"""Search backend the baselines were recorded with, every search of the benchmarks uses it unless told otherwise."""
+defaultSearchBackend = "tabular"
+
+"""Values of the JSON literals."""
+jsonLiterals = {"null" : None, "true" : True, "false" : False}
+
+"""Characters that follow a backslash in a JSON string mapped to the characters they stand for, except u."""
+jsonEscapes = {"\"" : "\"", "\\" : "\\", "/" : "/", "b" : "\b", "f" : "\f", "n" : "\n", "r" : "\r", "t" : "\t"}
+
+jsonNumberPattern = re.compile(r"-?\d+(\.\d+)?([eE][-+]?\d+)?")
+jsonSpacePattern = re.compile(r"\s*")
+jsonCharactersPattern = re.compile(r"[^\"\\]*")
+
+"""Arguments of Pipeline.run that aren't locations, the defaults of main.py."""
+eValue = 0.1
+minLength = 100
+scaffoldingDistance = 100
+promoterScoreCutoff = 0
+
+def loadNeofelis():
+  """
+  Imports the modules of the pipeline.  They make the directories they cache results in when they are imported, so this
+  is only done once the working directory is the work directory.
+  """
+  global utils, context, extend, intergenic, scaffolds, signals, promoters, terminators, rna, artemis, report, pipeline, trace
+  from neofelis import utils
+  from neofelis import context
+  from neofelis import extend
+  from neofelis import intergenic
+  from neofelis import scaffolds
+  from neofelis import signals
+  from neofelis import promoters
+  from neofelis import terminators
+  from neofelis import rna
+  from neofelis import artemis
+  from neofelis import report
+  from neofelis import pipeline
+  from neofelis import trace
+
+def usedMemory():
+  """
+  Returns the bytes of the heap of the JVM in use.
+  """
+  runtime = Runtime.getRuntime()
+  return runtime.totalMemory() - runtime.freeMemory()
+
+class MemorySampler(threading.Thread):
+  """
+  Samples the memory in use until it is stopped and keeps the peak.  The garbage collector is run before sampling starts
+  so garbage left by whatever ran before isn't counted.
+  """
+  def __init__(self, interval = 0.01):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.interval = interval
+    self.running = True
+    System.gc()
+    self.baseline = usedMemory()
+    self.peak = self.baseline
+
+  def run(self):
+    while self.running:
+      self.peak = max(self.peak, usedMemory())
+      time.sleep(self.interval)
+
+  def stop(self):
+    """
+    Stops sampling and returns the peak memory used since sampling started, in bytes.
+    """
+    self.running = False
+    self.join()
+    self.peak = max(self.peak, usedMemory())
+    return self.peak - self.baseline
+
+class Measurement():
+  """
+  The measurements of one stage of one genome.
+  """
+  def __init__(self, genome, stage, wallTime, cpuTime, memory = None, result = None):
+    self.genome = genome
+    self.stage = stage
+    self.wallTime = wallTime
+    self.cpuTime = cpuTime
+    self.memory = memory
+    self.result = result
+    #A digest of what the stage found, compared with the baseline, and a summary of it for people.
+    self.digest = None
+    self.summary = ""
+    #ok, CHANGED, or new, how the digest compares with the baseline.
+    self.outcome = ""
+
+  def __str__(self):
+    result = "<"
+    result += "Genome = " + str(self.genome) + ", "
+    result += "Stage = " + str(self.stage) + ", "
+    result += "WallTime = " + str(self.wallTime) + ", "
+    result += "CpuTime = " + str(self.cpuTime) + ", "
+    result += "Memory = " + str(self.memory) + ", "
+    result += "Digest = " + str(self.digest)
+    result += ">"
+    return result
+
+def measure(genome, stage, function, *arguments):
+  """
+  Calls function with arguments and returns a Measurement of the call with its result.
+  """
+  sampler = MemorySampler()
+  sampler.start()
+  start, startCpu = time.time(), trace.threadCpuTime()
+  try:
+    result = function(*arguments)
+  finally:
+    wallTime, cpuTime = time.time() - start, trace.threadCpuTime() - startCpu
+    memory = sampler.stop()
+  return Measurement(genome, stage, wallTime, cpuTime, memory, result)
+
+def digest(values):
+  """
+  Returns a digest of values, a list of tuples of integers and strings, that doesn't depend on their order.
+  """
+  return hashlib.sha1(repr(sorted(values))).hexdigest()[:16]
+
+def geneDigest(measurement, genes):
+  """
+  Sets the digest of measurement to one of genes, Iteration objects, and summarizes them.
+  """
+  measurement.digest = digest([(gene.query, gene.location[0], gene.location[1], gene.numHits) for gene in genes])
+  measurement.summary = "genes=%d hits=%d" % (len(genes), len(filter(lambda x: x.numHits, genes)))
+
+def stubSearch(query, fileName):
+  """
+  Writes the hits of the proteins in the fasta file query to fileName as the blast stub does with tabular output,
+  and returns the file read by utils.TabularBackend.
+  """
+  backend = utils.searchBackends["tabular"]
+  output = open(fileName, "w")
+  tools.writeBlastTabular(output, tools.readFasta(query), "stub", backend.fields.split())
+  output.close()
+  return fileName
+
+def benchmarkStages(name, fileName, scratch):
+  """
+  name:     Name of the genome.
+  fileName: Fasta file of the genome.
+  scratch:  Directory to write files to.
+
+  return:   A list of Measurements, one for each stage that doesn't run an external program.
+
+  The stages are run in the order the pipeline runs them, each on the results of the ones before it.  The searches and
+  predictions of external programs between them are made by the stubs, they aren't measured.
+  """
+  result = []
+  backend = utils.searchBackends["tabular"]
+  def timed(stage, function, *arguments):
+    measurement = measure(name, stage, function, *arguments)
+    result.append(measurement)
+    return measurement
+
+  def load():
+    genome = context.loadContext(fileName, scratch)
+    genome.reverseComplement(), genome.gcContent(), genome.forwardIndex(), genome.reverseIndex()
+    return genome
+  measurement = timed("context", load)
+  genome = measurement.result
+  measurement.digest = digest([(genome.length, hashlib.sha1(genome.reverseComplement()).hexdigest())])
+  measurement.summary = "length=%d" % genome.length
+
+  orfs = tools.findOrfs(genome.genome)
+  proteins = os.path.join(scratch, "orfs.fas")
+  utils.writeProteins(proteins, [(name + "~%d:%d-%d" % (i + 1, orfs[i][0], orfs[i][1]), tools.protein(genome.genome, orfs[i][0], orfs[i][1])) for i in range(len(orfs))])
+  measurement = timed("parse", backend.parse, stubSearch(proteins, os.path.join(scratch, "initial.blastp.tab")))
+  initialGenes = measurement.result
+  geneDigest(measurement, initialGenes.values())
+
+  def findExtensions():
+    extensions = extend.getExtensions(genome.genome, initialGenes.values(), genome.forwardIndex(), genome.reverseIndex())
+    extend.writeExtensions(genome.genome, extensions, os.path.join(scratch, "extensions.fas"))
+    return extensions
+  measurement = timed("extend", findExtensions)
+  measurement.digest = digest([(gene.query, start) for gene, starts in measurement.result.items() for start in starts])
+  measurement.summary = "candidates=%d" % sum(map(len, measurement.result.values()))
+
+  extensionResults = stubSearch(os.path.join(scratch, "extensions.fas"), os.path.join(scratch, "extended.blastp.tab"))
+  measurement = timed("applyExtensions", lambda: extend.applyExtensions(genome.genome, initialGenes, backend.parse(extensionResults)))
+  extendedGenes = measurement.result
+  geneDigest(measurement, extendedGenes.values())
+
+  def findCandidates():
+    forwardRegions, reverseRegions = intergenic.calculateIntergenicRegions(genome.length, extendedGenes.values(), minLength)
+    locations = intergenic.findPotentialGenes(genome.genome, forwardRegions, minLength, genome.forwardIndex())
+    reverseLocations = intergenic.findPotentialGenes(genome.reverseComplement(), reverseRegions, minLength, genome.reverseIndex())
+    locations += map(lambda x: (genome.length-x[0], genome.length-x[1]), reverseLocations)
+    utils.writeProteins(os.path.join(scratch, "intergenics.fas"), intergenic.translatePotentialGenes(genome.genome, locations))
+    return locations
+  measurement = timed("intergenic", findCandidates)
+  measurement.digest = digest(measurement.result)
+  measurement.summary = "candidates=%d" % len(measurement.result)
+
+  intergenicResults = stubSearch(os.path.join(scratch, "intergenics.fas"), os.path.join(scratch, "intergenic.blastp.tab"))
+  def refineIntergenics():
+    genes = backend.parse(intergenicResults)
+    intergenic.alignedStarts(genome.genome, genes)
+    return intergenic.removeCommonStops(genes)
+  measurement = timed("intergenicHits", refineIntergenics)
+  intergenicGenes = measurement.result
+  for gene in intergenicGenes.values():
+    gene.intergenic, gene.note, gene.color = True, "Intergenic", "160 32 240"
+  geneDigest(measurement, intergenicGenes.values())
+
+  genes = dict(extendedGenes.items() + intergenicGenes.items())
+  measurement = timed("scaffolds", scaffolds.refineScaffolds, genes, scaffoldingDistance)
+  scaffolded = measurement.result
+  geneDigest(measurement, scaffolded.values())
+
+  forwardText, reverseText = tools.formatPromoters(genome.genome), tools.formatPromoters(genome.reverseComplement())
+  terminatorText = tools.formatTerminators([tuple(gene.location) for gene in genes.values()])
+  def filterSignals():
+    initialPromoters = promoters.parseBPROM(forwardText) + [promoters.reverseCoordinates(genome.length, x) for x in promoters.parseBPROM(reverseText)]
+    initialPromoters = filter(lambda x: x.score > promoterScoreCutoff, initialPromoters)
+    filtered = signals.filterSignals(scaffolded.values(), initialPromoters + terminators.parseTransterm(terminatorText))
+    return filter(lambda x: isinstance(x, promoters.Promoter), filtered), filter(lambda x: isinstance(x, terminators.Terminator), filtered)
+  measurement = timed("signals", filterSignals)
+  filteredPromoters, filteredTerminators = measurement.result
+  measurement.digest = digest([tuple(x.location) for x in filteredPromoters + filteredTerminators])
+  measurement.summary = "promoters=%d terminators=%d" % (len(filteredPromoters), len(filteredTerminators))
+
+  transferRNAs = [rna.TransferRNA(start, stop, type, antiCodon, cove) for start, stop, type, antiCodon, cove in tools.transferRNAs(genome.genome)]
+  output = os.path.join(scratch, name)
+  def writeReport():
+    artemis.writeArtemisFile(output + ".art", genome.genome, scaffolded.values(), filteredPromoters, filteredTerminators, transferRNAs)
+    report.writeSpreadsheet(scaffolded.values(), output)
+  measurement = timed("report", writeReport)
+  lines = annotationLines(output + ".art")
+  rows = spreadsheetRows(output + ".xls")
+  measurement.digest = digest([tuple(lines), tuple(rows)])
+  measurement.summary = "features=%d rows=%d" % (len(filter(lambda x: not x.startswith(" " * 20), lines)), len(rows))
+  return result
+
+def annotationLines(fileName):
+  """
+  Returns the lines of the features of the artemis file fileName, without their notes, which hold scores.
+  """
+  input = open(fileName, "r")
+  lines = []
+  for line in input:
+    if line.startswith("ORIGIN"):
+      break
+    if line.strip() and "/note=" not in line:
+      lines.append(line.rstrip())
+  input.close()
+  return sorted(lines)
+
+def spreadsheetRows(fileName):
+  """
+  Returns the start, stop, and number of hits of every row of the spreadsheet fileName.
+  """
+  input = open(fileName, "r")
+  rows = [tuple(line.split("\t")[1:4]) for line in input.read().splitlines()[1:]]
+  input.close()
+  return sorted(rows)
+
+def clearCaches():
+  """
+  Empties the directories the pipeline caches results in.
+  """
+  for directory in cacheDirectories:
+    if os.path.isdir(directory):
+      shutil.rmtree(directory)
+    os.mkdir(directory)
+
+def parseString(text, position):
+  """
+  text:     JSON text.
+  position: Index of the opening quote of a string in text.
+
+  return:   A 2-tuple, the string and the index just past its closing quote.
+  """
+  result = []
+  position += 1
+  while True:
+    end = jsonCharactersPattern.match(text, position).end()
+    if end == len(text):
+      raise ValueError("Unterminated string in JSON")
+    result.append(text[position:end])
+    if text[end] == "\"":
+      return "".join(result), end+1
+    escape = text[end+1:end+2]
+    if escape == "u":
+      digits = text[end+2:end+6]
+      if len(digits) != 4:
+        raise ValueError("Incomplete unicode escape at character " + str(end) + " of JSON")
+      result.append(unichr(int(digits, 16)))
+      position = end+6
+    elif escape in jsonEscapes:
+      result.append(jsonEscapes[escape])
+      position = end+2
+    else:
+      raise ValueError("Invalid escape at character " + str(end) + " of JSON")
+
+def parseValue(text, position):
+  """
+  text:     JSON text.
+  position: Index of the start of a value in text.
+
+  return:   A 2-tuple, the value and the index just past it and any space that follows it.
+  """
+  character = text[position:position+1]
+  if character == "{":
+    result = {}
+    position = jsonSpacePattern.match(text, position+1).end()
+    if text[position:position+1] == "}":
+      return result, jsonSpacePattern.match(text, position+1).end()
+    while True:
+      if text[position:position+1] != "\"":
+        raise ValueError("Expected a key at character " + str(position) + " of JSON")
+      key, position = parseString(text, position)
+      position = jsonSpacePattern.match(text, position).end()
+      if text[position:position+1] != ":":
+        raise ValueError("Expected : at character " + str(position) + " of JSON")
+      result[key], position = parseValue(text, jsonSpacePattern.match(text, position+1).end())
+      if text[position:position+1] == "}":
+        return result, jsonSpacePattern.match(text, position+1).end()
+      if text[position:position+1] != ",":
+        raise ValueError("Expected , or } at character " + str(position) + " of JSON")
+      position = jsonSpacePattern.match(text, position+1).end()
+  elif character == "[":
+    result = []
+    position = jsonSpacePattern.match(text, position+1).end()
+    if text[position:position+1] == "]":
+      return result, jsonSpacePattern.match(text, position+1).end()
+    while True:
+      value, position = parseValue(text, position)
+      result.append(value)
+      if text[position:position+1] == "]":
+        return result, jsonSpacePattern.match(text, position+1).end()
+      if text[position:position+1] != ",":
+        raise ValueError("Expected , or ] at character " + str(position) + " of JSON")
+      position = jsonSpacePattern.match(text, position+1).end()
+  elif character == "\"":
+    value, position = parseString(text, position)
+    return value, jsonSpacePattern.match(text, position).end()
+  for literal in jsonLiterals:
+    if text.startswith(literal, position):
+      return jsonLiterals[literal], jsonSpacePattern.match(text, position+len(literal)).end()
+  match = jsonNumberPattern.match(text, position)
+  if not match:
+    raise ValueError("Expected a value at character " + str(position) + " of JSON")
+  if match.group(1) or match.group(2):
+    value = float(match.group())
+  else:
+    value = int(match.group())
+  return value, jsonSpacePattern.match(text, match.end()).end()
+
+def parseJSON(text):
+  """
+  Returns the value of the JSON text, raises a ValueError if text isn't JSON.  Only the JSON the trace writes
+  has to be read, but all of JSON is accepted.
+  """
+  value, position = parseValue(text, jsonSpacePattern.match(text).end())
+  if position != len(text):
+    raise ValueError("Extra data at character " + str(position) + " of JSON")
+  return value
+
+def readTrace(fileName):
+  """
+  Returns the records of the trace fileName as dictionaries.
+  """
+  input = open(fileName, "r")
+  records = [parseJSON(line) for line in input if line.strip()]
+  input.close()
+  return records
+
+def benchmarkPipeline(name, fileName, bpromURL, searchBackend = defaultSearchBackend):
+  """
+  name:          Name of the genome.
+  fileName:      Fasta file of the genome, in the work directory.
+  bpromURL:      Address of the BPROM stand-in.
+  searchBackend: Name of the search backend every search uses, if None then the default of the pipeline is used.
+                 Defaults to the backend the baselines were recorded with.
+
+  return:        A list of Measurements, one for every stage of the pipeline from the trace of the run and a last one
+                 for the whole run with a digest of the artemis file.
+  """
+  clearCaches()
+  traceFile = os.path.join("traces", name + ".jsonl")
+  promoters.bpromURL = bpromURL
+  instance = pipeline.Pipeline()
+  searchBackends = None
+  if searchBackend:
+    searchBackends = {"initial" : searchBackend, "extension" : searchBackend, "intergenic" : searchBackend}
+  measurement = measure(name, "pipeline", instance.run, os.path.join(stubs, "blast"), os.path.join(stubs, "genemark"),
+                        os.path.join(stubs, "transterm"), os.path.join(stubs, "tRNAscan"), os.path.abspath(os.path.join("db", "nr")),
+                        eValue, os.path.join(stubs, "genemark", "stub.mat"), minLength, scaffoldingDistance, promoterScoreCutoff,
+                        [fileName], False, "", None, None, searchBackends, None, None, 1, traceFile)
+  result = []
+  for record in readTrace(traceFile):
+    if record["type"] == "stage" and record["status"] == "finished":
+      result.append(Measurement(name, "pipeline:" + record["stage"], record["wallTime"], record["cpuTime"] + record["toolCpuTime"]))
+      result[-1].summary = " ".join(["%s=%d" % (key, record["counters"][key]) for key in sorted(record["counters"].keys())])
+    elif record["type"] == "run":
+      measurement.cpuTime = record["cpuTime"]
+  lines = annotationLines(os.path.splitext(fileName)[0] + ".art")
+  measurement.digest = digest(lines)
+  features = {}
+  for line in lines:
+    if not line.startswith(" " * 20):
+      features[line.split()[0]] = features.get(line.split()[0], 0) + 1
+  measurement.summary = " ".join(["%s=%d" % (key, features[key]) for key in sorted(features.keys())])
+  return result + [measurement]
+
+def readBaseline(name):
+  """
+  Returns a dictionary that maps the stages of the baseline of the genome name to their digests.
+  """
+  result = {}
+  fileName = os.path.join(baselines, name + ".tsv")
+  if os.path.isfile(fileName):
+    input = open(fileName, "r")
+    for line in input:
+      if line.strip() and not line.startswith("#"):
+        fields = line.rstrip("\n").split("\t")
+        result[fields[0]] = fields[1]
+    input.close()
+  return result
+
+def writeBaseline(name, measurements):
+  """
+  Writes the digests of measurements as the baseline of the genome name, stages of the baseline that weren't measured
+  are kept.
+  """
+  fileName = os.path.join(baselines, name + ".tsv")
+  rows = {}
+  if os.path.isfile(fileName):
+    input = open(fileName, "r")
+    for line in input:
+      if line.strip() and not line.startswith("#"):
+        rows[line.split("\t")[0]] = line.rstrip("\n")
+    input.close()
+  for measurement in measurements:
+    if measurement.digest:
+      rows[measurement.stage] = "\t".join([measurement.stage, measurement.digest, measurement.summary])
+  output = open(fileName, "w")
+  output.write("#stage\tdigest\tsummary\n")
+  for stage in sorted(rows.keys()):
+    output.write(rows[stage] + "\n")
+  output.close()
+
+def compareBaseline(name, measurements):
+  """
+  Sets the outcome of every measurement with a digest, and returns True if any of them changed.
+  """
+  baseline = readBaseline(name)
+  changed = False
+  for measurement in measurements:
+    if not measurement.digest:
+      continue
+    if measurement.stage not in baseline:
+      measurement.outcome = "new"
+    elif baseline[measurement.stage] == measurement.digest:
+      measurement.outcome = "ok"
+    else:
+      measurement.outcome = "CHANGED"
+      changed = True
+  return changed
+
+def fastest(runs):
+  """
+  runs:   A list of lists of Measurements, one list for each repetition.
+
+  return: A list with the fastest Measurement of every stage, in the order of the first run.
+  """
+  result = []
+  for i in range(len(runs[0])):
+    result.append(min([run[i] for run in runs if i < len(run)], key = lambda x: x.wallTime))
+  return result
+
+def readReport(fileName):
+  """
+  Returns a dictionary that maps (genome, stage) to the wall time in a report written by writeReport.
+  """
+  result = {}
+  input = open(fileName, "r")
+  for line in input:
+    if line.strip() and not line.startswith("#"):
+      fields = line.split("\t")
+      result[(fields[0], fields[1])] = float(fields[2])
+  input.close()
+  return result
+
+def writeReport(fileName, measurements):
+  """
+  Writes measurements to fileName, a tab separated line for each.
+  """
+  output = open(fileName, "w")
+  output.write("#genome\tstage\twallTime\tcpuTime\tmemory\tdigest\toutcome\tsummary\n")
+  for m in measurements:
+    output.write("\t".join([m.genome, m.stage, "%.6f" % m.wallTime, "%.6f" % m.cpuTime, "" if m.memory is None else str(m.memory),
+                            m.digest or "", m.outcome, m.summary]) + "\n")
+  output.close()
+
+def printMeasurements(measurements, previous = None):
+  """
+  Prints a line for every measurement, with the change in its wall time since the report previous, see readReport.
+  """
+  print "%-12s %-26s %9s %9s %9s  %-8s %s" % ("genome", "stage", "wall(s)", "cpu(s)", "peak(MB)", "result", "summary")
+  for m in measurements:
+    line = "%-12s %-26s %9.4f %9.4f %9s  %-8s %s" % (m.genome, m.stage, m.wallTime, m.cpuTime,
+                                                      "-" if m.memory is None else "%.1f" % (m.memory/1048576.0), m.outcome or "-", m.summary)
+    if previous and (m.genome, m.stage) in previous and previous[(m.genome, m.stage)] > 0:
+      line += "  (%+.0f%%)" % (100*(m.wallTime/previous[(m.genome, m.stage)] - 1))
+    print line
+
+def setup(work, genomes):
+  """
+  work:    Directory to run the pipeline in, made if it doesn't exist.
+  genomes: List of fasta files of genomes.
+
+  return:  The genomes copied to the work directory.
+
+  Makes work the working directory, copies the genomes to it, and makes the directory of the stub database.
+  """
+  if not os.path.isdir(work):
+    os.makedirs(work)
+  os.chdir(work)
+  for directory in ["genomes", "scratch", "traces", os.path.join("db", "nr")]:
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+  result = []
+  for genome in genomes:
+    result.append(os.path.join(os.path.abspath("genomes"), os.path.basename(genome)))
+    shutil.copyfile(genome, result[-1])
+  loadNeofelis()
+  return result
+
+def benchmark(genomes, work, repeat = 1, stages = True, whole = True, searchBackend = defaultSearchBackend):
+  """
+  genomes:       List of fasta files of genomes.
+  work:          Directory to run the pipeline in.
+  repeat:        Number of times to run everything, the fastest run of each stage is kept.
+  stages:        If true the stages are benchmarked on their own.
+  whole:         If true the whole pipeline is benchmarked.
+  searchBackend: Name of the search backend the pipeline uses, see benchmarkPipeline.
+
+  return:        A list of Measurements of every stage of every genome.
+  """
+  queries = setup(work, genomes)
+  if whole:
+    server, url = bprom.serve()
+  result = []
+  for query in queries:
+    name = os.path.splitext(os.path.basename(query))[0]
+    runs = []
+    for i in range(repeat):
+      run = []
+      if stages:
+        scratch = os.path.abspath(os.path.join("scratch", name))
+        if os.path.isdir(scratch):
+          shutil.rmtree(scratch)
+        os.mkdir(scratch)
+        run += benchmarkStages(name, query, scratch)
+      if whole:
+        run += benchmarkPipeline(name, query, url, searchBackend)
+      runs.append(run)
+    result += fastest(runs)
+  return result
+
+def main(arguments):
+  try:
+    opts, args = getopt.getopt(arguments, "", ["genomes=", "genome=", "work=", "keep", "repeat=", "stages-only", "pipeline-only",
+                                               "search=", "update", "report=", "compare=", "help"])
+  except getopt.GetoptError:
+    print __doc__
+    return 2
+  genomeDirectory, names, work, keep, repeat = os.path.join(root, "genomes"), [], None, False, 1
+  stages, whole, searchBackend, update, reportFile, previous = True, True, defaultSearchBackend, False, None, None
+  for opt, arg in opts:
+    if opt == "--genomes":
+      genomeDirectory = arg
+    elif opt == "--genome":
+      names.append(arg)
+    elif opt == "--work":
+      work = arg
+    elif opt == "--keep":
+      keep = True
+    elif opt == "--repeat":
+      repeat = max(1, int(arg))
+    elif opt == "--stages-only":
+      whole = False
+    elif opt == "--pipeline-only":
+      stages = False
+    elif opt == "--search":
+      searchBackend = arg
+    elif opt == "--update":
+      update = True
+    elif opt == "--report":
+      reportFile = os.path.abspath(arg)
+    elif opt == "--compare":
+      previous = readReport(arg)
+    elif opt == "--help":
+      print __doc__
+      return 0
+
+  genomes = sorted(filter(lambda x: x.endswith(".fas"), os.listdir(genomeDirectory)))
+  if names:
+    genomes = filter(lambda x: os.path.splitext(x)[0] in names, genomes)
+  genomes = [os.path.abspath(os.path.join(genomeDirectory, genome)) for genome in genomes]
+  if not work:
+    work = tempfile.mkdtemp(prefix = "neofelis-benchmarks.")
+  work = os.path.abspath(work)
+
+  start = os.getcwd()
+  try:
+    measurements = benchmark(genomes, work, repeat, stages, whole, searchBackend)
+  finally:
+    os.chdir(start)
+    if not keep:
+      shutil.rmtree(work, True)
+
+  changed = False
+  for genome in genomes:
+    name = os.path.splitext(os.path.basename(genome))[0]
+    genomeMeasurements = filter(lambda x: x.genome == name, measurements)
+    if update:
+      writeBaseline(name, genomeMeasurements)
+    changed = compareBaseline(name, genomeMeasurements) or changed
+  printMeasurements(measurements, previous)
+  if reportFile:
+    writeReport(reportFile, measurements)
+  if changed:
+    print "The results of some stages changed, run with --update if the change is intended."
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
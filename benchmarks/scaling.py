@@ -0,0 +1,225 @@
+"""
+Scaling benchmarks of the pipeline on synthetic genomes, see synthetic.py, from the size of a phage to that of the
+largest bacterial assemblies.  The stages are benchmarked as run.py benchmarks them, and the time of every stage is
+plotted against the size of the genome on log scales in an SVG file.  The slope of each line, the exponent of the
+growth of the stage, is printed, a stage whose time grows like the square of the size has a slope of about two.
+
+Run from the top of the repository with Jython, a heap of a few gigabytes is needed for the largest genomes:
+
+  jython -J-Xmx4g -Dpython.path=src/main/python benchmarks/scaling.py [OPTIONS]
+
+   --sizes LIST     Sizes of the genomes separated by commas, k and M suffixes may be used.  Defaults to
+                    100k,250k,500k,1M,2M,5M,10M,20M.
+   --gc FRACTION    Fraction of the genomes that is G or C.  Defaults to 0.5.
+   --seed N         Seed of the genomes.  Defaults to 1.
+   --genomes DIR    Directory the synthetic genomes are kept in, a genome already there isn't made again.  Defaults to
+                    the work directory.
+   --work DIR       Directory the pipeline is run in.  Defaults to a new temporary directory.
+   --keep           Keep the work directory once the benchmarks are done.
+   --repeat N       Run every stage N times and keep the fastest run.  Defaults to 1.
+   --pipeline       Also run the whole pipeline, with the stubs, on every genome.
+   --plot FILE      SVG file to plot to.  Defaults to scaling.svg.
+   --report FILE    Write the measurements to FILE, as run.py does.
+"""
+
+import os
+import sys
+import math
+import shutil
+import getopt
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import run
+import synthetic
+
+"""Sizes of the genomes benchmarked by default, in base pairs."""
+defaultSizes = [100000, 250000, 500000, 1000000, 2000000, 5000000, 10000000, 20000000]
+
+"""Colours of the lines of the plot, in the order of the stages."""
+colours = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf",
+           "#393b79", "#637939", "#8c6d31", "#843c39", "#7b4173", "#3182bd"]
+
+"""Slope above which the growth of a stage is flagged as faster than linear."""
+superlinear = 1.3
+
+def slope(points):
+  """
+  points: A list of 2-tuples, the size of a genome and the time a stage took on it.
+
+  return: The slope of the least squares line through the points on log scales, or None if there are fewer than two
+          points with a time.
+  """
+  points = [(math.log(size), math.log(time)) for size, time in points if time > 0]
+  if len(points) < 2:
+    return None
+  meanX = sum([x for x, y in points])/len(points)
+  meanY = sum([y for x, y in points])/len(points)
+  spread = sum([(x - meanX)**2 for x, y in points])
+  if spread == 0:
+    return None
+  return sum([(x - meanX)*(y - meanY) for x, y in points])/spread
+
+def series(measurements, sizes):
+  """
+  measurements: A list of run.Measurements.
+  sizes:        A dictionary that maps the names of the genomes to their sizes.
+
+  return:       A list of 2-tuples, the name of every stage, in the order they were run, and a list of 2-tuples of the
+                size of every genome and the wall time of the stage on it, sorted by size.
+  """
+  stages, points = [], {}
+  for measurement in measurements:
+    if measurement.stage not in points:
+      stages.append(measurement.stage)
+      points[measurement.stage] = []
+    points[measurement.stage].append((sizes[measurement.genome], measurement.wallTime))
+  return [(stage, sorted(points[stage])) for stage in stages]
+
+def escape(text):
+  """
+  Returns text with the characters XML reserves replaced by entities.
+  """
+  return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def writePlot(fileName, lines, width = 900, height = 560):
+  """
+  fileName: Name of the SVG file to write.
+  lines:    A list of 2-tuples, the name of a stage and its points as returned by series.
+  width:    Width of the plot in pixels.
+  height:   Height of the plot in pixels.
+
+  Plots the time of every stage against the size of the genome on log scales, with a line for each stage and a legend
+  of the stages with their slopes.  Times of zero can't be plotted and are left out.
+  """
+  points = [point for stage, stagePoints in lines for point in stagePoints if point[1] > 0]
+  if not points:
+    return
+  left, right, top, bottom = 70, 260, 30, 50
+  lowX = 10**math.floor(math.log10(min([x for x, y in points])))
+  highX = 10**math.ceil(math.log10(max([x for x, y in points])))
+  lowY = 10**math.floor(math.log10(min([y for x, y in points])))
+  highY = 10**math.ceil(math.log10(max([y for x, y in points])))
+  highX, highY = max(highX, lowX*10), max(highY, lowY*10)
+  def plotX(x):
+    return left + (width - left - right)*(math.log10(x) - math.log10(lowX))/(math.log10(highX) - math.log10(lowX))
+  def plotY(y):
+    return height - bottom - (height - top - bottom)*(math.log10(y) - math.log10(lowY))/(math.log10(highY) - math.log10(lowY))
+
+  output = open(fileName, "w")
+  output.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
+  output.write("<svg xmlns=\"http://www.w3.org/2000/svg\" width=\"%d\" height=\"%d\" font-family=\"sans-serif\" font-size=\"12\">\n" % (width, height))
+  output.write("<rect width=\"%d\" height=\"%d\" fill=\"white\"/>\n" % (width, height))
+  decade = lowX
+  while decade <= highX:
+    output.write("<line x1=\"%.1f\" y1=\"%d\" x2=\"%.1f\" y2=\"%d\" stroke=\"#dddddd\"/>\n" % (plotX(decade), top, plotX(decade), height - bottom))
+    output.write("<text x=\"%.1f\" y=\"%d\" text-anchor=\"middle\">%s</text>\n" % (plotX(decade), height - bottom + 16, synthetic.formatLength(int(decade))))
+    decade *= 10
+  decade = lowY
+  while decade <= highY*1.0001:
+    output.write("<line x1=\"%d\" y1=\"%.1f\" x2=\"%d\" y2=\"%.1f\" stroke=\"#dddddd\"/>\n" % (left, plotY(decade), width - right, plotY(decade)))
+    output.write("<text x=\"%d\" y=\"%.1f\" text-anchor=\"end\">%gs</text>\n" % (left - 6, plotY(decade) + 4, decade))
+    decade *= 10
+  output.write("<rect x=\"%d\" y=\"%d\" width=\"%d\" height=\"%d\" fill=\"none\" stroke=\"black\"/>\n" % (left, top, width - left - right, height - top - bottom))
+  output.write("<text x=\"%.1f\" y=\"%d\" text-anchor=\"middle\">Genome size (bp)</text>\n" % ((left + width - right)/2.0, height - 12))
+  output.write("<text x=\"16\" y=\"%.1f\" text-anchor=\"middle\" transform=\"rotate(-90 16 %.1f)\">Wall time</text>\n" % ((top + height - bottom)/2.0, (top + height - bottom)/2.0))
+
+  for i in range(len(lines)):
+    stage, stagePoints = lines[i]
+    colour = colours[i % len(colours)]
+    plotted = [(plotX(x), plotY(y)) for x, y in stagePoints if y > 0]
+    if plotted:
+      output.write("<polyline fill=\"none\" stroke=\"%s\" stroke-width=\"2\" points=\"%s\"/>\n" % (colour, " ".join(["%.1f,%.1f" % point for point in plotted])))
+      for point in plotted:
+        output.write("<circle cx=\"%.1f\" cy=\"%.1f\" r=\"3\" fill=\"%s\"/>\n" % (point[0], point[1], colour))
+    stageSlope = slope(stagePoints)
+    label = escape(stage) + ("" if stageSlope is None else " (slope %.2f)" % stageSlope)
+    output.write("<line x1=\"%d\" y1=\"%d\" x2=\"%d\" y2=\"%d\" stroke=\"%s\" stroke-width=\"2\"/>\n" % (width - right + 15, top + 10 + 18*i, width - right + 35, top + 10 + 18*i, colour))
+    output.write("<text x=\"%d\" y=\"%d\">%s</text>\n" % (width - right + 40, top + 14 + 18*i, label))
+  output.write("</svg>\n")
+  output.close()
+
+def printSeries(lines):
+  """
+  Prints the time of every stage on every genome and the slope of the stage.
+  """
+  sizes = sorted(dict([(size, True) for stage, points in lines for size, time in points]).keys())
+  print "%-26s" % "stage" + "".join(["%10s" % synthetic.formatLength(size) for size in sizes]) + "%8s" % "slope"
+  for stage, points in lines:
+    times = dict(points)
+    line = "%-26s" % stage + "".join(["%10.3f" % times[size] if size in times else "%10s" % "-" for size in sizes])
+    stageSlope = slope(points)
+    if stageSlope is None:
+      line += "%8s" % "-"
+    else:
+      line += "%8.2f" % stageSlope
+      if stageSlope > superlinear:
+        line += "  faster than linear"
+    print line
+
+def main(arguments):
+  try:
+    opts, args = getopt.getopt(arguments, "", ["sizes=", "gc=", "seed=", "genomes=", "work=", "keep", "repeat=", "pipeline",
+                                               "plot=", "report=", "help"])
+  except getopt.GetoptError:
+    print __doc__
+    return 2
+  sizes, gc, seed, genomes, work, keep, repeat, whole = defaultSizes, 0.5, 1, None, None, False, 1, False
+  plotFile, reportFile = "scaling.svg", None
+  for opt, arg in opts:
+    if opt == "--sizes":
+      sizes = map(synthetic.parseLength, arg.split(","))
+    elif opt == "--gc":
+      gc = float(arg)
+    elif opt == "--seed":
+      seed = int(arg)
+    elif opt == "--genomes":
+      genomes = arg
+    elif opt == "--work":
+      work = arg
+    elif opt == "--keep":
+      keep = True
+    elif opt == "--repeat":
+      repeat = max(1, int(arg))
+    elif opt == "--pipeline":
+      whole = True
+    elif opt == "--plot":
+      plotFile = arg
+    elif opt == "--report":
+      reportFile = arg
+    elif opt == "--help":
+      print __doc__
+      return 0
+  plotFile = os.path.abspath(plotFile)
+  if reportFile:
+    reportFile = os.path.abspath(reportFile)
+  if not work:
+    work = tempfile.mkdtemp(prefix = "neofelis-scaling.")
+  work = os.path.abspath(work)
+  genomes = os.path.abspath(genomes or os.path.join(work, "synthetic"))
+  if not os.path.isdir(genomes):
+    os.makedirs(genomes)
+
+  start = os.getcwd()
+  try:
+    fileNames, names = [], {}
+    for size in sorted(sizes):
+      print "Making a synthetic genome of", synthetic.formatLength(size), "base pairs"
+      fileNames.append(synthetic.writeGenome(genomes, size, gc, seed))
+      names[synthetic.genomeName(size, gc, seed)] = size
+    measurements = run.benchmark(fileNames, work, repeat, True, whole)
+  finally:
+    os.chdir(start)
+    if not keep:
+      shutil.rmtree(work, True)
+
+  lines = series(measurements, names)
+  printSeries(lines)
+  writePlot(plotFile, lines)
+  print "Plotted to", plotFile
+  if reportFile:
+    run.writeReport(reportFile, measurements)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
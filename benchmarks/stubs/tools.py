@@ -0,0 +1,372 @@
+"""
+Deterministic stand-ins for the predictions of the programs the pipeline runs, shared by the stub executables, the BPROM
+stand-in, and the benchmarks of single stages.  Every prediction is a function of the sequence it is made for alone, so a
+benchmark finds the same genes, hits, and signals on every run and every machine.
+
+The stubs are run with whatever python is on the PATH and the benchmarks with Jython 2.5, so this module only uses syntax
+that both python 2.5 and python 3 understand.
+"""
+
+import re
+import bisect
+import hashlib
+
+"""Start and stop codons."""
+startCodons = ("ATG", "GTG", "TTG")
+stopCodons = ("TAA", "TAG", "TGA")
+
+complements = {"A" : "T", "T" : "A", "C" : "G", "G" : "C"}
+
+bases = "TCAG"
+codonTable = dict(zip([a + b + c for a in bases for b in bases for c in bases],
+                      "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"))
+
+"""Amino acids, in an order used to make proteins from numbers."""
+aminoAcids = "ACDEFGHIKLMNPQRSTVWY"
+
+"""Three letter names of the amino acids, used as the types of transfer RNAs."""
+aminoAcidNames = {"A" : "Ala", "R" : "Arg", "N" : "Asn", "D" : "Asp", "C" : "Cys", "Q" : "Gln", "E" : "Glu", "G" : "Gly",
+                  "H" : "His", "I" : "Ile", "L" : "Leu", "K" : "Lys", "M" : "Met", "F" : "Phe", "P" : "Pro", "S" : "Ser",
+                  "T" : "Thr", "W" : "Trp", "Y" : "Tyr", "V" : "Val", "*" : "Sup"}
+
+"""Shortest open reading frame, in base pairs, the genemark stub predicts as a gene."""
+minimumOrf = 300
+
+"""Most base pairs two genes predicted by the genemark stub may overlap by."""
+maximumOverlap = 60
+
+"""Expected values the blast stub gives hits, the first is the best."""
+hitEValues = (1e-80, 1e-40, 1e-20, 1e-10, 1e-5, 0.001, 0.05)
+
+"""T loop of transfer RNAs, the tRNAscan stub predicts a transfer RNA around every one."""
+tLoop = "GTTCGAATC"
+
+def parseArguments(arguments):
+  """
+  Returns a dictionary that maps every option in the list arguments to the argument after it, or to None if the option
+  is a flag followed by another option.
+  """
+  result = {}
+  for i in range(len(arguments)):
+    if arguments[i].startswith("-"):
+      if i + 1 < len(arguments) and not arguments[i+1].startswith("-"):
+        result[arguments[i]] = arguments[i+1]
+      else:
+        result[arguments[i]] = None
+  return result
+
+def readFasta(fileName):
+  """
+  Returns a list of 2-tuples, the header and sequence of every record in the fasta file fileName.
+  """
+  records, header, chunks = [], None, []
+  input = open(fileName, "r")
+  for line in input:
+    line = line.strip()
+    if line.startswith(">"):
+      if header is not None:
+        records.append((header, "".join(chunks)))
+      header, chunks = line[1:].strip(), []
+    elif line:
+      chunks.append(line.upper())
+  input.close()
+  if header is not None:
+    records.append((header, "".join(chunks)))
+  return records
+
+def writeFasta(output, header, sequence):
+  """
+  Writes a record to the file object output with 50 residues on each line.
+  """
+  output.write(">" + header + "\n")
+  for i in range(0, len(sequence), 50):
+    output.write(sequence[i:i+50] + "\n")
+
+def readGenome(fileName):
+  """
+  Returns the sequences of every record in the fasta file fileName joined together.
+  """
+  return "".join([sequence for header, sequence in readFasta(fileName)])
+
+def reverseComplement(sequence):
+  """
+  Returns the reverse complement of sequence, anything but A, C, G, and T becomes N.
+  """
+  result = [complements.get(base, "N") for base in sequence]
+  result.reverse()
+  return "".join(result)
+
+def translate(sequence):
+  """
+  Returns the translation of sequence, codons that aren't in the codon table become X.
+  """
+  return "".join([codonTable.get(sequence[i:i+3], "X") for i in range(0, len(sequence) - len(sequence) % 3, 3)])
+
+def score(text):
+  """
+  Returns a number from 0 to 2**32-1 that only depends on text.
+  """
+  return int(hashlib.sha1(text.encode("ascii")).hexdigest()[:8], 16)
+
+def codonPositions(sequence, codons):
+  """
+  Returns three sorted lists, the positions of codons in sequence in each frame.
+  """
+  frames = ([], [], [])
+  pattern = re.compile("(?=(" + "|".join(codons) + "))")
+  for match in pattern.finditer(sequence):
+    frames[match.start() % 3].append(match.start())
+  return frames
+
+def strandOrfs(sequence, minimum):
+  """
+  Returns a list of 2-tuples, the string coordinates of an open reading frame ending at every stop codon of sequence,
+  from the start of a start codon to the end of the stop codon, that are at least minimum base pairs long.  Like
+  genemark, the first start codon after the previous stop isn't always the one chosen, one of the first three is
+  chosen by the score of the stop's position, as long as the frame stays long enough, so some genes can be extended.
+  """
+  starts, stops = codonPositions(sequence, startCodons), codonPositions(sequence, stopCodons)
+  result = []
+  for frame in range(3):
+    previous = frame - 3
+    for stop in stops[frame]:
+      first = bisect.bisect_right(starts[frame], previous)
+      last = bisect.bisect_left(starts[frame], stop)
+      if first < last and stop + 3 - starts[frame][first] >= minimum:
+        index = first + score(str(stop)) % min(3, last - first)
+        if stop + 3 - starts[frame][index] < minimum:
+          index = first
+        result.append((starts[frame][index], stop + 3))
+      previous = stop
+  return result
+
+def findOrfs(genome, minimum = minimumOrf, overlap = maximumOverlap):
+  """
+  genome:  The genome as a string.
+  minimum: Shortest open reading frame to predict as a gene.
+  overlap: Most base pairs two predicted genes may overlap by.
+
+  return:  A list of 2-tuples, the start and stop of each predicted gene in the coordinates genemark uses, the first
+           base pair is one, both ends are included, and the start of a gene on the reverse strand is greater than its stop.
+
+  The open reading frames on both strands are taken longest first, and one is kept if it doesn't overlap any kept
+  frame by more than overlap base pairs.  The genes are returned in the order they occur on the genome.
+  """
+  candidates = [(start + 1, stop) for start, stop in strandOrfs(genome, minimum)]
+  candidates += [(len(genome) - start, len(genome) - stop + 1) for start, stop in strandOrfs(reverseComplement(genome), minimum)]
+  candidates.sort(key = lambda x: (-abs(x[1] - x[0]), min(x)))
+  kept, lows, highs = [], [], []
+  for candidate in candidates:
+    low, high = min(candidate), max(candidate)
+    index = bisect.bisect_left(lows, low)
+    clear = True
+    for neighbour in range(max(0, index - 1), len(lows)):
+      if lows[neighbour] > high:
+        break
+      if min(high, highs[neighbour]) - max(low, lows[neighbour]) + 1 > overlap:
+        clear = False
+        break
+    if clear:
+      lows.insert(index, low)
+      highs.insert(index, high)
+      kept.insert(index, candidate)
+  return kept
+
+def writeOrfs(output, genome, orfs):
+  """
+  Writes the translations of orfs, genes of genome as returned by findOrfs, to the file object output in the format
+  of the .orf files of genemark.
+  """
+  for i in range(len(orfs)):
+    start, stop = orfs[i]
+    translation = protein(genome, start, stop)
+    writeFasta(output, "orf_%d|GeneMark stub|%d aa, %d - %d" % (i + 1, len(translation), start, stop), translation)
+
+def writeOrfList(output, orfs):
+  """
+  Writes orfs, genes as returned by findOrfs, to the file object output in the format of the .lst files of genemark.
+  """
+  output.write("GeneMark stub, predicted genes\n\n   Gene    Strand    LeftEnd    RightEnd       Gene     Class\n")
+  for i in range(len(orfs)):
+    start, stop = orfs[i]
+    output.write("%7d %9s %10d %11d %10d %9d\n" % (i + 1, "direct" if start < stop else "complement", min(start, stop), max(start, stop), abs(stop - start) + 1, 1))
+
+def hits(protein):
+  """
+  protein: A protein sequence.
+
+  return:  A list of hits for the protein, best first, each a tuple of the id, definition, e value, bit score,
+           identity, alignment length, and the position the alignment starts at in the protein.
+  """
+  value = score(protein)
+  result = []
+  for i in range(value % 4):
+    subject = score(protein + str(i)) % 100000000
+    eValue = hitEValues[min(len(hitEValues) - 1, (value >> 8) % 4 + i)]
+    length = max(10, len(protein) - (value >> 12) % 30)
+    queryFrom = 1 + (value >> 20) % min(30, max(1, len(protein) // 4))
+    result.append(("gi|%d|ref|YP_%08d.1|" % (subject, subject), "hypothetical protein %d [Stub phage %d]" % (subject % 1000, subject % 7),
+                   eValue, float(200 - 20 * i), length - i, length, queryFrom))
+  return result
+
+def protein(genome, start, stop):
+  """
+  Returns the translation of the gene from start to stop, in the coordinates returned by findOrfs, without its stop codon.
+  """
+  if start < stop:
+    return translate(genome[start-1:stop]).rstrip("*")
+  return translate(reverseComplement(genome[stop-1:start])).rstrip("*")
+
+def escape(text):
+  """
+  Returns text with the characters XML reserves replaced by entities.
+  """
+  for character, entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ("\"", "&quot;")):
+    text = text.replace(character, entity)
+  return text
+
+def writeBlastXML(output, records, database):
+  """
+  output:   A file object.
+  records:  A list of 2-tuples, the header and sequence of every query.
+  database: Name of the database searched.
+
+  Writes the hits of every query to output as blast XML, blastp -outfmt 5.
+  """
+  output.write("<?xml version=\"1.0\"?>\n<!DOCTYPE BlastOutput PUBLIC \"-//NCBI//NCBI BlastOutput/EN\" \"NCBI_BlastOutput.dtd\">\n")
+  output.write("<BlastOutput>\n  <BlastOutput_program>blastp</BlastOutput_program>\n  <BlastOutput_version>BLASTP stub</BlastOutput_version>\n")
+  output.write("  <BlastOutput_db>%s</BlastOutput_db>\n  <BlastOutput_iterations>\n" % escape(database))
+  for i in range(len(records)):
+    header, sequence = records[i]
+    output.write("    <Iteration>\n      <Iteration_iter-num>%d</Iteration_iter-num>\n      <Iteration_query-ID>Query_%d</Iteration_query-ID>\n" % (i + 1, i + 1))
+    output.write("      <Iteration_query-def>%s</Iteration_query-def>\n      <Iteration_query-len>%d</Iteration_query-len>\n      <Iteration_hits>\n" % (escape(header), len(sequence)))
+    found = hits(sequence)
+    for j in range(len(found)):
+      id, definition, eValue, bitScore, identity, length, queryFrom = found[j]
+      output.write("        <Hit>\n          <Hit_num>%d</Hit_num>\n          <Hit_id>%s</Hit_id>\n          <Hit_def>%s</Hit_def>\n" % (j + 1, escape(id), escape(definition)))
+      output.write("          <Hit_accession>%s</Hit_accession>\n          <Hit_len>%d</Hit_len>\n          <Hit_hsps>\n            <Hsp>\n" % (id.split("|")[3], length))
+      output.write("              <Hsp_num>1</Hsp_num>\n              <Hsp_bit-score>%.1f</Hsp_bit-score>\n              <Hsp_evalue>%g</Hsp_evalue>\n" % (bitScore, eValue))
+      aligned = sequence[queryFrom-1:queryFrom-1+length]
+      output.write("              <Hsp_query-from>%d</Hsp_query-from>\n              <Hsp_query-to>%d</Hsp_query-to>\n" % (queryFrom, queryFrom + len(aligned) - 1))
+      output.write("              <Hsp_identity>%d</Hsp_identity>\n              <Hsp_align-len>%d</Hsp_align-len>\n" % (identity, length))
+      output.write("              <Hsp_qseq>%s</Hsp_qseq>\n              <Hsp_hseq>%s</Hsp_hseq>\n              <Hsp_midline>%s</Hsp_midline>\n" % (aligned, aligned, aligned))
+      output.write("            </Hsp>\n          </Hit_hsps>\n        </Hit>\n")
+    output.write("      </Iteration_hits>\n")
+    if not found:
+      output.write("      <Iteration_message>No hits found</Iteration_message>\n")
+    output.write("    </Iteration>\n")
+  output.write("  </BlastOutput_iterations>\n</BlastOutput>\n")
+
+def writeBlastTabular(output, records, database, fields):
+  """
+  output:   A file object.
+  records:  A list of 2-tuples, the header and sequence of every query.
+  database: Name of the database searched.
+  fields:   List of the names of the fields, the ones utils.TabularBackend asks for.
+
+  Writes the hits of every query to output as commented tabular output, blastp -outfmt 7.
+  """
+  for header, sequence in records:
+    found = hits(sequence)
+    output.write("# BLASTP stub\n# Query: %s\n# Database: %s\n" % (header, database))
+    if found:
+      output.write("# Fields: %s\n" % ", ".join(fields))
+    output.write("# %d hits found\n" % len(found))
+    for id, definition, eValue, bitScore, identity, length, queryFrom in found:
+      output.write("\t".join([header.split()[0], id, "%g" % eValue, "%.1f" % bitScore, str(identity), str(length), str(queryFrom), definition]) + "\n")
+  output.write("# BLAST processed %d queries\n" % len(records))
+
+def terminators(genes):
+  """
+  genes:  A list of 2-tuples, the start and stop of genes.
+
+  return: A list of terminators, each a tuple of the start, end, strand, confidence, hairpin score, and tail score.
+          One in three genes has a terminator 15 to 45 base pairs past its stop.
+  """
+  result = []
+  for start, stop in genes:
+    value = score("%d-%d" % (start, stop))
+    if value % 3:
+      continue
+    if start < stop:
+      result.append((stop + 15, stop + 45, "+", 60 + value % 40, -5.0 - (value >> 4) % 15, -3.0 - (value >> 8) % 4))
+    else:
+      result.append((stop - 15, stop - 45, "-", 60 + value % 40, -5.0 - (value >> 4) % 15, -3.0 - (value >> 8) % 4))
+  return result
+
+def formatTerminators(genes):
+  """
+  Returns the terminators of genes in the text format of transterm.
+  """
+  lines = ["TransTermHP stub", ""]
+  found = terminators(genes)
+  for i in range(len(found)):
+    start, end, strand, confidence, hairpin, tail = found[i]
+    lines.append("  TERM %-4d %8d - %-8d %s F %3d %5.1f %5.1f | stub" % (i + 1, start, end, strand, confidence, hairpin, tail))
+  return "\n".join(lines) + "\n"
+
+def transferRNAs(genome):
+  """
+  Returns a list of transfer RNAs, each a tuple of the start, end, type, anticodon, and cove score.  A transfer RNA is
+  predicted around every T loop in either strand.
+  """
+  result = []
+  for strand, sequence in ((1, genome), (-1, reverseComplement(genome))):
+    for match in re.finditer(tLoop, sequence):
+      begin = match.start() - 50
+      if begin < 0 or match.end() + 20 > len(sequence):
+        continue
+      anticodon = sequence[begin+33:begin+36]
+      aminoAcid = aminoAcidNames.get(codonTable.get(reverseComplement(anticodon), "*"), "Sup")
+      cove = 20 + score(sequence[begin:match.end() + 20]) % 7000 / 100.0
+      if strand == 1:
+        result.append((begin + 1, match.end() + 20, aminoAcid, anticodon, cove))
+      else:
+        result.append((len(genome) - begin, len(genome) - match.end() - 19, aminoAcid, anticodon, cove))
+  return result
+
+def formatTransferRNAs(name, genome):
+  """
+  Returns the transfer RNAs of genome, named name, in the tabular format of tRNAscan-SE.
+  """
+  lines = ["Sequence\t\ttRNA \tBounds\ttRNA\tAnti\tIntron Bounds\tCove",
+           "Name    \ttRNA #\tBegin\tEnd  \tType\tCodon\tBegin\tEnd\tScore",
+           "--------\t------\t---- \t------\t----\t-----\t-----\t----\t------"]
+  found = transferRNAs(genome)
+  for i in range(len(found)):
+    start, end, type, anticodon, cove = found[i]
+    lines.append("%s\t%d\t%d\t%d\t%s\t%s\t0\t0\t%.2f" % (name, i + 1, start, end, type, anticodon, cove))
+  return "\n".join(lines) + "\n"
+
+def promoters(sequence):
+  """
+  Returns a list of promoters on the forward strand of sequence, each a tuple of the position, score, -10 box position,
+  -10 box, -35 box position, and -35 box.  A promoter is predicted at every -10 box, TA.A[AT]T, that has a TTG 16 to 22
+  base pairs before it.
+  """
+  result = []
+  for match in re.finditer("(?=(TA[ACGT]A[AT]T))", sequence):
+    tenBox = match.start()
+    upstream = sequence[max(0, tenBox - 22):max(0, tenBox - 13)]
+    if "TTG" not in upstream:
+      continue
+    thirtyFiveBox = max(0, tenBox - 22) + upstream.index("TTG")
+    value = score(sequence[thirtyFiveBox:tenBox + 6])
+    result.append((tenBox + 15, 0.2 + value % 1200 / 100.0, tenBox + 1, sequence[tenBox:tenBox+9],
+                   thirtyFiveBox + 1, sequence[thirtyFiveBox:thirtyFiveBox+6]))
+  return result
+
+def formatPromoters(sequence):
+  """
+  Returns the promoters of sequence in the text format of BPROM.
+  """
+  found = promoters(sequence)
+  lines = ["stub sequence",
+           " Length of sequence-  %8d" % len(sequence),
+           " Threshold for promoters -  0.20",
+           " Number of predicted promoters -  %5d" % len(found)]
+  for position, value, tenPosition, tenBox, thirtyFivePosition, thirtyFiveBox in found:
+    lines.append(" Promoter Pos: %6d LDF- %5.2f" % (position, value))
+    lines.append(" -10 box at pos. %6d %s Score %5d" % (tenPosition, tenBox, score(tenBox) % 100))
+    lines.append(" -35 box at pos. %6d %s    Score %5d" % (thirtyFivePosition, thirtyFiveBox, score(thirtyFiveBox) % 100))
+  return "\n".join(lines) + "\n"
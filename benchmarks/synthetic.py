@@ -0,0 +1,266 @@
+"""
+Generates synthetic genomes of any size and gc content for the scaling benchmarks, see scaling.py.  The sample genomes
+are phages of 150 kb or less, too small for the cost of stages that grow faster than the genome to show.
+
+A synthetic genome is laid out like a bacterial chromosome.  Genes of about a thousand base pairs, with the length
+distribution of bacterial genes, are placed on both strands in runs that share a strand, separated by short intergenic
+spacers, so about nine tenths of the genome codes for proteins.  Some spacers hold a promoter in front of the next gene
+and about one in every hundred kilobases holds the T loop of a transfer RNA.  The bases are drawn so the genome has the
+gc content asked for.  The stubs in stubs/ then find the genes, hits, terminators, and transfer RNAs a real assembly
+would have about as many of.
+
+Run with python or Jython 2.5:
+
+  python synthetic.py [OPTIONS] DIRECTORY
+
+   --length N      Length of the genome in base pairs, k and M suffixes may be used.  Defaults to 1M.
+   --gc FRACTION   Fraction of the genome that is G or C.  Defaults to 0.5.
+   --seed N        Seed of the random numbers, the same seed makes the same genome.  Defaults to 1.
+   --outputs       Also write what the stub programs output for the genome: the .orf and .lst files of genemark, the
+                   blast XML of the genes, and the output of transterm and tRNAscan-SE.
+
+The genome is written to DIRECTORY/NAME.fas, see genomeName.
+"""
+
+import os
+import sys
+import bisect
+import random
+import getopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs"))
+import tools
+
+"""Start codons of the genes and how often each is used, as in Escherichia coli."""
+geneStarts = (("ATG", 0.90), ("GTG", 0.08), ("TTG", 0.02))
+
+"""Stop codons of the genes and how often each is used."""
+geneStops = (("TAA", 0.63), ("TGA", 0.29), ("TAG", 0.08))
+
+"""Shape and scale, in codons, of the gamma distribution of the lengths of genes, a mean of about 320 codons."""
+geneShape = 2.5
+geneScale = 128
+
+"""Shortest and longest genes, in codons."""
+shortestGene = 80
+longestGene = 5000
+
+"""Chance that the next gene is on the other strand, genes come in runs on the same strand like operons."""
+strandSwitch = 0.3
+
+"""Chance that a spacer is short, shorter spacers are within operons, and the ranges of the lengths of both kinds."""
+shortSpacer = 0.4
+shortSpacers = (0, 40)
+longSpacers = (40, 300)
+
+"""Chance a long spacer holds a promoter for the next gene, and the boxes of the promoter."""
+promoterChance = 0.3
+promoterBoxes = ("TTGACA", "TATAAT")
+
+"""Base pairs between transfer RNAs."""
+transferRNASpacing = 100000
+
+def parseLength(text):
+  """
+  Returns the number of base pairs written in text, which may end with k or M.
+  """
+  text = text.strip()
+  if text[-1] in "kK":
+    return int(float(text[:-1])*1000)
+  if text[-1] in "mM":
+    return int(float(text[:-1])*1000000)
+  return int(text)
+
+def formatLength(length):
+  """
+  Returns length, in base pairs, as short as it can be written with parseLength.
+  """
+  if length % 1000000 == 0:
+    return "%dM" % (length//1000000)
+  if length % 1000 == 0:
+    return "%dk" % (length//1000)
+  return str(length)
+
+def genomeName(length, gc, seed):
+  """
+  Returns the name of the synthetic genome made with length, gc, and seed.
+  """
+  return "synthetic-%s-gc%d-seed%d" % (formatLength(length), int(round(gc*100)), seed)
+
+class Sampler():
+  """
+  Draws strings from a fixed list of choices with fixed weights.
+  """
+  def __init__(self, random, choices):
+    """
+    random:  A random.Random.
+    choices: A list of 2-tuples, a string and its weight.
+    """
+    self.random = random
+    self.choices = [choice for choice, weight in choices]
+    self.bounds = []
+    total = 0.0
+    for choice, weight in choices:
+      total += weight
+      self.bounds.append(total)
+    self.total = total
+
+  def draw(self):
+    """
+    Returns one of the choices.
+    """
+    return self.choices[min(len(self.choices) - 1, bisect.bisect_right(self.bounds, self.random.random()*self.total))]
+
+  def sequence(self, count):
+    """
+    Returns count choices joined together.
+    """
+    return "".join([self.draw() for i in range(count)])
+
+def baseWeights(gc):
+  """
+  Returns a dictionary that maps every base to how often it occurs in a genome whose gc content is gc.
+  """
+  return {"A" : (1 - gc)/2, "T" : (1 - gc)/2, "C" : gc/2, "G" : gc/2}
+
+def codonChoices(gc, exclude = ()):
+  """
+  Returns a list of 2-tuples, every codon but the ones in exclude and how often it occurs by chance in a genome whose
+  gc content is gc.
+  """
+  weights = baseWeights(gc)
+  return [(codon, weights[codon[0]]*weights[codon[1]]*weights[codon[2]]) for codon in sorted(tools.codonTable.keys()) if codon not in exclude]
+
+def generate(length, gc = 0.5, seed = 1):
+  """
+  length: Length of the genome in base pairs.
+  gc:     Fraction of the genome that is G or C.
+  seed:   Seed of the random numbers.
+
+  return: A 2-tuple, the genome as a string and a list of the genes placed in it, each a 2-tuple of the start and
+          stop in the coordinates genemark uses, see tools.findOrfs.
+
+  The genome is made by placing genes, spacers, promoters, and transfer RNAs one after another until it is long
+  enough, then it is cut to length.  A gene cut by the end of the genome isn't returned.
+  """
+  generator = random.Random(seed)
+  #Intergenic bases are drawn three at a time, drawing codons is the slow part of making a large genome.
+  intergenic = Sampler(generator, codonChoices(gc))
+  body = Sampler(generator, codonChoices(gc, tools.stopCodons))
+  starts, stops = Sampler(generator, geneStarts), Sampler(generator, geneStops)
+  pieces, genes = [], []
+  position, forward, nextTransferRNA = 0, True, transferRNASpacing//2
+
+  def spacer(count):
+    return intergenic.sequence(count//3 + 1)[:count]
+
+  #randint draws differently in python 2 and 3, only random is used so a seed makes the same genome in either.
+  def between(low, high):
+    return low + int(generator.random()*(high - low + 1))
+
+  while position < length:
+    if generator.random() < strandSwitch:
+      forward = not forward
+    promoter = ""
+    if generator.random() < shortSpacer:
+      gap = spacer(between(*shortSpacers))
+    else:
+      gap = spacer(between(*longSpacers))
+      if position >= nextTransferRNA:
+        gap = spacer(50) + tools.tLoop + spacer(21) + gap
+        nextTransferRNA += transferRNASpacing
+      if generator.random() < promoterChance:
+        promoter = promoterBoxes[0] + spacer(17) + promoterBoxes[1] + spacer(8)
+    codons = max(shortestGene, min(longestGene, int(generator.gammavariate(geneShape, geneScale))))
+    gene = starts.draw() + body.sequence(codons - 2) + stops.draw()
+
+    #A promoter is upstream of its gene, after the gene on the forward strand if the gene is on the reverse strand.
+    if forward:
+      pieces.extend([gap, promoter, gene])
+      position += len(gap) + len(promoter)
+      genes.append((position + 1, position + len(gene)))
+      position += len(gene)
+    else:
+      pieces.extend([gap, tools.reverseComplement(gene), tools.reverseComplement(promoter)])
+      position += len(gap)
+      genes.append((position + len(gene), position + 1))
+      position += len(gene) + len(promoter)
+
+  genome = "".join(pieces)[:length]
+  return genome, [gene for gene in genes if max(gene) <= length]
+
+def writeGenome(directory, length, gc = 0.5, seed = 1, outputs = False):
+  """
+  directory: Directory to write the genome to.
+  length:    Length of the genome in base pairs.
+  gc:        Fraction of the genome that is G or C.
+  seed:      Seed of the random numbers.
+  outputs:   If true what the stub programs output for the genome is written next to it.
+
+  return:    Name of the fasta file of the genome.  If the file is already there it is not made again.
+  """
+  name = genomeName(length, gc, seed)
+  fileName = os.path.join(directory, name + ".fas")
+  if os.path.isfile(fileName) and not outputs:
+    return fileName
+  if os.path.isfile(fileName):
+    genome = tools.readGenome(fileName)
+  else:
+    genome = generate(length, gc, seed)[0]
+    output = open(fileName + ".partial", "w")
+    tools.writeFasta(output, name, genome)
+    output.close()
+    os.rename(fileName + ".partial", fileName)
+  if outputs:
+    writeOutputs(fileName, name, genome)
+  return fileName
+
+def writeOutputs(fileName, name, genome):
+  """
+  Writes what the stub programs output for genome, whose fasta file is fileName, next to it.  The .orf and .lst files
+  are named as genemark names them, the searches of the genes are in fileName.blastp.xml, and the outputs of transterm
+  and tRNAscan-SE are in fileName.transterm and fileName.tRNAscan.
+  """
+  orfs = tools.findOrfs(genome)
+  output = open(fileName + ".orf", "w")
+  tools.writeOrfs(output, genome, orfs)
+  output.close()
+  output = open(fileName + ".lst", "w")
+  tools.writeOrfList(output, orfs)
+  output.close()
+
+  output = open(fileName + ".blastp.xml", "w")
+  tools.writeBlastXML(output, [(name + "~%d:%d-%d" % (i + 1, orfs[i][0], orfs[i][1]), tools.protein(genome, orfs[i][0], orfs[i][1])) for i in range(len(orfs))], "stub")
+  output.close()
+  output = open(fileName + ".transterm", "w")
+  output.write(tools.formatTerminators(orfs))
+  output.close()
+  output = open(fileName + ".tRNAscan", "w")
+  output.write(tools.formatTransferRNAs(name, genome))
+  output.close()
+
+if __name__ == "__main__":
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "", ["length=", "gc=", "seed=", "outputs", "help"])
+  except getopt.GetoptError:
+    sys.stdout.write(__doc__)
+    sys.exit(2)
+  length, gc, seed, outputs = 1000000, 0.5, 1, False
+  for opt, arg in opts:
+    if opt == "--length":
+      length = parseLength(arg)
+    elif opt == "--gc":
+      gc = float(arg)
+    elif opt == "--seed":
+      seed = int(arg)
+    elif opt == "--outputs":
+      outputs = True
+    elif opt == "--help":
+      sys.stdout.write(__doc__)
+      sys.exit(0)
+  if len(args) != 1:
+    sys.stdout.write(__doc__)
+    sys.exit(2)
+  if not os.path.isdir(args[0]):
+    os.makedirs(args[0])
+  sys.stdout.write(writeGenome(args[0], length, gc, seed, outputs) + "\n")
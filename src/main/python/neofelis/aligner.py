@@ -0,0 +1,127 @@
+"""
+A small protein aligner that stands in for blastp when blast isn't installed, for testing.  It finds the best ungapped
+local alignment between each query and each database protein sharing a word with it and writes the results in the same
+commented tabular format blastp writes with -outfmt 7, so they can be read like the output of a real search.
+"""
+
+import os
+import math
+from neofelis import fasta
+
+"""Length of the words used to find the database proteins that may align with a query."""
+wordLength = 3
+
+"""Scores of identical and differing residues in an alignment."""
+matchScore = 5
+mismatchScore = -4
+
+"""Karlin-Altschul parameters used to turn alignment scores into bit scores."""
+scoreLambda = 0.3
+scoreK = 0.1
+
+"""First line of every record in the output."""
+programLine = "# BLASTP local\n"
+
+"""Fields in each line of the output."""
+fieldsLine = "# Fields: query id, subject id, evalue, bit score, identical, alignment length, q. start, subject title\n"
+
+def loadDatabase(database):
+  """
+  database: Name of a fasta file of proteins.
+
+  return:   A 2-tuple, a list of the header and sequence of each protein and a dictionary that maps
+            every word in the proteins to a list of the indices of the proteins it occurs in.
+  """
+  records = fasta.readFasta(database, fasta.proteinPattern)
+  words = {}
+  for i in xrange(len(records)):
+    sequence = records[i][1]
+    for j in xrange(len(sequence)-wordLength+1):
+      indices = words.setdefault(sequence[j:j+wordLength], [])
+      if not indices or indices[-1] != i:
+        indices.append(i)
+  return records, words
+
+def bestSegment(query, subject, diagonal):
+  """
+  query:    A protein sequence.
+  subject:  A protein sequence.
+  diagonal: Offset of the subject from the query, position i of the query is aligned with position i+diagonal of the subject.
+
+  return:   A 4-tuple, the score, number of identical residues, length, and first query position, counting from one,
+            of the highest scoring segment on the diagonal.
+  """
+  start, end = max(0, -diagonal), min(len(query), len(subject)-diagonal)
+  best = (0, 0, 0, 0)
+  score, identical, length = 0, 0, 0
+  for i in xrange(start, end):
+    if query[i] == subject[i+diagonal]:
+      score, identical = score+matchScore, identical+1
+    else:
+      score += mismatchScore
+    length += 1
+    if score <= 0:
+      score, identical, length = 0, 0, 0
+    elif score > best[0]:
+      best = (score, identical, length, i-length+2)
+  return best
+
+def align(query, subject):
+  """
+  query:   A protein sequence.
+  subject: A protein sequence.
+
+  return:  A 4-tuple, the score, number of identical residues, length, and first query position of the best
+           ungapped alignment on any diagonal where the sequences share a word, see bestSegment.
+  """
+  diagonals = {}
+  positions = {}
+  for j in xrange(len(subject)-wordLength+1):
+    positions.setdefault(subject[j:j+wordLength], []).append(j)
+  for i in xrange(len(query)-wordLength+1):
+    for j in positions.get(query[i:i+wordLength], []):
+      diagonals[j-i] = True
+  best = (0, 0, 0, 0)
+  for diagonal in diagonals:
+    best = max(best, bestSegment(query, subject, diagonal))
+  return best
+
+def search(query, database, eValue, fileName, searchSize = None):
+  """
+  query:      Name of a fasta file of proteins.
+  database:   Name of a fasta file of proteins to search.
+  eValue:     Largest e value of any hit reported.
+  fileName:   Name of the file to write the results to.
+  searchSize: Number of residues e values are calculated for, if None then the number of residues in database.
+
+  Aligns every protein in query with the proteins in database and writes one line for every protein it aligns
+  with, best first.  The first word of a database header is used as the subject id and the rest as its title.
+  """
+  records, words = loadDatabase(database)
+  databaseLength = searchSize or sum([len(sequence) for header, sequence in records])
+  queries = fasta.readFasta(query, fasta.proteinPattern) if os.path.getsize(query) else []
+  output = open(fileName, "w")
+  for header, sequence in queries:
+    candidates = {}
+    for i in xrange(len(sequence)-wordLength+1):
+      for index in words.get(sequence[i:i+wordLength], []):
+        candidates[index] = True
+    hits = []
+    for index in candidates:
+      score, identical, length, queryFrom = align(sequence, records[index][1])
+      bitScore = (scoreLambda*score - math.log(scoreK))/math.log(2)
+      hitEValue = len(sequence)*databaseLength*math.pow(2, -bitScore)
+      if hitEValue <= eValue:
+        hits.append((hitEValue, -bitScore, index, identical, length, queryFrom))
+    hits.sort()
+    output.write(programLine)
+    output.write("# Query: " + header + "\n")
+    output.write("# Database: " + database + "\n")
+    if hits:
+      output.write(fieldsLine)
+    output.write("# " + str(len(hits)) + " hits found\n")
+    for hitEValue, bitScore, index, identical, length, queryFrom in hits:
+      subject = (records[index][0].split(None, 1) + [""])[:2]
+      output.write("\t".join([header.split()[0], subject[0], "%.2g" % hitEValue, "%.1f" % -bitScore, str(identical), str(length), str(queryFrom), subject[1]]) + "\n")
+  output.write("# BLAST processed " + str(len(queries)) + " queries\n")
+  output.close()
@@ -0,0 +1,196 @@
+"""
+A cache of blast results for single proteins.  Results are stored as the record of the protein in the output
+of a search, the XML of its Iteration element for XML output, under the hash of the protein sequence and the search settings, so a protein that has been searched
+once, by any stage of any genome, is never searched again with the same settings.
+"""
+
+import os
+import re
+import hashlib
+import threading
+
+"""Directory the cached iterations are stored in."""
+cacheDirectory = "blastCache"
+
+#Have to make sure that a directory to store the cached iterations exists.
+if not os.path.isdir(cacheDirectory):
+  os.mkdir(cacheDirectory)
+
+"""Held while an iteration is written, genomes annotated at once may cache the same protein."""
+storeLock = threading.Lock()
+
+"""Start of a blast XML file assembled from cached iterations."""
+xmlHeader = """<?xml version="1.0"?>
+<!DOCTYPE BlastOutput PUBLIC "-//NCBI//NCBI BlastOutput/EN" "NCBI_BlastOutput.dtd">
+<BlastOutput>
+  <BlastOutput_program>blastp</BlastOutput_program>
+  <BlastOutput_version>BLASTP</BlastOutput_version>
+  <BlastOutput_reference></BlastOutput_reference>
+  <BlastOutput_db>%(database)s</BlastOutput_db>
+  <BlastOutput_query-ID>Query_1</BlastOutput_query-ID>
+  <BlastOutput_query-def>%(query)s</BlastOutput_query-def>
+  <BlastOutput_query-len>0</BlastOutput_query-len>
+  <BlastOutput_param>
+    <Parameters>
+      <Parameters_expect>%(eValue)s</Parameters_expect>
+    </Parameters>
+  </BlastOutput_param>
+  <BlastOutput_iterations>
+"""
+
+"""End of a blast XML file assembled from cached iterations."""
+xmlFooter = """  </BlastOutput_iterations>
+</BlastOutput>
+"""
+
+xmlEscapes = (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ("\"", "&quot;"))
+
+queryDefPattern = re.compile(r"<Iteration_query-def>(.*)</Iteration_query-def>")
+queryIDPattern = re.compile(r"<Iteration_query-ID>.*</Iteration_query-ID>")
+iterationNumberPattern = re.compile(r"<Iteration_iter-num>.*</Iteration_iter-num>")
+
+def escape(text):
+  """
+  Turns special characters into their xml form.
+  """
+  for character, entity in xmlEscapes:
+    text = text.replace(character, entity)
+  return text
+
+def unescape(text):
+  """
+  Turns xml entities back into the characters they represent.
+  """
+  for character, entity in reversed(xmlEscapes):
+    text = text.replace(entity, character)
+  return text
+
+def searchSettings(database, eValue, outputFormat = "5", searchSize = None):
+  """
+  database:     The database searched.
+  eValue:       The e value of the search.
+  outputFormat: The -outfmt argument of the search.
+  searchSize:   The -dbsize argument of the search, or None if the size of database is used.
+
+  return:       A string describing every setting that affects the result of a search.
+  """
+  settings = ["blastp", "-outfmt", outputFormat, "-db", database, "-evalue", str(eValue)]
+  if searchSize:
+    settings += ["-dbsize", str(searchSize)]
+  return " ".join(settings)
+
+def proteinKey(sequence, settings):
+  """
+  sequence: A protein sequence.
+  settings: The settings of a search as returned by searchSettings.
+
+  return:   The key the result of searching for sequence with settings is cached under.
+  """
+  return hashlib.sha1(settings + "\n" + sequence).hexdigest()
+
+def fragmentPath(key):
+  """
+  key:    A key returned by proteinKey.
+
+  return: Name of the file the iteration for key is cached in.
+  """
+  return os.path.join(cacheDirectory, key[:2], key + ".xml")
+
+def isCached(key):
+  """
+  Returns true if there is a cached iteration for key.
+  """
+  return os.path.isfile(fragmentPath(key))
+
+def store(key, fragment):
+  """
+  key:      A key returned by proteinKey.
+  fragment: The XML of an Iteration element.
+
+  Caches fragment under key.  The fragment is written to a temporary file first so an interrupted
+  write can't leave a partial iteration in the cache.
+  """
+  fileName = fragmentPath(key)
+  storeLock.acquire()
+  try:
+    if not os.path.isdir(os.path.dirname(fileName)):
+      os.mkdir(os.path.dirname(fileName))
+    output = open(fileName + ".tmp", "w")
+    output.write(fragment)
+    output.close()
+    if os.path.isfile(fileName):
+      os.remove(fileName)
+    os.rename(fileName + ".tmp", fileName)
+  finally:
+    storeLock.release()
+
+def load(key):
+  """
+  Returns the XML of the Iteration element cached under key.
+  """
+  input = open(fragmentPath(key), "r")
+  fragment = input.read()
+  input.close()
+  return fragment
+
+def splitIterations(fileName):
+  """
+  fileName: Name of a blast XML file.
+
+  return:   A generator of 2-tuples, the query definition and the XML of each complete Iteration element in
+            the file.
+
+  Blast writes every element on its own line, so the file is split line by line without parsing it.
+  """
+  input = open(fileName, "r")
+  lines = None
+  queryDef = None
+  for line in input:
+    stripped = line.strip()
+    if stripped == "<Iteration>":
+      lines, queryDef = [], None
+    if lines is not None:
+      lines.append(line)
+      match = queryDefPattern.search(line)
+      if match:
+        queryDef = unescape(match.group(1))
+      if stripped == "</Iteration>":
+        yield queryDef, "".join(lines)
+        lines = None
+  input.close()
+
+def storeIterations(fileName, keys, split = splitIterations):
+  """
+  fileName: Name of a file of blast results.
+  keys:     A dictionary that maps query definitions to the keys their results are cached under.
+  split:    Function that splits fileName into query definitions and records, splitIterations for XML.
+
+  Caches every complete record in fileName whose query is in keys.
+  """
+  for queryDef, fragment in split(fileName):
+    if queryDef in keys:
+      store(keys[queryDef], fragment)
+
+def assemble(fileName, queries, database, eValue):
+  """
+  fileName: Name of the blast XML file to write.
+  queries:  A list of 2-tuples, the definition of a query and the key its result is cached under.
+  database: The database that was searched.
+  eValue:   The e value of the search.
+
+  Writes a blast XML file with one iteration for each query, in order, taken from the cache.  The query
+  definition, query ID, and iteration number of each cached iteration are replaced with those of the query.
+  """
+  output = open(fileName, "w")
+  output.write(xmlHeader % {"database" : escape(os.path.split(database)[1]),
+                            "query" : escape(queries[0][0]) if queries else "",
+                            "eValue" : eValue})
+  for i in xrange(len(queries)):
+    queryDef, key = queries[i]
+    fragment = load(key)
+    fragment = queryDefPattern.sub(lambda match: "<Iteration_query-def>" + escape(queryDef) + "</Iteration_query-def>", fragment, 1)
+    fragment = queryIDPattern.sub("<Iteration_query-ID>Query_" + str(i+1) + "</Iteration_query-ID>", fragment, 1)
+    fragment = iterationNumberPattern.sub("<Iteration_iter-num>" + str(i+1) + "</Iteration_iter-num>", fragment, 1)
+    output.write(fragment)
+  output.write(xmlFooter)
+  output.close()
@@ -0,0 +1,117 @@
+"""
+This module holds the genome a run of the pipeline annotates, so that it is loaded once and what several stages derive
+from it, the reverse complement, the gc content, and the codon indexes, is computed once and shared by them.
+"""
+
+import os
+import threading
+from neofelis import fasta
+from neofelis import sequences
+from neofelis import trace
+
+class GenomeContext():
+  """
+  A genome being annotated.  The values derived from the genome are computed the first time they are asked for and
+  kept, stages running at the same time share them.  A fasta file of the genome is only written if an external program
+  needs one, see fastaFile.
+  """
+  def __init__(self, name, genome, workspace = ""):
+    """
+    name:      Name of the genome, used as the header of its fasta file.
+    genome:    The genome as a string.
+    workspace: Directory scratch files for the genome are written to, the working directory if it's empty.
+    """
+    self.name = name
+    self.genome = genome
+    self.length = len(genome)
+    self.workspace = workspace
+    self.lock = threading.RLock()
+    self.derived = {}
+
+  def __getstate__(self):
+    """
+    Only the name and the genome are pickled, the derived values can be computed again and the workspace only
+    exists for one run, so contexts of the same genome pickle the same.
+    """
+    return {"name" : self.name, "genome" : self.genome}
+
+  def __setstate__(self, state):
+    self.__init__(state["name"], state["genome"])
+
+  def __str__(self):
+    result = "<"
+    result += "Name = " + str(self.name) + ", "
+    result += "Length = " + str(self.length) + ", "
+    result += "Workspace = " + str(self.workspace)
+    result += ">"
+    return result
+
+  def derive(self, name, function):
+    """
+    name:     Name of a derived value.
+    function: Function that computes the value.
+
+    return:   The value, computed with function only the first time it's asked for.
+    """
+    self.lock.acquire()
+    try:
+      if name not in self.derived:
+        self.derived[name] = function()
+      return self.derived[name]
+    finally:
+      self.lock.release()
+
+  def reverseComplement(self):
+    """
+    return: The reverse complement of the genome.
+    """
+    return self.derive("reverseComplement", lambda: sequences.reverseComplement(self.genome))
+
+  def gcContent(self):
+    """
+    return: The percentage of the genome that is G or C.
+    """
+    return self.derive("gcContent", lambda: sequences.gcContent(self.genome))
+
+  def forwardIndex(self):
+    """
+    return: A sequences.CodonIndex of the genome.
+    """
+    return self.derive("forwardIndex", lambda: sequences.CodonIndex(self.genome))
+
+  def reverseIndex(self):
+    """
+    return: A sequences.CodonIndex of the reverse complement of the genome.
+    """
+    return self.derive("reverseIndex", lambda: sequences.CodonIndex(self.reverseComplement()))
+
+  def scratchFile(self, fileName):
+    """
+    Returns the name fileName has in the workspace.
+    """
+    return os.path.join(self.workspace, fileName)
+
+  def fastaFile(self):
+    """
+    return: Name of a fasta file of the genome with name as its header, written to the workspace the first time
+            it's asked for.
+    """
+    def write():
+      fileName = self.scratchFile("query.fas")
+      output = open(fileName, "w")
+      output.write(">" + self.name + "\n")
+      for i in range(0, self.length, 50):
+        output.write(self.genome[i:min(i+50, self.length)] + "\n")
+      output.close()
+      trace.wrote(fileName)
+      return fileName
+    return self.derive("fastaFile", write)
+
+def loadContext(fileName, workspace = ""):
+  """
+  fileName:  Name of a fasta file of a genome.
+  workspace: Directory scratch files for the genome are written to.
+
+  return:    A GenomeContext of the genome, named after fileName without its directory and extension.
+  """
+  return GenomeContext(os.path.split(fasta.stripExtension(fileName))[1], fasta.loadGenome(fileName), workspace)
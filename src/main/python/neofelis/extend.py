@@ -6,85 +6,205 @@ the function extendGenes.
 import os
 import re
 import sys
+import shutil
+import bisect
+import hashlib
 import functools
+import threading
 from neofelis import utils
+from neofelis import fasta
+from neofelis import sequences
+from neofelis import trace
 
 #Have to make sure that a directory to store the blasts this module creates exists.
 if not os.path.isdir("extendedBlasts"):
   os.mkdir("extendedBlasts")
+
+#Have to make sure that a directory to build the databases of parent hits in exists.
+if not os.path.isdir("extensionDatabases"):
+  os.mkdir("extensionDatabases")
+
+"""Held while a database of parent hits is built, so genomes annotated at once don't build the same database together."""
+databaseLock = threading.Lock()
   
 def getStops(genes):
   """
   genes:  A list of Iteration objects.
 
-  return: A 2-tuple, first object is a list of where all the forward coding genes stop,
-          second is a list of where all the reverse coding genes stop.
+  return: A 2-tuple, first object is a sorted list of where all the forward coding genes stop,
+          second is a sorted list of where all the reverse coding genes stop.
   """
-  forwardStops = map(lambda x: x.location[1], filter(lambda x: x.location[0] < x.location[1], genes))
-  reverseStops = map(lambda x: x.location[1], filter(lambda x: x.location[1] < x.location[0], genes))
+  forwardStops = sorted(map(lambda x: x.location[1], filter(lambda x: x.location[0] < x.location[1], genes)))
+  reverseStops = sorted(map(lambda x: x.location[1], filter(lambda x: x.location[1] < x.location[0], genes)))
   return forwardStops, reverseStops
 
-def getExtensions(genome, genes):
+def previousStop(stops, location):
   """
-  genome: The genome as a string.
-  genes:  A list of Iteration objects.
+  stops:    A sorted list of stops.
+  location: A location in the genome.
+
+  return:   The last stop before location, found with a binary search.
+  """
+  return stops[bisect.bisect_left(stops, location)-1]
+
+def nextStop(stops, location):
+  """
+  stops:    A sorted list of stops.
+  location: A location in the genome.
+
+  return:   The first stop after location, found with a binary search.
+  """
+  return stops[bisect.bisect_right(stops, location)]
+
+def getExtensions(genome, genes, forwardIndex = None, reverseIndex = None):
+  """
+  genome:       The genome as a string.
+  genes:        A list of Iteration objects.
+  forwardIndex: A sequences.CodonIndex of genome, built here if it isn't given.
+  reverseIndex: A sequences.CodonIndex of the reverse complement of genome, built here if it isn't given.
 
   return: A dictionary mapping genes(Iteration objects) to alternative locations where that gene could start.
   
-  The alternate starts are calculated by starting at the original start of the gene and iterating backwards.
-  When a start codon is found the start of that start codon is added to the list of alternate starts.  If this start
-  codon comes before the start of the previous gene then is it still added to the list but the search terminates.
+  The alternate starts are calculated by starting at the original start of the gene and iterating backwards
+  over the in frame codons of a sequences.CodonIndex.  When a start codon is found the start of that start codon
+  is added to the list of alternate starts.  If this start codon comes before the start of the previous gene then
+  is it still added to the list but the search terminates, as it does at the first stop codon.
   """
   forwardStops, reverseStops = getStops(genes)
-  forwardStops.append(1)
+  forwardStops.insert(0, 1)
   reverseStops.append(len(genome))
+  if not forwardIndex:
+    forwardIndex = sequences.CodonIndex(genome)
+  if not reverseIndex:
+    reverseIndex = sequences.CodonIndex(sequences.reverseComplement(genome))
   results = {}
   for gene in genes:
     results[gene] = []
     if gene.location[0] < gene.location[1]:
-      bound = max(filter(lambda x: x < gene.location[1], forwardStops))
-      for i in xrange(gene.location[0]-1, 0, -3):
-        if genome[i-3:i] in utils.startCodons:
-          results[gene].append(i-3)
-          if i <= bound-1:
-            break
-        elif genome[i-3:i] in utils.stopCodons:
+      bound = previousStop(forwardStops, gene.location[1])
+      for position, isStart in forwardIndex.upstream(gene.location[0]-4):
+        if not isStart:
+          break
+        results[gene].append(position)
+        if position <= bound-4:
           break
     else:
-      bound = min(filter(lambda x: x > gene.location[1], reverseStops))
-      for i in xrange(gene.location[0], len(genome), 3):
-        if utils.reverseComplement(genome[i:i+3]) in utils.startCodons:
-          results[gene].append(i+3)
-          if i >= bound-1:
-            break
-        elif utils.reverseComplement(genome[i:i+3]) in utils.stopCodons:
+      bound = nextStop(reverseStops, gene.location[1])
+      for position, isStart in reverseIndex.upstream(len(genome)-gene.location[0]-3):
+        if not isStart:
+          break
+        results[gene].append(len(genome)-position)
+        if len(genome)-position-3 >= bound-1:
           break
   return results
 
-def writeExtensions(genome, extensions):
+def writeExtensions(genome, extensions, fileName = "extensions.fas"):
   """
   genome: The genome as a string.
   extensions: A dictionary mapping genes(Iteration objects) to alternative locations where that gene could start.
+  fileName: Name of the file to write.
   
-  This function will write the translation of each possible extension to the file, "extensions.fas".
+  This function will write the translation of each possible extension to the file fileName, "extensions.fas" by default.
+  The genes are written in the order of their query names so the extensions are numbered the same on every run.
   """
-  output = open("extensions.fas", "w")
+  output = open(fileName, "w")
   q = 0
-  for gene, extensionList in extensions.items():
+  for gene, extensionList in sorted(extensions.items(), key = lambda x: x[0].query):
     for extension in extensionList:
       q += 1
       if gene.location[0] < gene.location[1]:
         ext = extension+1
-        proteins = utils.translate(genome[extension:gene.location[1]])
+        proteins = sequences.translate(genome[extension:gene.location[1]])
       else:
         ext = extension
-        proteins = utils.translate(utils.reverseComplement(genome[gene.location[1]-1:extension]))
+        proteins = sequences.translate(sequences.reverseComplement(genome[gene.location[1]-1:extension]))
       output.write(">" + gene.query + "~" + str(q) + ":" +
                    "-".join(map(str, [ext, gene.location[1]])) + "\n")
       for i in xrange(0, len(proteins), 50):
         output.write(proteins[i:min(i+50, len(proteins))] + "\n")
       
   output.close()
+  trace.wrote(fileName)
+
+def hitAccession(hit):
+  """
+  hit:    The id of a hit.
+
+  return: The identifier blastdbcmd looks the hit up with, its gi number if it has one.
+  """
+  match = re.match(r"gi\|(\d+)", hit)
+  return match.group(1) if match else hit
+
+def databaseLength(blast, database, pipeline):
+  """
+  blast:    Location of the installation of blast.
+  database: The database to measure.
+  pipeline: The pipeline running the search.
+
+  return:   The number of residues in database.
+  """
+  if os.path.isfile(utils.localDatabase(database)):
+    return sum([len(sequence) for header, sequence in fasta.readFasta(utils.localDatabase(database), fasta.proteinPattern)])
+  invocation = utils.runBlastProgram("blastdbcmd", [blast + "/bin/blastdbcmd", "-db", os.path.split(database)[1], "-info"], pipeline, database)
+  return int(re.search(r"([\d,]+) total (letters|residues)", invocation.output).group(1).replace(",", ""))
+
+def parentDatabase(blast, database, genes, pipeline):
+  """
+  blast:    Location of the installation of blast.
+  database: The database the genes were searched for in.
+  genes:    A list of Iteration objects.
+  pipeline: The pipeline running the search.
+
+  return:   A 2-tuple, a database of the proteins the genes hit and the number of residues in database, or None if
+            the genes have no hits.
+
+  The database is built in extensionDatabases under the hash of database and the ids of the hits, from the proteins
+  dumped by blastdbcmd, or from the fasta file of a local database.  A database is only built once for a set of hits,
+  its size file is written last so a database is only reused if it was built completely.  If the build fails the
+  directory is removed and a utils.BlastError is raised.
+  """
+  hits = {}
+  for gene in genes:
+    for hit in gene.hits:
+      hits[hit] = True
+  if not hits:
+    return None
+  hits = sorted(hits.keys())
+  key = hashlib.sha1(os.path.abspath(database) + "\n" + "\n".join(hits)).hexdigest()
+  directory = os.path.join("extensionDatabases", key)
+  sizeFile = os.path.join(directory, "size")
+  databaseLock.acquire()
+  try:
+    if os.path.isfile(sizeFile):
+      input = open(sizeFile, "r")
+      size = int(input.read())
+      input.close()
+      return directory, size
+
+    if not os.path.isdir(directory):
+      os.mkdir(directory)
+    try:
+      proteins = os.path.abspath(os.path.join(directory, key + ".fas"))
+      if os.path.isfile(utils.localDatabase(database)):
+        records = fasta.readFasta(utils.localDatabase(database), fasta.proteinPattern)
+        utils.writeProteins(proteins, filter(lambda x: x[0].split()[0] in hits, records))
+      else:
+        output = open(os.path.join(directory, "hits"), "w")
+        output.write("\n".join(map(hitAccession, hits)) + "\n")
+        output.close()
+        utils.runBlastProgram("blastdbcmd", [blast + "/bin/blastdbcmd", "-db", os.path.split(database)[1], "-entry_batch", os.path.abspath(os.path.join(directory, "hits")), "-out", proteins], pipeline, database)
+        utils.runBlastProgram("makeblastdb", [blast + "/bin/makeblastdb", "-in", proteins, "-dbtype", "prot", "-parse_seqids", "-out", key], pipeline, directory)
+      size = databaseLength(blast, database, pipeline)
+      output = open(sizeFile + ".tmp", "w")
+      output.write(str(size))
+      output.close()
+      os.rename(sizeFile + ".tmp", sizeFile)
+    except:
+      shutil.rmtree(directory, True)
+      raise
+    return directory, size
+  finally:
+    databaseLock.release()
 
 def applyExtensions(genome, genes, extendedGenes):
   """
@@ -94,60 +214,79 @@ def applyExtensions(genome, genes, extendedGenes):
 
   return:        A merging of genes with extendedGenes consisting of the, "better" gene in the event of a conflict
   
-  The merging is done by iterating over the dictionary genes, for each entry in genes extendedGenes
-  is iterated over.  If an entry in extendedGenes has a query name that starts with the query name
-  of the original gene then that entry is an extension of the original gene.  This extension will replace
+  The merging is done by first grouping the entries of extendedGenes by the query name of the gene they extend,
+  the query name of an extension is that of the original gene followed by another "~" and a number.  Then for each
+  entry in genes its extensions are folded over in turn, in the order of their numbers.  An extension will replace
   the gene in the new dictionary if it either has an eValue that is lower than the original gene or the extension places
-  it within 100 bps of the preceeding gene and is closer to the stop of the preceding gene.
+  it within 100 bps of the preceeding gene and is closer to the stop of the preceding gene.  The stop of the preceding
+  gene is found with a binary search of the sorted stops.
   """
   forwardStops, reverseStops = getStops(genes.values())
-  forwardStops.append(1)
+  forwardStops.insert(0, 1)
   reverseStops.append(len(genome))
+
+  extensions = {}
+  for extension in sorted(extendedGenes.values(), key = lambda x: int(x.query.rsplit("~", 1)[1])):
+    extensions.setdefault(re.sub(r"(~\d+)~\d+", r"\1", extension.query), []).append(extension)
   
-  def reduceFunction(gene, x, y):
-    if re.sub(r"(~\d+)~\d+", r"\1", y.query) == gene.query:
-      if gene.location[0] < gene.location[1]:
-        stop = max(filter(lambda z: z < gene.location[1], forwardStops))
-        gapSize = y.location[0] - stop
-      else:
-        stop = min(filter(lambda z: z > gene.location[1], reverseStops))
-        gapSize = stop - y.location[0]
-      if gapSize < 0:
-        return min(x, y, key = lambda z: abs(z.location[0] - stop))
-      elif gapSize < 100 or abs(x.eValue - y.eValue) < 10e-5 or utils.isNaN(x.eValue-y.eValue):
-        return max(x, y, key = lambda z: abs(z.location[1] - z.location[0]))
-      else:
-        return min(x, y, key = lambda z: z.eValue)
+  def reduceFunction(gene, stop, x, y):
+    if gene.location[0] < gene.location[1]:
+      gapSize = y.location[0] - stop
+    else:
+      gapSize = stop - y.location[0]
+    if gapSize < 0:
+      return min(x, y, key = lambda z: abs(z.location[0] - stop))
+    elif gapSize < 100 or abs(x.eValue - y.eValue) < 10e-5 or utils.isNaN(x.eValue-y.eValue):
+      return max(x, y, key = lambda z: abs(z.location[1] - z.location[0]))
     else:
-      return x
+      return min(x, y, key = lambda z: z.eValue)
         
   result = {}
   for gene, geneData in genes.items():
-    result[gene] = reduce(functools.partial(reduceFunction, geneData), extendedGenes.values(), geneData)
+    result[gene] = geneData
+    if geneData.query not in extensions:
+      continue
+    if geneData.location[0] < geneData.location[1]:
+      stop = previousStop(forwardStops, geneData.location[1])
+    else:
+      stop = nextStop(reverseStops, geneData.location[1])
+    result[gene] = reduce(functools.partial(reduceFunction, geneData, stop), extensions[geneData.query], geneData)
     if result[gene] != geneData:
       result[gene].color = "0 255 0"
       result[gene].note = "Extended"
   return result
 
-def extendGenes(query, genes, name, blast, database, eValue, pipeline):
+def extendGenes(context, genes, blast, database, eValue, pipeline):
   """
-  query:    File name of the query.
+  context:  A context.GenomeContext of the genome.
   ganes:    A dictionary that maps query names to Iteration objects
-  name:     Name of the genome
   blast:    Location of the installation of blast.
   database: The database to use with blast.
   eValue:   The E Value to use with blast.
 
   return:   A new dictionary mapping query names to Iteration objects with any better extensions replacing the originals.
   
-  This function will search for any possible extensions of the genes in the query.  An extension will replace the original gene in the resulting
+  This function will search for any possible extensions of the genes in the genome, the extensions are written to
+  extensions.fas in the workspace of the context.  An extension will replace the original gene in the resulting
   dictionary if it either brings the start of the gene sufficiently close to the end of a previous gene or it has
   a lower eValue.
+
+  If pipeline.extensionScoring is "parents" the extensions are only searched for in a database of the proteins the genes
+  hit, see parentDatabase, with e values calculated for the size of the whole database so they can be compared with
+  those of the genes.  If the genes have no hits the whole database is searched.
   """
-  genome = utils.loadGenome(query)
-  extensions = getExtensions(genome, genes.values())
+  genome = context.genome
+  extensions = getExtensions(genome, genes.values(), context.forwardIndex(), context.reverseIndex())
+  trace.count("extensionCandidates", sum(map(len, extensions.values())))
   
-  writeExtensions(genome, extensions)
-  extendedGenes = utils.cachedBlast("extendedBlasts/" + name + ".blastp.xml", blast, database, eValue, "extensions.fas", pipeline)
-  os.remove("extensions.fas")
+  extensionsFile = context.scratchFile("extensions.fas")
+  writeExtensions(genome, extensions, extensionsFile)
+  backend = utils.stageBackend(pipeline, "extension")
+  searchSize = None
+  if pipeline.extensionScoring == "parents":
+    parents = parentDatabase(blast, database, genes.values(), pipeline)
+    if parents:
+      database, searchSize = parents
+  extendedGenes = utils.cachedBlast("extendedBlasts/" + context.name + ".blastp" + backend.extension, blast, database, eValue, extensionsFile, pipeline, backend = backend, searchSize = searchSize)
+  os.remove(extensionsFile)
   return applyExtensions(genome, genes, extendedGenes)
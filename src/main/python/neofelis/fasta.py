@@ -0,0 +1,140 @@
+"""
+Functions for reading fasta files.  Files are read in a single pass and may be gzip compressed.
+"""
+
+import os
+import re
+import gzip
+
+"""Number of lines read when deciding if a file is a fasta file at all."""
+sniffLength = 10
+
+"""Patterns matching the residues of nucleotide and protein sequences."""
+sequencePattern = re.compile("[ACGT]+")
+proteinPattern = re.compile("[A-Z*]+")
+
+class FastaError(Exception):
+  """
+  Raised when a file that is supposed to be a fasta file isn't one.
+  """
+  def __init__(self, fileName, reason):
+    Exception.__init__(self, fileName + " is not a fasta file: " + reason)
+
+def openFasta(fileName):
+  """
+  fileName: Name of a fasta file, compressed with gzip or not.
+
+  return:   A file object that reads the uncompressed contents of the file.
+  """
+  input = open(fileName, "rb")
+  magic = input.read(2)
+  input.close()
+  if magic == "\x1f\x8b":
+    return gzip.open(fileName, "rb")
+  return open(fileName, "r")
+
+def stripExtension(fileName):
+  """
+  fileName: Name of a fasta file.
+
+  return:   fileName without its extension, ".gz" is removed along with the extension before it.
+  """
+  if fileName.endswith(".gz"):
+    fileName = fileName[:-3]
+  return os.path.splitext(fileName)[0]
+
+def readRecords(input, fileName, pattern = sequencePattern):
+  """
+  input:    A file object positioned at the start of a fasta file.
+  fileName: Name of the file being read, used in error messages.
+  pattern:  Pattern matching the residues of a sequence line.
+
+  return:   A generator of 2-tuples, the header and the sequence of each record in the file.
+
+  Only the first sniffLength lines are checked for being valid.  After that, as with the original
+  genome loader, any line that doesn't begin with nucleotides is skipped.  Sequence lines are collected
+  in a list and joined once per record so reading is linear in the size of the file.
+  """
+  header, chunks, lineNumber = None, [], 0
+  for line in input:
+    lineNumber += 1
+    line = line.strip()
+    if not line:
+      continue
+    if line[0] == ">":
+      if header is not None:
+        yield header, "".join(chunks)
+      header, chunks = line[1:].strip(), []
+    else:
+      if header is None:
+        raise FastaError(fileName, "sequence data before the first header on line " + str(lineNumber))
+      match = pattern.match(line.upper())
+      if match:
+        chunks.append(match.group())
+      elif lineNumber <= sniffLength:
+        raise FastaError(fileName, "line " + str(lineNumber) + " is not sequence data")
+  if header is None:
+    raise FastaError(fileName, "no records found")
+  yield header, "".join(chunks)
+
+def readFasta(fileName, pattern = sequencePattern):
+  """
+  fileName: Name of a fasta file, compressed with gzip or not.
+  pattern:  Pattern matching the residues of a sequence line, proteinPattern for protein files.
+
+  return:   A list of 2-tuples, the header and the sequence of each record in the file.
+  """
+  input = openFasta(fileName)
+  try:
+    return list(readRecords(input, fileName, pattern))
+  finally:
+    input.close()
+
+def isGenome(fileName):
+  """
+  fileName: Name of a file.
+
+  return:   True if fileName looks like a fasta file.  Only the first few lines of the file are read.
+  """
+  if os.path.isdir(fileName):
+    return False
+  try:
+    input = openFasta(fileName)
+  except IOError:
+    return False
+  try:
+    lines = []
+    for line in input:
+      lines.append(line)
+      if len(lines) == sniffLength:
+        break
+    for record in readRecords(lines, fileName):
+      pass
+    return True
+  except (FastaError, IOError):
+    return False
+  finally:
+    input.close()
+
+def getHeader(fileName):
+  """
+  fileName: Name of a fasta file, compressed with gzip or not.
+
+  return:   The header of the first record in the file in upper case, or None if there isn't one.
+  """
+  input = openFasta(fileName)
+  try:
+    for line in input:
+      if line.startswith(">"):
+        return line[1:].strip().upper()
+    return None
+  finally:
+    input.close()
+
+def loadGenome(fileName):
+  """
+  fileName: Name of a fasta file, compressed with gzip or not.
+
+  return:   The sequences of every record in the file joined together.
+  """
+  return "".join([sequence for header, sequence in readFasta(fileName)])
@@ -4,10 +4,11 @@ the function findGenes.
 """
 
 from neofelis import utils
+from neofelis import processes
+from neofelis import trace
 import sys
 import re
 import os
-import subprocess
 
 #Have to make sure that a directory to store the blasts this module creates exists.
 if not os.path.isdir("initialBlasts"):
@@ -17,12 +18,15 @@ def modifyFastaHeader(fileName, name):
   """
   fileName: The name of the file to modify.
   name:     The name of the genome that will be included in the header of each sequence
+
+  return:   The number of sequences in the file.
   """
   input = open(fileName, "r")
-  swap = ""
+  swap, sequences = "", 0
   for line in input:
     matches = re.search(">orf_(\d+).*, (\d+ - \d+)", line)
     if matches:
+      sequences += 1
       swap += ">" + name + "~" + ":".join(matches.groups()).replace(" ", "") + "\n"
     else:
       swap += line
@@ -31,6 +35,7 @@ def modifyFastaHeader(fileName, name):
   output = open(fileName, "w")
   output.write(swap)
   output.close()
+  return sequences
 
 def removeInvalidGenes(fileName, genomeLength):
   """
@@ -56,10 +61,9 @@ def removeInvalidGenes(fileName, genomeLength):
   output.write(swap)
   output.close()
 
-def findGenes(query, name, blastLocation, database, eValue, genemark, matrix, pipeline):
+def findGenes(context, blastLocation, database, eValue, genemark, matrix, pipeline):
   """
-  query:         File name of the query.
-  name:          Name of the genome in the query.
+  context:       A context.GenomeContext of the genome.
   blastLocation: Location of blast installation.
   database:      Name of the database to search.
   eValue:        E value to use when searching.
@@ -67,22 +71,21 @@ def findGenes(query, name, blastLocation, database, eValue, genemark, matrix, pi
   matrix:        Name of the matrix to use, or None
   
   
-  Uses genemark to predict genes in query and then uses blast with the given eValue
+  Uses genemark to predict genes in the genome and then uses blast with the given eValue
   to find annotations for those genes.  If a matrix is not specified the GC program in
-  genemark will be used to select a heuristic matrix.
+  genemark will be used to select a heuristic matrix.  Genemark is run on the fasta file of the context in its
+  workspace so its output is written there.
   """
-  genome = utils.loadGenome(query)
+  query = context.fastaFile()
   if not matrix:
-    gc = int(utils.getGCContent(genome))
+    gc = int(context.gcContent())
     matrix = genemark + "/" + "heuristic_mat/heu_11_" + str(min(max(30, gc), 70)) + ".mat"
-  genemarkProcess = subprocess.Popen([genemark + "/gm", "-opq", "-m", matrix, query], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-  while genemarkProcess.poll() == None:
-    genemarkProcess.stdout.read()
-    genemarkProcess.stderr.read()
-  removeInvalidGenes(query + ".orf", len(genome))
-  modifyFastaHeader(query + ".orf", name)
+  processes.run("genemark", [os.path.abspath(genemark) + "/gm", "-opq", "-m", os.path.abspath(matrix), os.path.basename(query)], pipeline, cwd = os.path.dirname(query) or None)
+  removeInvalidGenes(query + ".orf", context.length)
+  trace.count("orfs", modifyFastaHeader(query + ".orf", context.name))
   
-  result = utils.cachedBlast("initialBlasts/" + name + ".blastp.xml", blastLocation, database, eValue, query + ".orf", pipeline)
+  backend = utils.stageBackend(pipeline, "initial")
+  result = utils.cachedBlast("initialBlasts/" + context.name + ".blastp" + backend.extension, blastLocation, database, eValue, query + ".orf", pipeline, backend = backend)
   os.remove(query + ".orf")
   os.remove(query + ".lst")
   return result
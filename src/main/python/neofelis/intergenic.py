@@ -5,8 +5,12 @@ using the function findIntergenics.
 
 import copy
 import sys
+import bisect
 import os
 from neofelis import utils
+from neofelis import sequences
+from neofelis import prefilter
+from neofelis import trace
 
 """Have to make sure that a directory to store the blasts this module creates exists."""
 if not os.path.isdir("intergenicBlasts"):
@@ -44,6 +48,12 @@ def calculateIntergenicRegions(genomeLength, genes, minLength = 3):
   calculated iteratively starting with a single intergenic region consisting of the entire genome.  For each gene the regions are
   either splitted or whittled down, then any regions which are smaller than minLength are filtered out, which includes regions of
   negative length which get generated.
+
+  The regions of positive length never overlap, so they are kept sorted and the ones a gene overlaps are found with a
+  binary search instead of visiting every region for every gene.  A region of negative length is left when a gene covers
+  a region and the inset of the gene keeps it from being filtered out, these are rare and kept in a separate list that is
+  checked against every gene.  A negative region stays at the place in the list of regions of the region it came from,
+  so the regions are returned in the same order as if every region were visited for every gene.
   """
   def filterFunction(region):
     """
@@ -53,87 +63,160 @@ def calculateIntergenicRegions(genomeLength, genes, minLength = 3):
     inset = abs(region.stopGene.location[1] - region.stopGene.location[0])/2 if region.stopGene else 0
     return region.stop + inset - region.start > minLength
 
-  forwardResult, reverseResult = [Region(None, 0, genomeLength, None)], [Region(None, 0, genomeLength, None)]
+  def cut(region, bottom, top, gene):
+    """
+    Returns the regions left of region after removing the gene from bottom to top, before filtering.
+    """
+    if bottom < region.stop and region.stop <= top:
+      return [Region(region.startGene, region.start, bottom, gene)]
+    elif bottom <= region.start and region.start < top:
+      return [Region(gene, top, region.stop, region.stopGene)]
+    elif region.start < bottom and top < region.stop:
+      return [Region(region.startGene, region.start, bottom, gene), Region(gene, top, region.stop, region.stopGene)]
+    return [region]
+
+  def strandRegions(intervals):
+    """
+    intervals: A list of 3-tuples, the bottom, top, and gene of each gene on a strand in the order they were given.
+
+    return:    The intergenic regions of the strand.
+    """
+    regions = [Region(None, 0, genomeLength, None)]
+    starts, stops = [0], [genomeLength]
+    negatives = []
+    for bottom, top, gene in intervals:
+      remaining = []
+      for position, region in negatives:
+        if bottom < region.stop and region.stop <= top or bottom <= region.start and region.start < top:
+          remaining += [(position, newRegion) for newRegion in filter(filterFunction, cut(region, bottom, top, gene))]
+        else:
+          remaining.append((position, region))
+      negatives = remaining
+
+      low, high = bisect.bisect_right(stops, bottom), bisect.bisect_left(starts, top)
+      replacements = []
+      for region in regions[low:high]:
+        for newRegion in filter(filterFunction, cut(region, bottom, top, gene)):
+          if newRegion.start < newRegion.stop:
+            replacements.append(newRegion)
+          else:
+            negatives.append((region.start, newRegion))
+      regions[low:high] = replacements
+      starts[low:high] = [region.start for region in replacements]
+      stops[low:high] = [region.stop for region in replacements]
+
+    positions = [(region.start, region) for region in regions] + negatives
+    positions.sort(key = lambda x: x[0])
+    return filter(filterFunction, [region for position, region in positions])
+
+  forwardIntervals, reverseIntervals = [], []
   for gene in genes:
-    intermediate = []
-    if gene.location[0] < gene.location[1]:
-      result = forwardResult
-      bottom, top = gene.location[0], gene.location[1]
-    else:
-      result = reverseResult
-      bottom, top = genomeLength-gene.location[0]+1, genomeLength-gene.location[1]+1
-    for region in result:
-      if bottom < region.stop and region.stop <= top:
-        intermediate += [Region(region.startGene, region.start, bottom, gene)]
-      elif bottom <= region.start and region.start < top:
-        intermediate += [Region(gene, top, region.stop, region.stopGene)]
-      elif region.start < bottom and top < region.stop:
-        intermediate += [Region(region.startGene, region.start, bottom, gene), Region(gene, top, region.stop, region.stopGene)]
-      else:
-        intermediate += [region]
     if gene.location[0] < gene.location[1]:
-      forwardResult = filter(filterFunction, intermediate)
+      forwardIntervals.append((gene.location[0], gene.location[1], gene))
     else:
-      reverseResult = filter(filterFunction, intermediate)
-    
-  forwardResult = filter(filterFunction, forwardResult)
-  reverseResult = filter(filterFunction, reverseResult)
-  return forwardResult, reverseResult
+      reverseIntervals.append((genomeLength-gene.location[0]+1, genomeLength-gene.location[1]+1, gene))
+  return strandRegions(forwardIntervals), strandRegions(reverseIntervals)
 
-def findPotentialGenes(genome, regions, minLength = 3):
+def findPotentialGenes(genome, regions, minLength = 3, index = None):
   """
   genome:    The genome as a string.
   region:    A list of intergenic regions.
   minLength: Minimum length of an intergenic gene.
+  index:     A sequences.CodonIndex of genome, built here if it isn't given.
 
   return:    A list of 2-tuples, each of which represents the start and stop of an intergenic gene.
   
   Searches for potential genes in regions.  Potential genes are found by starting at the end of the
   region if the end is not bracketed by a gene or the end of the region plus one half the length of
   the end bracketing gene if it is.  This function then steps backwords recording the last stop codon
-  encountered.  If a start codon is encountered then the start of the start codon and end of the stop codon
-  are saved in a tuple if the start codon comes before the stop of the gene that brackets the end of this region.
+  encountered.  If a start codon is encountered then it becomes the start of the gene ending at that stop codon
+  if the start codon comes before the stop of the gene that brackets the end of this region, so only the longest
+  gene ending at each stop codon is kept, the starts nested inside it are chosen between after the search, see alignedStarts.
   If a start or stop codon is encountered before the start of this region then then the search records the start and stop
-  if a start was found and terminates the search for this region.  This process is repeated on each region for each frame.
+  if a start was found and terminates the search for this region.  This process is repeated on each region for each frame,
+  and starts found before the first stop codon of a frame have no stop in the search and are skipped.
+  Only the start and stop codons are visited, they are looked up in the codon index rather than by stepping over every codon.
   The resulting coordinates are string coordinates(first nucleotide is at zero and the ending index is exclusive).
   """
+  if not index:
+    index = sequences.CodonIndex(genome)
   result = []
-  stop = None
   for region in regions:
     inset = abs(region.stopGene.location[1] - region.stopGene.location[0])/2 if region.stopGene else 0
     for frame in xrange(3):
-      for start in xrange(region.stop+frame+inset, 0, -3):
-        if genome[start-3:start] in utils.stopCodons:
-          stop = start
-          if start <= region.start:
+      stop, found = None, False
+      for position, isStart in index.upstream(region.stop+frame+inset-3):
+        if not isStart:
+          stop, found = position+3, False
+          if position+3 <= region.start:
             break
-        if genome[start-3:start] in utils.startCodons and stop and start < region.stop:
-          result.append((start-3, stop))
-          if start <= region.start:
+        elif stop and position+3 < region.stop:
+          if found:
+            result[-1] = (position, stop)
+          else:
+            result.append((position, stop))
+            found = True
+          if position+3 <= region.start:
             break
   return filter(lambda x: x[1]-x[0] > minLength, result)
                     
-def writePotentialGenes(genome, locations):
+def translatePotentialGenes(genome, locations):
   """
   genome:    The genome as a string.
   locations: A list of 2-tuples representing the locations of genes in string coordinates(first nucleotide is at zero and the ending index is exclusive).
-  
-  Writes all the genes in genome listed locations to "intergenic.fas".  The written
-  headers will contain fasta coordinates(first nucleotide is at one and the ending index is inclusive).
+
+  return:    A list of 2-tuples, the header and protein sequence of each gene.  The headers contain fasta coordinates(first
+             nucleotide is at one and the ending index is inclusive).
   """
-  output = open("intergenics.fas", "w")
+  result = []
   q = 0
   for location in locations:
     q += 1
     if location[0] < location[1]:
-      output.write(">intergenic~" + str(q) + ":" + str(location[0]+1) + "-" + str(location[1]) + "\n")
-      proteins = utils.translate(genome[location[0]:location[1]])
+      header = "intergenic~" + str(q) + ":" + str(location[0]+1) + "-" + str(location[1])
+      proteins = sequences.translate(genome[location[0]:location[1]])
+    else:
+      header = "intergenic~" + str(q) + ":" + str(location[0]) + "-" + str(location[1]+1)
+      proteins = sequences.translate(sequences.reverseComplement(genome[location[1]:location[0]]))
+    result.append((header, proteins))
+  return result
+
+def writePotentialGenes(genome, locations, fileName = "intergenics.fas"):
+  """
+  genome:    The genome as a string.
+  locations: A list of 2-tuples representing the locations of genes in string coordinates(first nucleotide is at zero and the ending index is exclusive).
+  fileName:  Name of the file to write.
+  
+  Writes all the genes in genome listed locations to fileName, "intergenics.fas" by default.  The written
+  headers will contain fasta coordinates(first nucleotide is at one and the ending index is inclusive).
+  """
+  utils.writeProteins(fileName, translatePotentialGenes(genome, locations))
+
+def alignedStarts(genome, genes):
+  """
+  genome: The genome as a string.
+  genes:  A dictionary that maps query names to Iteration objects, the results of searching for the longest gene
+          ending at each stop codon.
+
+  Moves the start of every gene with a hit to the last start codon in its frame that isn't past the first residue of
+  its best alignment, so the start codons nested in a gene are chosen between by where its alignment begins.  If the
+  alignment begins at the first residue the gene is left alone.
+  """
+  for gene in genes.values():
+    if not gene.numHits or gene.queryFrom <= 1:
+      continue
+    if gene.location[0] < gene.location[1]:
+      start = gene.location[0]-1
+      for i in xrange(gene.queryFrom-1, 0, -1):
+        if genome[start+3*i:start+3*i+3] in utils.startCodons:
+          gene.location[0] = start+3*i+1
+          break
     else:
-      output.write(">intergenic~" + str(q) + ":" + str(location[0]) + "-" + str(location[1]+1) + "\n")
-      proteins = utils.translate(utils.reverseComplement(genome[location[1]:location[0]]))
-    for i in xrange(0, len(proteins), 50):
-      output.write(proteins[i:min(i+50, len(proteins))] + "\n")
-  output.close()
+      start = gene.location[0]
+      for i in xrange(gene.queryFrom-1, 0, -1):
+        if sequences.reverseComplement(genome[start-3*i-3:start-3*i]) in utils.startCodons:
+          gene.location[0] = start-3*i
+          break
 
 def removeCommonStops(genes):
   """
@@ -168,11 +251,10 @@ def removeCommonStops(genes):
     result[temp.query] = temp
   return result
 
-def findIntergenics(query, genes, name, minLength, blast, database, eValue, pipeline):
+def findIntergenics(context, genes, minLength, blast, database, eValue, pipeline):
   """
-  query:     File name of the fasta file.
+  context:   A context.GenomeContext of the genome.
   genes:     A dictionary that maps query names to Iteration objects
-  name:      Name of the genome.
   minLength: Minimum length of any intergenic genes.
   blast:     Location of the installation of blast.
   database:  The database to use with blast.
@@ -181,22 +263,32 @@ def findIntergenics(query, genes, name, minLength, blast, database, eValue, pipe
   return:    A dictionary that maps query names to Iterations objects, only contains intergenic genes.
   
   Searches for intergenic genes within a genome.  First, all the intergenic regions in the genome are calculated and
-  any potential genes in those regions area extracted and written to "intergenics.fas".  This file is then blasted.
-  Then the genes in the result of this blast are pruned so that only one intergenic gene may stop at any one
-  location.  Finally, the remaining genes are flagged as intergenic and returned.
+  the longest potential gene ending at each stop codon in those regions is extracted and written to "intergenics.fas" in the workspace of the context.  If pipeline.prefilterSeeds is
+  set, genes with fewer seeds than that in every protein of the database are dropped first, see the prefilter module.  This file is then blasted.
+  The start of each gene with a hit is moved to the start codon nearest the beginning of its alignment, and then the genes
+  in the result of this blast are pruned so that only one intergenic gene may stop at any one location.  Finally, the remaining genes are flagged as intergenic and returned.
   """
-  genome = utils.loadGenome(query)
-  reverseComplementGenome = utils.reverseComplement(genome)
+  genome = context.genome
   openForwardLocations, openReverseLocations = calculateIntergenicRegions(len(genome), genes.values(), minLength)
   
-  potentialGenes = findPotentialGenes(genome, openForwardLocations, minLength)
-  reversePotentialGenes = findPotentialGenes(reverseComplementGenome, openReverseLocations, minLength)
+  potentialGenes = findPotentialGenes(genome, openForwardLocations, minLength, context.forwardIndex())
+  reversePotentialGenes = findPotentialGenes(context.reverseComplement(), openReverseLocations, minLength, context.reverseIndex())
   potentialGenes += map(lambda x: (len(genome)-x[0], len(genome)-x[1]), reversePotentialGenes)
   
-  writePotentialGenes(genome, potentialGenes)
+  proteins = translatePotentialGenes(genome, potentialGenes)
+  trace.count("intergenicCandidates", len(proteins))
+  if pipeline.prefilterSeeds:
+    candidates = len(proteins)
+    proteins = prefilter.filterProteins(proteins, blast, database, pipeline.prefilterSeeds, pipeline)
+    print "    Prefilter removed %d of %d intergenic candidates" % (candidates-len(proteins), candidates)
+  intergenicsFile = context.scratchFile("intergenics.fas")
+  utils.writeProteins(intergenicsFile, proteins)
+  trace.count("intergenicSearched", len(proteins))
   
-  result = utils.cachedBlast("intergenicBlasts/" + name + ".blastp.xml", blast, database, eValue, "intergenics.fas", pipeline)
-  os.remove("intergenics.fas")
+  backend = utils.stageBackend(pipeline, "intergenic")
+  result = utils.cachedBlast("intergenicBlasts/" + context.name + ".blastp" + backend.extension, blast, database, eValue, intergenicsFile, pipeline, backend = backend)
+  os.remove(intergenicsFile)
+  alignedStarts(genome, result)
   result = removeCommonStops(result)
   for r in result.values():
     r.intergenic = True
@@ -10,7 +10,10 @@ import sys
 import socket
 import threading
 from getopt import getopt
+from getopt import GetoptError
 from neofelis import pipeline
+from neofelis import promoters
+from neofelis import fasta
 from neofelis import utils
 from javax.swing import JFrame
 from javax.swing import JPanel
@@ -252,12 +255,25 @@ class Main():
 -n --no-swing              If any required arguments are missing then the program will exit instead of using a Swing interface to get the missing arguments
 -a --email                 Email address that will be emailed when query is processed.
 -z --trna-scan             Location of tRNAscan
+   --blast-layout          Number of blastp processes to run at once and threads per process, written as PROCESSESxTHREADS
+   --timeout               Seconds an external program may run for, written as PROGRAM:SECONDS where PROGRAM is genemark, blastp, transterm, or tRNAscan.  May be given more than once.
+   --search                Search backend a stage uses, written as STAGE:BACKEND where STAGE is initial, extension, or intergenic and BACKEND is xml, tabular, or local.  May be given more than once.
+   --prefilter-seeds       Number of sampled five residue words an intergenic candidate must share with one protein of the database to be searched for, see the prefilter module.  By default every candidate is searched for.
+   --extension-scoring     Where extensions of genes are searched for, database for the whole database or parents for only the proteins the genes hit.  Defaults to database.
+   --workers               Number of genomes to annotate at once, each one runs its own blastp processes.  Defaults to 1.
+   --trace                 File to write the trace of the run to, a JSON object per line for every stage and external program.  Defaults to a new file in traces.
+   --bprom-url             Address to request promoter predictions from instead of BPROM, such as a local stand-in.
 """
     try:
-      opts, args = getopt(arguments, "m:d:g:b:e:l:t:p:c:q:hsvna:z:", ["matrix=", "database=", "genemark=", "blast=", "e-value=", "min-length=", "transterm=", "promoter-score-cutoff=", "scaffolding-distance=", "query=", "help", "swing", "server", "no-swing", "email=", "trna-scan="])
+      opts, args = getopt(arguments, "m:d:g:b:e:l:t:p:c:q:hsvna:z:", ["matrix=", "database=", "genemark=", "blast=", "e-value=", "min-length=", "transterm=", "promoter-score-cutoff=", "scaffolding-distance=", "query=", "help", "swing", "server", "no-swing", "email=", "trna-scan=", "blast-layout=", "timeout=", "search=", "prefilter-seeds=", "extension-scoring=", "workers=", "trace=", "bprom-url="])
     except GetoptError:
       print documentation
       sys.exit(0)
+
+    def usageError(message):
+      print "ERROR:", message
+      print documentation
+      sys.exit(2)
         
     self.matrix = ""
     self.database = ""
@@ -275,6 +291,13 @@ class Main():
     self.email = ""
     self.remote = False
     self.server = False
+    self.blastLayout = None
+    self.timeouts = {}
+    self.searchBackends = {}
+    self.prefilterSeeds = 0
+    self.extensionScoring = "database"
+    self.workers = 1
+    self.traceFile = None
     
     for opt, arg in opts:
       if opt in ("-q", "--query"):
@@ -307,6 +330,28 @@ class Main():
         self.email = arg
       elif opt in ("-v", "--server"):
         self.server = True
+      elif opt == "--blast-layout":
+        self.blastLayout = tuple(map(int, arg.lower().split("x")))
+      elif opt == "--timeout":
+        program, seconds = arg.rsplit(":", 1)
+        self.timeouts[program] = float(seconds)
+      elif opt == "--search":
+        stage, backend = (arg.split(":", 1) + [""])[:2]
+        if stage not in utils.searchStages:
+          usageError("--search " + arg + ", STAGE must be one of " + ", ".join(utils.searchStages))
+        if backend not in utils.searchBackends:
+          usageError("--search " + arg + ", BACKEND must be one of " + ", ".join(sorted(utils.searchBackends.keys())))
+        self.searchBackends[stage] = backend
+      elif opt == "--prefilter-seeds":
+        self.prefilterSeeds = int(arg)
+      elif opt == "--extension-scoring":
+        self.extensionScoring = arg
+      elif opt == "--workers":
+        self.workers = int(arg)
+      elif opt == "--trace":
+        self.traceFile = arg
+      elif opt == "--bprom-url":
+        promoters.bpromURL = arg
       elif opt in ("-h", "--help"):
         print documentation
         sys.exit(0)
@@ -353,11 +398,11 @@ class Main():
       if os.path.isdir(source):
         newSources = map(lambda x: os.path.join(source, x), os.listdir(source))
         self.sources.extend(newSources)
-      elif utils.isGenome(source):
+      elif fasta.isGenome(source):
         self.queries.append(source)
         
     self.pipeline = pipeline.Pipeline()
-    self.pipeline.run(self.blastLocation, self.genemarkLocation, self.transtermLocation, self.tRNAscanLocation, self.database, self.eValue, self.matrix, self.minLength, self.scaffoldingDistance, self.promoterScoreCutoff, self.queries, self.swingInterface, self.email)
+    self.pipeline.run(self.blastLocation, self.genemarkLocation, self.transtermLocation, self.tRNAscanLocation, self.database, self.eValue, self.matrix, self.minLength, self.scaffoldingDistance, self.promoterScoreCutoff, self.queries, self.swingInterface, self.email, self.blastLayout, self.timeouts, self.searchBackends, self.prefilterSeeds, self.extensionScoring, self.workers, self.traceFile)
 
 if __name__ == "__main__":
   Main().run(sys.argv)
@@ -4,20 +4,30 @@ The central component of the Neofelis pipeline.
 
 import os
 import sys
+import time
+import Queue
+import shutil
+import tempfile
+import threading
 import subprocess
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from neofelis import genemark
 from neofelis import extend
 from neofelis import intergenic
+from neofelis import prefilter
 from neofelis import promoters
 from neofelis import terminators
 from neofelis import artemis
 from neofelis import utils
+from neofelis import fasta
+from neofelis import context
 from neofelis import scaffolds
 from neofelis import signals
 from neofelis import report
 from neofelis import rna
+from neofelis import scheduler
+from neofelis import trace
 from javax.swing import JFrame
 from javax.swing import JPanel
 from javax.swing import JLabel
@@ -28,6 +38,14 @@ from java.awt.event import WindowAdapter
 from java.awt import GridBagLayout
 from java.awt import GridBagConstraints
 
+#Have to make sure that a directory to hold the scratch files of each genome exists.
+if not os.path.isdir("workspaces"):
+  os.mkdir("workspaces")
+
+#Have to make sure that a directory to save the outputs of the stages of each genome in exists.
+if not os.path.isdir("checkpoints"):
+  os.mkdir("checkpoints")
+
 class PipelineException(Exception):
   """
   Used to terminate the pipeline early.
@@ -69,6 +87,10 @@ class Pipeline():
     self.currentJob = ""
     #Keeps track of the massage to be displayed.
     self.message = 0
+    #Maps each query that has been started to the number of messages displayed for it, less one.
+    self.jobMessages = {}
+    #Held while progress is updated, queries may be processed by several threads at once.
+    self.progressLock = threading.Lock()
     #Messages to be displayed at each stage in the processing of a single query.
     self.messages = ["Searching for genes via genemark",
                      "Extending genes found via genemark",
@@ -81,6 +103,22 @@ class Pipeline():
                      "Writing Artemis file",
                      "Writing summary .xml, .html, and .xls files"]
     self.exception = None
+    #Number of blastp processes to run at once and the number of threads each one uses.
+    self.blastProcesses, self.blastThreads = utils.defaultBlastLayout()
+    #Maps the names of external programs to the number of seconds they may run for.
+    self.timeouts = {}
+    #Maps the names of the search stages(initial, extension, intergenic) to the names of the search backends they use, see utils.searchBackends.
+    self.searchBackends = {}
+    #Number of seeds an intergenic candidate needs in the database to be searched for, if 0 then every candidate is searched for.
+    self.prefilterSeeds = 0
+    #How extensions are scored, "database" searches the whole database and "parents" only the proteins the genes being extended hit.
+    self.extensionScoring = "database"
+    #Records of every external program run, processes.Invocation objects.
+    self.invocations = []
+    #Number of genomes annotated at once.
+    self.workers = 1
+    #The trace.Trace of the current run.
+    self.trace = None
 
   def initializeDisplay(self, queries, swing):
     """
@@ -131,38 +169,39 @@ class Pipeline():
       self.frame.setLocationRelativeTo(None)
       self.frame.setVisible(True)
 
-  def updateProgress(self, job):
+  def updateProgress(self, job, message = None):
     """
-    query: Name of the query currently being processed.
+    query:   Name of the query currently being processed.
+    message: Index of the message in messages to display, if None then the message after the last one displayed for job.
     
-    This function use used for updating the progress shown in the interface.  If job is not equal to currentJob then
-    global progress is incremented and shown and the currentProgress is reset and shown.  If job is equal to currentJob
-    then the globalProgress does not change and currentProgress is increased.
+    This function use used for updating the progress shown in the interface.  If job hasn't been seen before then
+    global progress is incremented and shown and the currentProgress is reset and shown.  Otherwise the globalProgress
+    does not change and the currentProgress of job is increased.  When several queries are processed at once each message
+    is labeled with the name of its query and the swing interface shows the query that was updated last.  Stages of a
+    query that run at the same time may start in any order, so the progress of a query counts the messages displayed for it.
     """
     if self.exception:
       raise self.exception
-    
-    if self.frame:
-      if job != self.currentJob:
-        self.currentProgress.setValue(self.currentProgress.getMaximum())
-        self.globalLabel.setText(job)
-        self.globalProgress.setValue(self.jobCount)
-        print "Processing %s, %.2f%% done" % (job, 100.0*self.jobCount/self.numJobs)
-        self.jobCount += 1
-        self.currentJob = job
-        self.message = -1
-      self.message += 1
-      print "    %s, %.2f%% done" % (self.messages[self.message], 100.0*self.message/len(self.messages))
-      self.currentProgress.setValue(self.message)
-      self.currentLabel.setText(self.messages[self.message])
-    else:
-      if job != self.currentJob:
+
+    self.progressLock.acquire()
+    try:
+      if job not in self.jobMessages:
         print "Processing %s, %.2f%% done" % (job, 100.0*self.jobCount/self.numJobs)
         self.jobCount += 1
-        self.currentJob = job
-        self.message = -1
-      self.message += 1
-      print "    %s, %.2f%% done" % (self.messages[self.message], 100.0*self.message/len(self.messages))
+        self.jobMessages[job] = -1
+        if self.frame:
+          self.globalProgress.setValue(self.jobCount-1)
+      self.jobMessages[job] += 1
+      self.currentJob = job
+      self.message = self.jobMessages[job] if message is None else message
+      label = "    " + os.path.basename(job) + ": " if self.workers > 1 else "    "
+      print "%s%s, %.2f%% done" % (label, self.messages[self.message], 100.0*self.jobMessages[job]/len(self.messages))
+      if self.frame:
+        self.globalLabel.setText(job)
+        self.currentProgress.setValue(self.jobMessages[job])
+        self.currentLabel.setText(self.messages[self.message])
+    finally:
+      self.progressLock.release()
 
   def finished(self):
     """
@@ -179,7 +218,7 @@ class Pipeline():
       while self.frame.isVisible():
         pass
 
-  def run(self, blastLocation, genemarkLocation, transtermLocation, tRNAscanLocation, database, eValue, matrix, minLength, scaffoldingDistance, promoterScoreCutoff, queries, swing = False, email = ""):
+  def run(self, blastLocation, genemarkLocation, transtermLocation, tRNAscanLocation, database, eValue, matrix, minLength, scaffoldingDistance, promoterScoreCutoff, queries, swing = False, email = "", blastLayout = None, timeouts = None, searchBackends = None, prefilterSeeds = None, extensionScoring = None, workers = None, traceFile = None):
     """
     blastLocation:       Directory blast was installed in.
     genemarkLocation:    Directory genemark was installed in.
@@ -194,6 +233,16 @@ class Pipeline():
     queries:             A list of faster files to process.
     swing:               If true a swing window will be used to updated the user about the pipeline's progress.
     email:               If this is a non-empty string an email will be sent to the address in the string when the pipeline is done.  This will be attempted with the sendmail command on the local computer.
+    blastLayout:         A 2-tuple, the number of blastp processes to run at once and the number of threads for each.  If None then utils.defaultBlastLayout is used.
+    timeouts:            A dictionary that maps the names of external programs(genemark, blastp, transterm, tRNAscan) to the number of seconds they may run for.
+    searchBackends:      A dictionary that maps the names of search stages(initial, extension, intergenic) to the names of the search backends(xml, tabular, local) they use.
+                         Stages that aren't in the dictionary use xml, only stages that use xml have their alignments in the report.
+    prefilterSeeds:      Number of sampled words an intergenic candidate must share with one protein of the database to be searched for, see the prefilter module.
+                         If None or 0 then every candidate is searched for.
+    extensionScoring:    "database" to search for extensions in the whole database, or "parents" to search only the proteins the genes being extended hit.
+                         If None then the whole database is searched.
+    workers:             Number of genomes to annotate at once.  If None then one genome is annotated at a time.
+    traceFile:           Name of the file to write the trace of the run to.  If None then it is written to a new file in traces.
     
     The main pipeline function.  For every query genemark is used to predict genes, these genes are then extended to any preferable starts.  Then the pipeline searches
     for any intergenic genes(genes between those found by genemark) and these are combined with the extended genemark genes.  Then the genes are pruned to remove
@@ -201,59 +250,151 @@ class Pipeline():
     signals which are inside or too far away from any genes.  Next, tRNAscan is used to find any transfer RNAs in the genome.  Finally, all the remaining genes,
     promoters, and terminators are written to an artemis file in the directory of the query with the same name but with a .art extension, and .xml, .html, and
     .xls files will be generating describing the blast results of the final genes.
+
+    The results of a query are kept under the name of its file without the directory, so queries in different directories
+    with the same name would overwrite each other's results and a ValueError is raised before anything is run.  The queries
+    are handed out largest first to workers threads, each query gets its own directory in workspaces for its scratch
+    files, which is removed once the query is done.  If annotating a query fails the other queries are stopped and the error is raised.
+    Each query is loaded once into a context.GenomeContext that every stage shares, its fasta file is only written to the workspace
+    when a stage that runs an external program on it needs one.
+
+    The stages of each query are run by the scheduler module, which saves the outputs of every stage in checkpoints under a key
+    made from the genome, the settings, and the outputs of the stages before it.  A stage whose key has a checkpoint isn't run
+    again, so a query that was interrupted resumes after its last finished stage and a query that was already annotated with the
+    same settings finishes immediately.
+
+    A trace of the run is written as JSON lines, see the trace module.  There is a record of every stage of every query with
+    its wall and cpu times, the bytes it read and wrote, and counts of what it found and searched for, a record of every external
+    program a stage ran, a record of every query once it is annotated with its throughput in megabase pairs per hour, and a
+    record of the whole run.
     """
+    queries = reduce(lambda x, y: x + [y] if os.path.abspath(y) not in map(os.path.abspath, x) else x, queries, [])
+    names = {}
+    for query in queries:
+      name = os.path.basename(fasta.stripExtension(query))
+      if name in names:
+        raise ValueError("Queries " + names[name] + " and " + query + " are both named " + name + ", their results would be written to the same files")
+      names[name] = query
     self.initializeDisplay(queries, swing)
+    if blastLayout:
+      self.blastProcesses, self.blastThreads = blastLayout
+    if timeouts:
+      self.timeouts = timeouts
+    if searchBackends:
+      self.searchBackends = searchBackends
+    if prefilterSeeds:
+      self.prefilterSeeds = prefilterSeeds
+    if extensionScoring:
+      self.extensionScoring = extensionScoring
+    if workers:
+      self.workers = workers
+    self.trace = trace.Trace(traceFile) if traceFile else trace.newTrace()
 
-    try:
-      for query in queries:
-        name = os.path.splitext(query)[0]
-        queryDirectory, name = os.path.split(name)
-        
-        genome = utils.loadGenome(query)
-        swapFileName = "query" + str(id(self)) + ".fas"
-        queryFile = open(swapFileName, "w")
-        queryFile.write(">" + name + "\n")
-        for i in range(0, len(genome), 50):
-          queryFile.write(genome[i:min(i+50, len(genome))] + "\n")
-        queryFile.close()
-
-        self.updateProgress(query)
-        initialGenes = genemark.findGenes(swapFileName, name, blastLocation, database, eValue, genemarkLocation, matrix, self)
+    def annotate(query, workspace):
+      name = fasta.stripExtension(query)
+      queryDirectory, name = os.path.split(name)
       
-        self.updateProgress(query)
-        extendedGenes = extend.extendGenes(swapFileName, initialGenes, name, blastLocation, database, eValue, self)
-    
-        self.updateProgress(query)
-        intergenicGenes = intergenic.findIntergenics(swapFileName, extendedGenes, name, minLength, blastLocation, database, eValue, self)
+      start = time.time()
+      genome = context.loadContext(query, workspace)
 
+      def refineGenes(extendedGenes, intergenicGenes):
         genes = {}
         for k, v in extendedGenes.items() + intergenicGenes.items():
           genes[k] = v
-        
-        self.updateProgress(query)
-        scaffolded = scaffolds.refineScaffolds(genes, scaffoldingDistance)
- 
-        self.updateProgress(query)
-        initialPromoters = promoters.findPromoters(swapFileName, name, promoterScoreCutoff, self.frame)
-    
-        self.updateProgress(query)
-        initialTerminators = terminators.findTerminators(swapFileName, name, genes.values(), transtermLocation)
-      
-        self.updateProgress(query)
+        return genes, scaffolds.refineScaffolds(genes, scaffoldingDistance)
+
+      def filterSignals(scaffolded, initialPromoters, initialTerminators):
         filteredSignals = signals.filterSignals(scaffolded.values(), initialPromoters + initialTerminators)
         filteredPromoters = filter(lambda x: isinstance(x, promoters.Promoter), filteredSignals)
         filteredTerminators = filter(lambda x: isinstance(x, terminators.Terminator), filteredSignals)
+        trace.count("signalsKept", len(filteredSignals))
+        trace.count("signalsDropped", len(initialPromoters) + len(initialTerminators) - len(filteredSignals))
+        return filteredPromoters, filteredTerminators
 
-        self.updateProgress(query)
-        transferRNAs = rna.findtRNAs(tRNAscanLocation, swapFileName)
+      output = fasta.stripExtension(query)
+      sources = []
+      for stage, directory in (("initial", "initialBlasts"), ("extension", "extendedBlasts"), ("intergenic", "intergenicBlasts")):
+        if utils.stageBackend(self, stage).extension == ".xml":
+          sources.append(directory + "/" + name + ".blastp.xml")
+      reportFiles = [output + ".xls"] + ([output + ".blastp.xml", output + ".blastp.html"] if sources else [])
+      def searchParameters(stage):
+        return (name, blastLocation, database, eValue, utils.stageBackend(self, stage).name)
+      def searchFiles(stage, directory):
+        return [directory + "/" + name + ".blastp" + utils.stageBackend(self, stage).extension]
 
-        os.remove(swapFileName)
+      #The stages are in the order of messages.  Promoters and transfer RNAs only depend on the genome, so they are found while
+      #the genes are.  The parameters of each stage are the settings its outputs depend on, and every stage that writes a file
+      #lists it, so a stage is only restored from its checkpoint if its settings are the same and its files still exist.  The
+      #locations of the external programs are settings too, another installation may be another version that finds other
+      #genes, and with no matrix genemark uses the default model of its installation.  The genome is a
+      #context.GenomeContext shared by every stage, it only writes a fasta file for the stages that need one.
+      stages = [scheduler.Stage("genemark", lambda genome: genemark.findGenes(genome, blastLocation, database, eValue, genemarkLocation, matrix, self),
+                                ["genome"], ["initialGenes"], searchParameters("initial") + (genemarkLocation, matrix), searchFiles("initial", "initialBlasts")),
+                scheduler.Stage("extend", lambda genome, initialGenes: extend.extendGenes(genome, initialGenes, blastLocation, database, eValue, self),
+                                ["genome", "initialGenes"], ["extendedGenes"], searchParameters("extension") + (self.extensionScoring,), searchFiles("extension", "extendedBlasts")),
+                scheduler.Stage("intergenic", lambda genome, extendedGenes: intergenic.findIntergenics(genome, extendedGenes, minLength, blastLocation, database, eValue, self),
+                                ["genome", "extendedGenes"], ["intergenicGenes"], searchParameters("intergenic") + (minLength, self.prefilterSeeds, prefilter.indexVersion), searchFiles("intergenic", "intergenicBlasts")),
+                scheduler.Stage("scaffolds", refineGenes,
+                                ["extendedGenes", "intergenicGenes"], ["genes", "scaffolded"], scaffoldingDistance),
+                scheduler.Stage("promoters", lambda genome: promoters.findPromoters(genome, promoterScoreCutoff, self.frame),
+                                ["genome"], ["initialPromoters"], (name, promoterScoreCutoff, promoters.bpromURL)),
+                scheduler.Stage("terminators", lambda genome, genes: terminators.findTerminators(genome, genes.values(), transtermLocation, self),
+                                ["genome", "genes"], ["initialTerminators"], (name, transtermLocation)),
+                scheduler.Stage("signals", filterSignals,
+                                ["scaffolded", "initialPromoters", "initialTerminators"], ["filteredPromoters", "filteredTerminators"]),
+                scheduler.Stage("tRNAscan", lambda genome: rna.findtRNAs(tRNAscanLocation, genome, self),
+                                ["genome"], ["transferRNAs"], tRNAscanLocation),
+                scheduler.Stage("artemis", lambda genome, scaffolded, filteredPromoters, filteredTerminators, transferRNAs:
+                                             artemis.writeArtemisFile(output + ".art", genome.genome, scaffolded.values(), filteredPromoters, filteredTerminators, transferRNAs),
+                                ["genome", "scaffolded", "filteredPromoters", "filteredTerminators", "transferRNAs"], [], output, [output + ".art"]),
+                scheduler.Stage("report", lambda scaffolded: report.report(name, scaffolded, output, sources),
+                                ["scaffolded"], [], (name, output, sources), reportFiles)]
+      for stage in stages:
+        stage.function = self.trace.traced(stage.function, stage.name, name)
+      def started(stage, restored):
+        if restored:
+          self.trace.restored(stage.name, name)
+        self.updateProgress(query, stages.index(stage))
+      scheduler.runStages(stages, {"genome" : genome}, self, "checkpoints", started)
+      self.trace.annotatedGenome(name, genome.length, time.time() - start)
 
-        self.updateProgress(query)
-        artemis.writeArtemisFile(os.path.splitext(query)[0] + ".art", genome, scaffolded.values(), filteredPromoters, filteredTerminators, transferRNAs)
+    jobs = Queue.Queue()
+    for query in sorted(queries, key = os.path.getsize, reverse = True):
+      jobs.put(query)
+    failures = []
+    def work():
+      while not self.exception:
+        try:
+          query = jobs.get_nowait()
+        except Queue.Empty:
+          return
+        workspace = tempfile.mkdtemp(prefix = os.path.basename(fasta.stripExtension(query)) + ".", dir = "workspaces")
+        try:
+          annotate(query, workspace)
+        except Exception, e:
+          if not isinstance(e, PipelineException):
+            failures.append(sys.exc_info())
+          if not self.exception:
+            self.exception = e
+        finally:
+          shutil.rmtree(workspace)
 
-        self.updateProgress(query)
-        report.report(name, scaffolded, os.path.splitext(query)[0])
+    try:
+      threads = [threading.Thread(target = work) for i in xrange(max(1, min(self.workers, len(queries))))]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+      if not self.exception:
+        self.trace.close("finished")
+      elif isinstance(self.exception, PipelineException):
+        self.trace.close("cancelled")
+      else:
+        self.trace.close("failed")
+      if failures:
+        raise failures[0][0], failures[0][1], failures[0][2]
+      if self.exception:
+        raise self.exception
 
       if email:
         if not os.path.isfile("EMAIL_MESSAGE"):
@@ -0,0 +1,336 @@
+"""
+This module removes intergenic candidates that can't have a hit in the database before they are searched for.  The
+words of wordLength residues in every protein of the database are indexed, each word with the numbers of the proteins
+it occurs in, and a candidate is only kept if enough of its words, its seeds, occur in one protein of the database.
+
+Only one word in sampleRate is indexed, the same words in the database and in the candidates, so a candidate's seeds
+are the sampled words it shares with a protein.  Words in more than maximumPostings proteins are saturated and left out
+of the index, they tell proteins apart no better than chance.  A database large enough for most of its words to be
+saturated, like nr, can't be prefiltered with words this short and every candidate is kept.  Whether a database is
+saturated is estimated before it is indexed, see estimateSaturation, so a database that can't be prefiltered isn't read
+in full.  The index, or the estimate of a saturated database, is made once per database and saved.
+"""
+
+import os
+import re
+import array
+import hashlib
+import cPickle
+import threading
+from neofelis import utils
+from neofelis import fasta
+
+"""Directory the indexes of databases are saved in."""
+indexDirectory = "prefilterIndexes"
+
+#Have to make sure that a directory to store the indexes exists.
+if not os.path.isdir(indexDirectory):
+  os.mkdir(indexDirectory)
+
+"""Version of the saved index format, bump it whenever the index changes."""
+indexVersion = 3
+
+"""Residues words are made of, words containing any other residue are skipped."""
+residues = "ACDEFGHIKLMNPQRSTVWY"
+residueCodes = dict([(residues[i], i) for i in xrange(len(residues))])
+
+"""Length of the words in the index, words are numbered from 0 to len(residues)**wordLength."""
+wordLength = 5
+wordCount = len(residues)**wordLength
+
+"""One word in this many is indexed, which words is fixed by their numbers, see sampledWords."""
+sampleRate = 4
+
+"""Words that occur in more proteins than this are saturated and aren't indexed."""
+maximumPostings = 2000
+
+"""Fraction of the word occurrences of the database in saturated words above which the database isn't prefiltered."""
+maximumSaturation = 0.5
+
+"""Number of proteins, spread evenly over the database, the saturation of a database is estimated from."""
+sampleProteins = 10000
+
+"""Held while an index is loaded or built, so genomes annotated at once build an index only once."""
+indexLock = threading.Lock()
+
+def wordCodes(sequence):
+  """
+  sequence: A protein sequence.
+
+  return:   A list of the number of every word in sequence made only of residues.
+  """
+  codes = []
+  code, length = 0, 0
+  for residue in sequence:
+    value = residueCodes.get(residue)
+    if value is None:
+      code, length = 0, 0
+      continue
+    code = (code*len(residues) + value) % wordCount
+    length += 1
+    if length >= wordLength:
+      codes.append(code)
+  return codes
+
+def sampledWords(sequence):
+  """
+  sequence: A protein sequence.
+
+  return:   A list of the distinct words in sequence that are indexed.  The numbers of the words are scrambled before
+            one in sampleRate is picked so the picked words aren't the ones that end in a few residues.
+  """
+  return dict([(code, True) for code in wordCodes(sequence) if code*613 % 65521 % sampleRate == 0]).keys()
+
+class Index():
+  """
+  The words of a database and the proteins they occur in.  The proteins of word code are
+  postings[offsets[code]:offsets[code+1]], an empty range for saturated words and words that aren't sampled.  The
+  index of a database found to be saturated before it was indexed has no offsets or postings, only the estimated
+  occurrences.
+  """
+  def __init__(self, offsets, postings, proteins, occurrences, saturatedOccurrences):
+    """
+    offsets:              An array of wordCount+1 offsets into postings.
+    postings:             An array of the numbers of proteins.
+    proteins:             Number of proteins in the database.
+    occurrences:          Number of distinct sampled words in every protein of the database, summed.
+    saturatedOccurrences: How many of those occurrences are of saturated words.
+    """
+    self.offsets = offsets
+    self.postings = postings
+    self.proteins = proteins
+    self.occurrences = occurrences
+    self.saturatedOccurrences = saturatedOccurrences
+
+  def saturation(self):
+    """
+    return: Fraction of the word occurrences of the database that are in saturated words.
+    """
+    if not self.occurrences:
+      return 0.0
+    return float(self.saturatedOccurrences)/self.occurrences
+
+  def seeds(self, sequence, needed):
+    """
+    sequence: A protein sequence.
+    needed:   Number of seeds to look for.
+
+    return:   The most seeds sequence shares with any one protein of the database, counting stops once needed are found.
+    """
+    counts, best = {}, 0
+    for code in sampledWords(sequence):
+      for i in xrange(self.offsets[code], self.offsets[code+1]):
+        protein = self.postings[i]
+        count = counts.get(protein, 0) + 1
+        counts[protein] = count
+        if count > best:
+          best = count
+          if best >= needed:
+            return best
+    return best
+
+def databaseSignature(database):
+  """
+  database: The database to index.
+
+  return:   A tuple identifying the current contents of the database, the names, sizes, and modification times
+            of its files.
+  """
+  directory, base = os.path.split(database)
+  if os.path.isdir(database):
+    directory = database
+  names = sorted(filter(lambda x: x.startswith(base), os.listdir(directory or ".")))
+  return (indexVersion, wordLength, sampleRate, maximumPostings, tuple([(name, os.path.getsize(os.path.join(directory, name)), os.path.getmtime(os.path.join(directory, name))) for name in names]))
+
+def databaseSize(blastLocation, database, pipeline):
+  """
+  blastLocation: Location of the blast installation.
+  database:      The database to measure.
+  pipeline:      The pipeline running the prefilter.
+
+  return:        A 2-tuple, the number of proteins and of residues in database, from blastdbcmd -info or, for a fasta
+                 database, see utils.localDatabase, by reading it.
+  """
+  if os.path.isfile(utils.localDatabase(database)):
+    proteins, residues = 0, 0
+    for header, sequence in fasta.readFasta(utils.localDatabase(database), fasta.proteinPattern):
+      proteins += 1
+      residues += len(sequence)
+    return proteins, residues
+  output = utils.runBlastProgram("blastdbcmd", [blastLocation + "/bin/blastdbcmd", "-db", os.path.split(database)[1], "-info"], pipeline, database).output
+  proteins = re.search(r"([\d,]+) sequences", output)
+  residues = re.search(r"([\d,]+) total (letters|residues)", output)
+  if not proteins or not residues:
+    raise utils.BlastError("blastdbcmd -info didn't report the size of " + database)
+  return int(proteins.group(1).replace(",", "")), int(residues.group(1).replace(",", ""))
+
+def dumpDatabase(blastLocation, database, pipeline):
+  """
+  blastLocation: Location of the blast installation.
+  database:      The database to read.
+  pipeline:      The pipeline running the prefilter.
+
+  return:        Name of a file the sequences of database are dumped to one per line with blastdbcmd, or None if database
+                 is a fasta database, see utils.localDatabase, which is read directly.  A utils.BlastError is raised
+                 if blastdbcmd fails.
+  """
+  if os.path.isfile(utils.localDatabase(database)):
+    return None
+  dumpFile = os.path.abspath(os.path.join(indexDirectory, "sequences" + str(id(pipeline)) + ".txt"))
+  try:
+    utils.runBlastProgram("blastdbcmd", [blastLocation + "/bin/blastdbcmd", "-db", os.path.split(database)[1], "-entry", "all", "-outfmt", "%s", "-out", dumpFile], pipeline, database)
+  except:
+    if os.path.isfile(dumpFile):
+      os.remove(dumpFile)
+    raise
+  return dumpFile
+
+def databaseSequences(database, dumpFile):
+  """
+  database: The database to read.
+  dumpFile: The file returned by dumpDatabase.
+
+  return:   A generator of the sequences of every protein in database.
+  """
+  if dumpFile is None:
+    for header, sequence in fasta.readFasta(utils.localDatabase(database), fasta.proteinPattern):
+      yield sequence
+    return
+  input = open(dumpFile, "r")
+  for line in input:
+    yield line.strip().upper()
+  input.close()
+
+def estimateSaturation(database, dumpFile, proteins):
+  """
+  database: The database to estimate the saturation of.
+  dumpFile: The file returned by dumpDatabase.
+  proteins: Number of proteins in database.
+
+  return:   A 2-tuple, the estimated number of occurrences of sampled words in database and how many of them are of
+            saturated words.  The words of sampleProteins proteins spread evenly over the database are counted and each
+            count is scaled up to the whole database.
+  """
+  step = max(1, proteins/sampleProteins)
+  counts, sampled, protein = {}, 0, 0
+  for sequence in databaseSequences(database, dumpFile):
+    if protein % step == 0:
+      sampled += 1
+      for code in sampledWords(sequence):
+        counts[code] = counts.get(code, 0) + 1
+    protein += 1
+  if not sampled:
+    return 0, 0
+  scale = float(proteins)/sampled
+  occurrences = sum(counts.values())*scale
+  saturatedOccurrences = sum([count for count in counts.values() if count*scale > maximumPostings])*scale
+  return int(occurrences), int(saturatedOccurrences)
+
+def buildIndex(blastLocation, database, pipeline):
+  """
+  blastLocation: Location of the blast installation.
+  database:      The database to index.
+  pipeline:      The pipeline running the prefilter.
+
+  return:        An Index of database.
+
+  If the database has so many residues that the sampled words would occur in more than maximumPostings proteins on
+  average it is saturated whatever its proteins are, and an Index of that estimate is returned without reading the
+  database.  Otherwise the database is dumped and its saturation is estimated from a sample, see estimateSaturation,
+  and only if it is at most maximumSaturation is it indexed.  The database is read twice, the proteins of every word are
+  counted first so the postings of all the words can be laid out in one array, then the postings are filled in.
+  """
+  proteins, residues = databaseSize(blastLocation, database, pipeline)
+  if residues/float(wordCount) > maximumPostings:
+    return Index(array.array("i"), array.array("i"), proteins, residues/sampleRate, residues/sampleRate)
+  dumpFile = dumpDatabase(blastLocation, database, pipeline)
+  try:
+    occurrences, saturatedOccurrences = estimateSaturation(database, dumpFile, proteins)
+    if occurrences and float(saturatedOccurrences)/occurrences > maximumSaturation:
+      return Index(array.array("i"), array.array("i"), proteins, occurrences, saturatedOccurrences)
+
+    counts = array.array("i", [0])*wordCount
+    proteins = 0
+    for sequence in databaseSequences(database, dumpFile):
+      proteins += 1
+      for code in sampledWords(sequence):
+        counts[code] += 1
+
+    offsets = array.array("i", [0])*(wordCount+1)
+    occurrences, saturatedOccurrences, total = 0, 0, 0
+    for code in xrange(wordCount):
+      offsets[code] = total
+      occurrences += counts[code]
+      if counts[code] > maximumPostings:
+        saturatedOccurrences += counts[code]
+      else:
+        total += counts[code]
+    offsets[wordCount] = total
+
+    postings = array.array("i", [0])*total
+    ends = offsets[:-1]
+    protein = 0
+    for sequence in databaseSequences(database, dumpFile):
+      for code in sampledWords(sequence):
+        if ends[code] < offsets[code+1]:
+          postings[ends[code]] = protein
+          ends[code] += 1
+      protein += 1
+  finally:
+    if dumpFile:
+      os.remove(dumpFile)
+  return Index(offsets, postings, proteins, occurrences, saturatedOccurrences)
+
+def loadIndex(blastLocation, database, pipeline):
+  """
+  blastLocation: Location of the blast installation.
+  database:      The database to index.
+  pipeline:      The pipeline running the prefilter.
+
+  return:        The index of database, see buildIndex.  A saved index is used if it matches the current database,
+                 otherwise the index is built and saved.
+  """
+  fileName = os.path.join(indexDirectory, hashlib.sha1(os.path.abspath(database)).hexdigest() + ".index")
+  signature = databaseSignature(database)
+  if os.path.isfile(fileName):
+    input = open(fileName, "rb")
+    try:
+      saved = cPickle.load(input)
+    except Exception:
+      saved = None
+    input.close()
+    if saved and saved[0] == signature:
+      offsets, postings = array.array("i"), array.array("i")
+      offsets.fromstring(saved[1])
+      postings.fromstring(saved[2])
+      return Index(offsets, postings, saved[3], saved[4], saved[5])
+  index = buildIndex(blastLocation, database, pipeline)
+  output = open(fileName + ".tmp", "wb")
+  cPickle.dump((signature, index.offsets.tostring(), index.postings.tostring(), index.proteins, index.occurrences, index.saturatedOccurrences), output, 2)
+  output.close()
+  if os.path.isfile(fileName):
+    os.remove(fileName)
+  os.rename(fileName + ".tmp", fileName)
+  return index
+
+def filterProteins(proteins, blastLocation, database, seeds, pipeline):
+  """
+  proteins:      A list of 2-tuples, the header and sequence of each candidate protein.
+  blastLocation: Location of the blast installation.
+  database:      The database the proteins will be searched for in.
+  seeds:         Number of seeds a protein needs to share with one protein of the database to be kept.
+  pipeline:      The pipeline running the prefilter.
+
+  return:        A list of the proteins with at least seeds seeds, in their original order.  If more than
+                 maximumSaturation of the word occurrences of the database are saturated every protein is returned.
+  """
+  indexLock.acquire()
+  try:
+    index = loadIndex(blastLocation, database, pipeline)
+  finally:
+    indexLock.release()
+  print "    Prefilter index of %d proteins, %.1f%% of word occurrences saturated" % (index.proteins, 100*index.saturation())
+  if index.saturation() > maximumSaturation:
+    print "    Prefilter skipped, the database is too large for words of %d residues to tell its proteins apart" % wordLength
+    return proteins
+  return filter(lambda x: index.seeds(x[1], seeds) >= seeds, proteins)
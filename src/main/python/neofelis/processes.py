@@ -0,0 +1,231 @@
+"""
+This module runs the external programs the pipeline depends on, genemark, blastp, transterm, and tRNAscan.
+Every program is started in its own process group so it can be cancelled along with any children it spawned,
+its output is drained by background threads, and the resources it used are recorded and added to the trace of the run.
+"""
+
+import os
+import re
+import time
+import threading
+import subprocess
+from neofelis import trace
+
+"""Longest time between checks for cancellation, timeouts, and resource use while a program runs."""
+pollInterval = 0.5
+
+"""Seconds between samples of the cpu time and memory use of a running program."""
+sampleInterval = 2
+
+"""Seconds a cancelled process group has to exit after SIGTERM before it is sent SIGKILL."""
+killGrace = 5
+
+"""Clock ticks per second used by the cpu times in /proc."""
+clockTicks = 100
+
+def findExecutable(name):
+  """
+  Returns the full path of the executable name on the PATH, or None if there isn't one.
+  """
+  for directory in os.getenv("PATH", "").split(os.pathsep):
+    if os.path.isfile(os.path.join(directory, name)):
+      return os.path.join(directory, name)
+  return None
+
+"""
+Commands are prefixed with this to run them as the leader of a new process group.  The shell reports its pid,
+which is the id of the new group, on the first line of stderr and then replaces itself with the command.
+"""
+setsid = findExecutable("setsid")
+groupLauncher = [setsid, "/bin/sh", "-c", "echo $$ >&2; exec \"$0\" \"$@\""] if setsid else []
+
+class ProcessTimeout(Exception):
+  """
+  Raised when a program runs for longer than its timeout.
+  """
+  def __init__(self, name, timeout):
+    Exception.__init__(self, name + " did not finish within " + str(timeout) + " seconds")
+
+class Invocation():
+  """
+  Record of one run of an external program.
+  """
+  def __init__(self, name, command):
+    self.name = name
+    self.command = command
+    self.returnCode = None
+    self.output = ""
+    self.errors = ""
+    self.wallTime = 0
+    self.cpuTime = 0
+    self.peakMemory = 0
+    self.bytesRead = 0
+    self.bytesWritten = 0
+
+  def __str__(self):
+    result = "<"
+    result += "Name = " + str(self.name) + ", "
+    result += "ReturnCode = " + str(self.returnCode) + ", "
+    result += "WallTime = " + str(self.wallTime) + ", "
+    result += "CPUTime = " + str(self.cpuTime) + ", "
+    result += "PeakMemory = " + str(self.peakMemory) + ", "
+    result += "BytesRead = " + str(self.bytesRead) + ", "
+    result += "BytesWritten = " + str(self.bytesWritten)
+    result += ">"
+    return result
+
+class Drain(threading.Thread):
+  """
+  Thread that reads a stream until it is closed with blocking reads, collecting what it reads.
+  """
+  def __init__(self, stream):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.stream = stream
+    self.chunks = []
+
+  def run(self):
+    chunk = self.stream.read(65536)
+    while chunk:
+      self.chunks.append(chunk)
+      chunk = self.stream.read(65536)
+
+  def text(self):
+    return "".join(self.chunks)
+
+class GroupMonitor():
+  """
+  Samples the cpu time, memory use, and bytes read and written of every process in a process group from /proc.  The cpu
+  time and bytes of a process are the last values seen for it.  The peak memory, in kilobytes, is the largest total resident
+  set size seen in any one sample or the high water mark of the group leader, whichever is larger.
+  """
+  def __init__(self, group):
+    self.group = group
+    self.cpuTimes = {}
+    self.bytesRead = {}
+    self.bytesWritten = {}
+    self.peakMemory = 0
+    self.lastSample = None
+
+  def sample(self):
+    if not self.group or not os.path.isdir("/proc"):
+      return
+    if self.lastSample and time.time() - self.lastSample < sampleInterval:
+      return
+    self.lastSample = time.time()
+    memory = 0
+    for pid in filter(lambda x: x.isdigit(), os.listdir("/proc")):
+      try:
+        input = open("/proc/" + pid + "/stat", "r")
+        fields = input.read().rsplit(")", 1)[1].split()
+        input.close()
+        if int(fields[2]) != self.group:
+          continue
+        self.cpuTimes[pid] = sum(map(int, fields[11:15]))/float(clockTicks)
+        input = open("/proc/" + pid + "/status", "r")
+        for line in input:
+          if line.startswith("VmRSS:"):
+            memory += int(line.split()[1])
+          elif line.startswith("VmHWM:") and int(pid) == self.group:
+            self.peakMemory = max(self.peakMemory, int(line.split()[1]))
+        input.close()
+        input = open("/proc/" + pid + "/io", "r")
+        for line in input:
+          if line.startswith("rchar:"):
+            self.bytesRead[pid] = int(line.split()[1])
+          elif line.startswith("wchar:"):
+            self.bytesWritten[pid] = int(line.split()[1])
+        input.close()
+      except (IOError, OSError, IndexError, ValueError):
+        continue
+    self.peakMemory = max(self.peakMemory, memory)
+
+  def cpuTime(self):
+    return sum(self.cpuTimes.values())
+
+  def bytes(self):
+    """
+    Returns a 2-tuple, the bytes read and written by the processes of the group.
+    """
+    return sum(self.bytesRead.values()), sum(self.bytesWritten.values())
+
+def killGroup(group, process, finished):
+  """
+  group:    Id of a process group or None.
+  process:  The Popen object that leads the group.
+  finished: A threading.Event that is set once process has exited.
+
+  Terminates every process in the group, or only process if there is no group.
+  """
+  if group:
+    subprocess.call(["kill", "-TERM", "--", "-" + str(group)])
+    finished.wait(killGrace)
+    devnull = open(os.devnull, "w")
+    subprocess.call(["kill", "-KILL", "--", "-" + str(group)], stderr = devnull)
+    devnull.close()
+  elif hasattr(process, "kill"):
+    process.kill()
+
+def run(name, command, pipeline = None, timeout = None, cwd = None, env = None):
+  """
+  name:     Name of the program, used to look up its timeout and to label the record of the run.
+  command:  The command to run as a list of strings.
+  pipeline: The pipeline running the program or None.  If the pipeline has an exception the program
+            is cancelled and the exception is raised.  The record of the run is appended to pipeline.invocations.
+  timeout:  Seconds the program may run for.  If None then pipeline.timeouts is checked for a timeout for name.
+  cwd:      Working directory of the program.
+  env:      Environment of the program.
+
+  return:   An Invocation object, the output of the program is in its output field.  It is also added to the trace of the
+            stage the program was run for, see trace.tool.
+
+  Runs command in its own process group and waits for it to finish without busy waiting, a background thread waits
+  on the process and the output and errors of the program are read by two more.  Wall time is measured directly, cpu time, peak memory, and bytes read and written are sampled
+  from /proc while the program runs, so they are only approximations on other systems or for very short runs.
+  If the program is cancelled or times out every process in its group is killed.
+  """
+  if timeout is None and pipeline:
+    timeout = pipeline.timeouts.get(name)
+  invocation = Invocation(name, command)
+  start = time.time()
+  process = subprocess.Popen(groupLauncher + command, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = cwd, env = env)
+  group = None
+  if groupLauncher:
+    line = process.stderr.readline()
+    if re.match(r"\d+$", line.strip()):
+      group = int(line)
+  output, errors = Drain(process.stdout), Drain(process.stderr)
+  output.start()
+  errors.start()
+  finished = threading.Event()
+  def wait():
+    process.wait()
+    finished.set()
+  waiter = threading.Thread(target = wait)
+  waiter.setDaemon(True)
+  waiter.start()
+  monitor = GroupMonitor(group)
+
+  try:
+    while not finished.isSet():
+      monitor.sample()
+      if pipeline and pipeline.exception:
+        killGroup(group, process, finished)
+        raise pipeline.exception
+      if timeout and time.time() - start > timeout:
+        killGroup(group, process, finished)
+        raise ProcessTimeout(name, timeout)
+      finished.wait(pollInterval)
+    output.join()
+    errors.join()
+  finally:
+    invocation.returnCode = process.returncode if finished.isSet() else None
+    invocation.wallTime = time.time() - start
+    invocation.cpuTime = monitor.cpuTime()
+    invocation.peakMemory = monitor.peakMemory
+    invocation.bytesRead, invocation.bytesWritten = monitor.bytes()
+    invocation.output, invocation.errors = output.text(), errors.text()
+    if pipeline:
+      pipeline.invocations.append(invocation)
+    trace.tool(invocation)
+  return invocation
@@ -3,8 +3,12 @@ This module contains classes and functions for predicting promoters in a genome.
 """
 
 from neofelis import utils
+from neofelis import processes
+from neofelis import trace
 import re
+import time
 import urllib
+import hashlib
 import functools
 import os.path
 from javax.swing import JFrame, JLabel, JButton, WindowConstants
@@ -14,6 +18,9 @@ from java.awt import GridBagLayout, GridBagConstraints
 if not os.path.isdir("promoterPredictions"):
   os.mkdir("promoterPredictions")
 
+"""Address requests for promoter predictions are sent to, BPROM itself unless a stand-in is given, see main.py."""
+bpromURL = "http://linux1.softberry.com/cgi-bin/programs/gfindb/bprom.pl"
+
 class Promoter():
   """
   Class for storing information about a promoter.
@@ -65,7 +72,16 @@ def cachedBPROM(genome, fileName, frame):
   If the file Specified by fileName already exists then this function simply parses the file
   already there.  Also, if a request is made to BPROM and nothing is returned, no file is
   created, the user is warned, and an empty list is returned.
+
+  The hash of genome is saved as the key of fileName, see utils.writeKey, and an existing file made for
+  a different genome is requested again.  A file made before keys were saved is assumed to be for genome,
+  since BPROM is slow to answer repeated requests.
+
+  A request to BPROM is added to the trace of the run like the runs of external programs, see trace.tool.
   """
+  key = hashlib.sha1(genome).hexdigest()
+  if os.path.isfile(fileName) and utils.readKey(fileName) not in (None, key):
+    os.remove(fileName)
   offset = 25 if ".forward.bprom" in fileName else 50
   direction = "forward" if offset == 50 else "reverse"
     
@@ -76,16 +92,22 @@ def cachedBPROM(genome, fileName, frame):
     return results
 
   if not os.path.isfile(fileName):
-    results = urllib.urlopen("http://linux1.softberry.com/cgi-bin/programs/gfindb/bprom.pl",
-                             urllib.urlencode({"DATA" : genome}))
+    invocation = processes.Invocation("BPROM", [bpromURL])
+    start = time.time()
+    request = urllib.urlencode({"DATA" : genome})
+    results = urllib.urlopen(invocation.command[0], request)
     resultString = results.read()
     results.close()
+    invocation.wallTime = time.time() - start
+    invocation.bytesRead, invocation.bytesWritten = len(request), len(resultString)
+    trace.tool(invocation)
     resultString = resultString[resultString.find("<pre>"):resultString.find("</pre>")]
     resultString = re.sub("<+.+>+", "", resultString).strip()
     if resultString:
       output = open(fileName, "w")
       output.write(resultString)
       output.close()
+      utils.writeKey(fileName, key)
       return getPromoters()
     else:
       if frame:
@@ -109,6 +131,8 @@ def cachedBPROM(genome, fileName, frame):
       print "BPROM Error:", "The pipeline will continue to run but BPROM did not process the request for promoters on the " + direction + " strand.  Try again tomorrow"
       return []
   else:
+    if utils.readKey(fileName) is None:
+      utils.writeKey(fileName, key)
     return getPromoters()
 
 def reverseCoordinates(genomeLength, promoter):
@@ -126,10 +150,9 @@ def reverseCoordinates(genomeLength, promoter):
   newPromoter.signal35Location = map(lambda x: genomeLength+1 - x, promoter.signal35Location)
   return newPromoter
 
-def findPromoters(query, name, scoreCutoff, frame):
+def findPromoters(context, scoreCutoff, frame):
   """
-  query: Name of the query file.
-  name: Name of the genome.
+  context: A context.GenomeContext of the genome.
   scoreCutoff: Minimum promoter score value for any promoters.
   frame: A JFrame that may be used as the parent for a JDialog to display messages.  If it is none then messages
          are just printed.
@@ -139,8 +162,9 @@ def findPromoters(query, name, scoreCutoff, frame):
   This function uses BPROM to predict promoters and parses the results into the list of Promoter objects
   that are returned. Promoters with a score lower than scoreCutoff are filtered out.
   """
-  genome = utils.loadGenome(query)
-  forwardResults = cachedBPROM(genome, "promoterPredictions/" + name + ".forward.bprom", frame)
-  reverseResults = cachedBPROM(utils.reverseComplement(genome), "promoterPredictions/" + name + ".reverse.bprom", frame)
-  reverseResults = map(functools.partial(reverseCoordinates, len(genome)), reverseResults)
-  return filter(lambda x: x.score > scoreCutoff, forwardResults + reverseResults)
+  forwardResults = cachedBPROM(context.genome, "promoterPredictions/" + context.name + ".forward.bprom", frame)
+  reverseResults = cachedBPROM(context.reverseComplement(), "promoterPredictions/" + context.name + ".reverse.bprom", frame)
+  reverseResults = map(functools.partial(reverseCoordinates, context.length), reverseResults)
+  result = filter(lambda x: x.score > scoreCutoff, forwardResults + reverseResults)
+  trace.count("promoters", len(result))
+  return result
@@ -286,21 +286,28 @@ def writeSpreadsheet(genes, output):
     output.write(gene.organism + "\n")
   output.close()
 
-def report(name, genes, output):
+def report(name, genes, output, sources = None):
   """
-  name:   Name of the genome.
-  genes:  A dictionary that maps query names to Iteration objects.
-  output: Output file name without an extension.
+  name:    Name of the genome.
+  genes:   A dictionary that maps query names to Iteration objects.
+  output:  Output file name without an extension.
+  sources: The blast XML files to take alignments from.  If None then the XML files of the initial, extended,
+           and intergenic searches are used.
 
   Writes a report of the contents of the blast searchs for the queries in
-  genes into "name.html", "name.blastp.xml", and "name.xls".
+  genes into "name.html", "name.blastp.xml", and "name.xls".  Only genes that were searched
+  for with XML output have alignments in the .html and .xml files, if no search was
+  then only the spreadsheet is written.
   """
-  reader = XMLReaderFactory.createXMLReader()
-  reader.entityResolver = reader.contentHandler = BlastMerger(["extendedBlasts/" + name + ".blastp.xml", "intergenicBlasts/" + name + ".blastp.xml"], genes.keys(), output + ".blastp.xml", True)
-  reader.parse("initialBlasts/" + name + ".blastp.xml")
-
-  reader = XMLReaderFactory.createXMLReader()
-  reader.entityResolver = reader.contentHandler = HTMLWriter(output + ".blastp.html")
-  reader.parse(output + ".blastp.xml")
+  if sources is None:
+    sources = ["initialBlasts/" + name + ".blastp.xml", "extendedBlasts/" + name + ".blastp.xml", "intergenicBlasts/" + name + ".blastp.xml"]
+  if sources:
+    reader = XMLReaderFactory.createXMLReader()
+    reader.entityResolver = reader.contentHandler = BlastMerger(sources[1:], genes.keys(), output + ".blastp.xml", True)
+    reader.parse(sources[0])
+
+    reader = XMLReaderFactory.createXMLReader()
+    reader.entityResolver = reader.contentHandler = HTMLWriter(output + ".blastp.html")
+    reader.parse(output + ".blastp.xml")
 
   writeSpreadsheet(genes.values(), output)
@@ -4,7 +4,7 @@ of genes and removing conflicting genes.
 """
 
 import sys
-import copy
+import bisect
 
 class Scaffold():
     """
@@ -30,35 +30,48 @@ def extractScaffolds(genes, scaffoldingDistance = 100):
 
     return:              A 2-tuple, first object is a list of Scaffold objects for the forward genes,
                          and the second a list of scaffold objects for the reverse genes.
+
+    Two scaffolds are joined when the end of one is less than scaffoldingDistance from the facing end of the other, in
+    either direction, so genes that overlap by scaffoldingDistance or more are kept apart.  The genes on each strand are
+    sorted by where they start and swept over once, and each gene is only checked against the scaffolds that end less
+    than scaffoldingDistance before it starts or later, no other scaffold has an end close enough to its own.  The
+    scaffolds are returned in the order they occur on the genome.
     """
-    forwardScaffolds, reverseScaffolds = [], []
-    for gene in genes:
-        if gene.location[0] < gene.location[1]:
-            newScaffold = Scaffold(gene.location[0], gene.location[1], [gene])
-            scaffolds = forwardScaffolds
-        else:
-            newScaffold = Scaffold(gene.location[1], gene.location[0], [gene])
-            scaffolds = reverseScaffolds
-        running = True
-        while running:
-            running = False
-            for scaffold in scaffolds:
-                if abs(newScaffold.stop - scaffold.start) < scaffoldingDistance:
-                    newScaffold.stop = scaffold.stop
-                    newScaffold.genes += scaffold.genes
-                    scaffolds.remove(scaffold)
-                    running = True
-                    break
-                elif abs(newScaffold.start - scaffold.stop) < scaffoldingDistance:
-                    newScaffold.start = scaffold.start
+    def sweep(intervals):
+        scaffolds, active, joined = [], [], set()
+        intervals.sort(key = lambda x: (x[0], x[1]))
+        for start, stop, gene in intervals:
+            active = [scaffold for scaffold in active if scaffold.stop > start - scaffoldingDistance]
+            newScaffold = Scaffold(start, stop, [gene])
+            running = True
+            while running:
+                running = False
+                for scaffold in active:
+                    if abs(newScaffold.stop - scaffold.start) < scaffoldingDistance:
+                        newScaffold.stop = scaffold.stop
+                    elif abs(newScaffold.start - scaffold.stop) < scaffoldingDistance:
+                        newScaffold.start = scaffold.start
+                    else:
+                        continue
                     newScaffold.genes += scaffold.genes
-                    scaffolds.remove(scaffold)
+                    active.remove(scaffold)
+                    joined.add(id(scaffold))
                     running = True
                     break
-        scaffolds.append(newScaffold)
-    map(lambda x: x.genes.sort(key = lambda y: (y.location[0] + y.location[1])/2), forwardScaffolds)
-    map(lambda x: x.genes.sort(key = lambda y: (y.location[0] + y.location[1])/2), reverseScaffolds)
-    return forwardScaffolds, reverseScaffolds
+            active.append(newScaffold)
+            scaffolds.append(newScaffold)
+        scaffolds = [scaffold for scaffold in scaffolds if id(scaffold) not in joined]
+        scaffolds.sort(key = lambda x: x.start)
+        map(lambda x: x.genes.sort(key = lambda y: (y.location[0] + y.location[1])/2), scaffolds)
+        return scaffolds
+
+    forwardIntervals, reverseIntervals = [], []
+    for gene in genes:
+        if gene.location[0] < gene.location[1]:
+            forwardIntervals.append((gene.location[0], gene.location[1], gene))
+        else:
+            reverseIntervals.append((gene.location[1], gene.location[0], gene))
+    return sweep(forwardIntervals), sweep(reverseIntervals)
 
 def overlap(intervalOne, intervalTwo):
     """
@@ -89,11 +102,32 @@ def filterScaffolds(originalForwardScaffolds, originalReverseScaffolds):
     For each forward scaffold this function iterates over each reverse scaffold.  If any two scaffolds conflict with each other
     then any intergenic genes on the conflicting edges are removed, and if this fails to resolve the conflict then both scaffolds are
     kept.  The result of this product is what is returned.
+
+    A scaffold never extends past the genes it started with, so a forward scaffold is only checked against the reverse scaffolds
+    whose extents overlap its own, which are found in a list of the reverse scaffolds sorted by where they start.  The scaffolds
+    are copied along with their lists of genes, the genes themselves are shared with the original scaffolds.
     """
-    forwardScaffolds, reverseScaffolds = copy.deepcopy(originalForwardScaffolds), copy.deepcopy(originalReverseScaffolds)
-    newForwardScaffolds, newReverseScaffolds = copy.copy(forwardScaffolds), copy.copy(reverseScaffolds)
+    def extent(scaffold):
+        locations = reduce(lambda x, y: x + y, map(lambda x: x.location, scaffold.genes), [scaffold.start, scaffold.stop])
+        return min(locations), max(locations)
+
+    forwardScaffolds = map(lambda x: Scaffold(x.start, x.stop, list(x.genes)), originalForwardScaffolds)
+    reverseScaffolds = map(lambda x: Scaffold(x.start, x.stop, list(x.genes)), originalReverseScaffolds)
+    removed = {}
+
+    reverseExtents = sorted([extent(reverseScaffolds[i]) + (i,) for i in xrange(len(reverseScaffolds))])
+    reverseStarts = map(lambda x: x[0], reverseExtents)
+    reverseStops = []
+    for start, stop, index in reverseExtents:
+        reverseStops.append(max(reverseStops[-1:] + [stop]))
+
     for forwardScaffold in forwardScaffolds:
-        for reverseScaffold in copy.copy(newReverseScaffolds):
+        start, stop = extent(forwardScaffold)
+        candidates = reverseExtents[bisect.bisect_left(reverseStops, start):bisect.bisect_right(reverseStarts, stop)]
+        candidates = sorted([x[2] for x in candidates if x[1] >= start])
+        for reverseScaffold in [reverseScaffolds[i] for i in candidates]:
+            if id(reverseScaffold) in removed:
+                continue
             forwardScaffoldRemoved = False
             while overlap(forwardScaffold, reverseScaffold) > 3:
                 forwardHasGenemark = reduce(lambda x, y: x or not y.intergenic, forwardScaffold.genes, False)
@@ -120,7 +154,7 @@ def filterScaffolds(originalForwardScaffolds, originalReverseScaffolds):
                     if toRemove.location[0] < toRemove.location[1]:
                         forwardScaffold.genes.remove(toRemove)
                         if not forwardScaffold.genes:
-                            newForwardScaffolds.remove(forwardScaffold)
+                            removed[id(forwardScaffold)] = True
                             forwardScaffoldRemoved = True
                             break
                         elif forwardCenter < reverseCenter:
@@ -130,7 +164,7 @@ def filterScaffolds(originalForwardScaffolds, originalReverseScaffolds):
                     else:
                         reverseScaffold.genes.remove(toRemove)
                         if not reverseScaffold.genes:
-                            newReverseScaffolds.remove(reverseScaffold)
+                            removed[id(reverseScaffold)] = True
                             break
                         elif forwardCenter < reverseCenter:
                             reverseScaffold.start = reverseScaffold.genes[0].location[1]
@@ -139,15 +173,15 @@ def filterScaffolds(originalForwardScaffolds, originalReverseScaffolds):
                 elif forwardHasGenemark and reverseHasGenemark:
                     break
                 elif forwardScaffold.stop - forwardScaffold.start < reverseScaffold.stop - reverseScaffold.start:
-                    newForwardScaffolds.remove(forwardScaffold)
+                    removed[id(forwardScaffold)] = True
                     forwardScaffoldRemoved = True
                     break
                 else:
-                    newReverseScaffolds.remove(reverseScaffold)
+                    removed[id(reverseScaffold)] = True
                     break
             if forwardScaffoldRemoved:
                 break
-    return newForwardScaffolds, newReverseScaffolds
+    return filter(lambda x: id(x) not in removed, forwardScaffolds), filter(lambda x: id(x) not in removed, reverseScaffolds)
 
 def refineScaffolds(genes, scaffoldingDistance):
     """
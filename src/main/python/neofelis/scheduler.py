@@ -0,0 +1,216 @@
+"""
+This module runs the stages of a computation as a graph.  Each stage names the values it needs and the values it makes,
+a stage is started as soon as every value it needs has been made, so stages which don't depend on each other run at
+the same time in their own threads.
+
+The outputs of each stage can be saved as a checkpoint under a key made from the name and parameters of the stage and the
+keys of its inputs, the key of an input being the hash of its value if it was given and the key of the stage that made it
+otherwise.  A change to any value or parameter changes the keys of every stage that depends on it, and a stage whose key
+has a checkpoint is restored from it instead of being run.
+"""
+
+import os
+import sys
+import hashlib
+import cPickle
+import threading
+
+"""Version of the checkpoint format and of the stages they are made by, bump it whenever either changes."""
+checkpointVersion = 1
+
+class StageError(Exception):
+  """
+  Raised when the stages given to runStages can't all be run, because an input is never made, an output is made
+  twice, or the stages depend on each other in a cycle.
+  """
+  pass
+
+class Stage():
+  """
+  One step of a computation.  function is called with the values named by inputs, in order, and returns the values
+  named by outputs, a single value if there is one output, a sequence of values if there are several, and
+  anything if there are none.  parameters is anything with a repr that describes the settings the outputs depend on
+  other than the inputs, and files lists the names of the files the stage writes, a checkpoint of the stage is
+  only used if all of them exist.
+  """
+  def __init__(self, name, function, inputs, outputs, parameters = None, files = None):
+    self.name = name
+    self.function = function
+    self.inputs = inputs
+    self.outputs = outputs
+    self.parameters = parameters
+    self.files = files or []
+
+  def __str__(self):
+    result = "<"
+    result += "Name = " + str(self.name) + ", "
+    result += "Inputs = " + str(self.inputs) + ", "
+    result += "Outputs = " + str(self.outputs)
+    result += ">"
+    return result
+
+def checkStages(stages, values):
+  """
+  stages: A list of Stage objects.
+  values: A dictionary of the values available before any stage runs.
+
+  Raises a StageError if the stages can't all be run starting with values.
+  """
+  made = dict([(name, None) for name in values])
+  for stage in stages:
+    for output in stage.outputs:
+      if output in made:
+        raise StageError(output + " is made by " + stage.name + " and " + str(made[output] or "the initial values"))
+      made[output] = stage.name
+  for stage in stages:
+    for input in stage.inputs:
+      if input not in made:
+        raise StageError(stage.name + " needs " + input + " which no stage makes")
+
+  available = dict([(name, True) for name in values])
+  remaining = list(stages)
+  while remaining:
+    ready = filter(lambda x: all([input in available for input in x.inputs]), remaining)
+    if not ready:
+      raise StageError("The stages " + ", ".join(map(lambda x: x.name, remaining)) + " depend on each other")
+    for stage in ready:
+      remaining.remove(stage)
+      for output in stage.outputs:
+        available[output] = True
+
+def stageOutputs(stage, result):
+  """
+  stage:  A Stage object.
+  result: What the function of stage returned.
+
+  return: A list of 2-tuples, the name of each output of stage and its value.
+  """
+  if not stage.outputs:
+    return []
+  elif len(stage.outputs) == 1:
+    return [(stage.outputs[0], result)]
+  return zip(stage.outputs, result)
+
+def valueKey(value):
+  """
+  Returns the key of a value given to runStages, the hash of its pickle.
+  """
+  return hashlib.sha1(cPickle.dumps(value, 2)).hexdigest()
+
+def stageKey(stage, inputKeys):
+  """
+  stage:     A Stage object.
+  inputKeys: A list of the keys of the inputs of stage.
+
+  return:    The key of stage, the hash of its name, parameters, and the keys of its inputs.
+  """
+  return hashlib.sha1("\n".join([str(checkpointVersion), stage.name, repr(stage.parameters)] + inputKeys)).hexdigest()
+
+def loadCheckpoint(directory, key, stage):
+  """
+  directory: Directory the checkpoints are saved in.
+  key:       The key of stage.
+  stage:     A Stage object.
+
+  return:    A list of 2-tuples, the name and value of each output of stage saved under key, or None if there is
+             no usable checkpoint.
+  """
+  fileName = os.path.join(directory, key + ".pickle")
+  if not os.path.isfile(fileName) or not all(map(os.path.isfile, stage.files)):
+    return None
+  input = open(fileName, "rb")
+  try:
+    outputs = cPickle.load(input)
+  except Exception:
+    outputs = None
+  input.close()
+  return outputs
+
+def saveCheckpoint(directory, key, outputs):
+  """
+  directory: Directory the checkpoints are saved in.
+  key:       The key of the stage that made outputs.
+  outputs:   A list of 2-tuples, the name and value of each output.
+
+  Saves outputs under key.  The checkpoint is written to a temporary file first so an interrupted write
+  can't leave a partial checkpoint.
+  """
+  fileName = os.path.join(directory, key + ".pickle")
+  output = open(fileName + ".tmp", "wb")
+  cPickle.dump(outputs, output, 2)
+  output.close()
+  if os.path.isfile(fileName):
+    os.remove(fileName)
+  os.rename(fileName + ".tmp", fileName)
+
+def runStages(stages, values, pipeline = None, checkpoints = None, started = None):
+  """
+  stages:      A list of Stage objects.
+  values:      A dictionary that maps names to the values available before any stage runs.
+  pipeline:    The pipeline running the stages or None.
+  checkpoints: Directory to save the outputs of stages in and restore them from, if None then every stage is run.
+  started:     Function called with each stage and whether it was restored from a checkpoint, as the stage starts.
+
+  return:      A new dictionary with values and the outputs of every stage.
+
+  Every stage is started in its own thread once all of its inputs have been made, the stages are started in the order
+  they are given when several become ready at once.  If a stage fails no more stages are started, pipeline.exception is set
+  so that any external programs the running stages started are cancelled, and once the running stages finish the error
+  of the first stage that failed is raised.
+  """
+  checkStages(stages, values)
+  keys = dict([(name, valueKey(value)) for name, value in values.items()])
+  values = dict(values)
+  waiting, running, failures = list(stages), [], []
+  condition = threading.Condition()
+
+  def runStage(stage, arguments, key):
+    #Anything a stage raises has to be caught, including java exceptions, or runStages would wait for it forever.
+    try:
+      outputs = None
+      if checkpoints:
+        outputs = loadCheckpoint(checkpoints, key, stage)
+      if started:
+        started(stage, outputs is not None)
+      if outputs is None:
+        outputs = stageOutputs(stage, stage.function(*arguments))
+        if checkpoints:
+          saveCheckpoint(checkpoints, key, outputs)
+      error = None
+    except:
+      outputs, error = None, sys.exc_info()
+    condition.acquire()
+    try:
+      if error:
+        failures.append(error)
+        if pipeline and not pipeline.exception:
+          pipeline.exception = error[1]
+      else:
+        values.update(outputs)
+      running.remove(stage)
+      condition.notifyAll()
+    finally:
+      condition.release()
+
+  condition.acquire()
+  try:
+    while True:
+      if not failures and not (pipeline and pipeline.exception):
+        for stage in filter(lambda x: all([input in values for input in x.inputs]), waiting):
+          waiting.remove(stage)
+          running.append(stage)
+          key = stageKey(stage, [keys[input] for input in stage.inputs])
+          for output in stage.outputs:
+            keys[output] = hashlib.sha1(key + "\n" + output).hexdigest()
+          threading.Thread(target = runStage, args = (stage, [values[input] for input in stage.inputs], key)).start()
+      if not running:
+        break
+      condition.wait()
+  finally:
+    condition.release()
+
+  if failures:
+    raise failures[0][0], failures[0][1], failures[0][2]
+  if pipeline and pipeline.exception:
+    raise pipeline.exception
+  return values
@@ -0,0 +1,91 @@
+"""
+Bulk operations on nucleotide sequences.  Everything in this module works over
+whole strings with table lookups instead of visiting one character at a time.
+"""
+
+import re
+import bisect
+import string
+from neofelis import utils
+
+"""Translation table used to complement a whole sequence at once."""
+complementTable = string.maketrans("ACGT", "TGCA")
+
+"""Splits a sequence into consecutive codons, any trailing partial codon is dropped."""
+codonPattern = re.compile("...")
+
+def translate(sequence):
+  """
+  sequence: A nucleotide sequence.
+
+  return:   The sequence translated into proteins.
+  """
+  return "".join(map(utils.translationDictionary.__getitem__, codonPattern.findall(sequence)))
+
+def reverseComplement(sequence):
+  """
+  sequence: A nucleotide sequence.
+
+  return:   The reverse complement of the sequence.
+  """
+  return sequence.translate(complementTable)[::-1]
+
+def gcContent(sequence):
+  """
+  sequence: A nucleotide sequence.
+
+  return:   The percentage of the sequence that is G or C.
+  """
+  return (sequence.count("G") + sequence.count("C"))/float(len(sequence))*100
+
+def findCodons(sequence, codons):
+  """
+  sequence: A nucleotide sequence.
+  codons:   A sequence of codons to search for.
+
+  return:   A sorted list of every position, in any frame, where one of codons begins.
+  """
+  pattern = re.compile("(?=(" + "|".join(codons) + "))")
+  return [match.start() for match in pattern.finditer(sequence)]
+
+class CodonIndex():
+  """
+  Positions of the start and stop codons in each frame of a sequence.  The positions are kept in
+  sorted lists so the codons near any position can be found with a binary search instead of walking
+  the sequence.  An index is built for each strand, the reverse strand using the coordinates of the
+  reverse complement.
+  """
+  def __init__(self, sequence):
+    self.length = len(sequence)
+    self.starts = self.splitFrames(findCodons(sequence, utils.startCodons))
+    self.stops = self.splitFrames(findCodons(sequence, utils.stopCodons))
+
+  def splitFrames(self, positions):
+    """
+    positions: A sorted list of positions.
+
+    return:    A list of three sorted lists, the positions in frames 0, 1, and 2.
+    """
+    frames = [[], [], []]
+    for position in positions:
+      frames[position%3].append(position)
+    return frames
+
+  def upstream(self, position):
+    """
+    position: A position in the sequence.
+
+    return:   A generator of 2-tuples, the position of a codon and whether it's a start codon, for every start and
+              stop codon in the same frame that begins at or before position.  The nearest codons come first.
+    """
+    if position < 0:
+      return
+    starts, stops = self.starts[position%3], self.stops[position%3]
+    i, j = bisect.bisect_right(starts, position)-1, bisect.bisect_right(stops, position)-1
+    while i >= 0 or j >= 0:
+      if j < 0 or (i >= 0 and starts[i] > stops[j]):
+        yield starts[i], True
+        i -= 1
+      else:
+        yield stops[j], False
+        j -= 1
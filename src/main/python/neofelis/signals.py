@@ -3,7 +3,7 @@ Module for cleaning excess signals.
 """
 
 import itertools
-import copy
+import bisect
 
 def removeSignals(genes, signals):
     """
@@ -13,22 +13,27 @@ def removeSignals(genes, signals):
     return:  A filtered list of the singals which does not contain any signal which has a center of
              mass inside a gene
 
-    A helper function for filter signals that expects genes and signals on the same direction.
+    A helper function for filter signals that expects genes and signals on the same direction.  A signal is kept
+    if its center isn't strictly inside any gene and it is less than 100 base pairs from the start of a gene.  Both
+    tests are binary searches, one in the sorted starts of the genes and one in the genes sorted by their lower end
+    along with the highest upper end of the genes up to each one.
     """
-    remainingSignals = copy.copy(signals)
-    
-    for signal in signals:
-        nearStart = False
-        for gene in genes:
-            center = (signal.location[0] + signal.location[1])/2
-            nearStart = nearStart or abs(gene.location[0] - center) < 100
-            if min(gene.location) < center and center < max(gene.location):
-                remainingSignals.remove(signal)
-                break
-        if not nearStart and signal in remainingSignals:
-            remainingSignals.remove(signal)
-            
-    return remainingSignals
+    starts = sorted(map(lambda x: x.location[0], genes))
+    extents = sorted(map(lambda x: (min(x.location), max(x.location)), genes))
+    lowerEnds = map(lambda x: x[0], extents)
+    upperEnds = []
+    for lowerEnd, upperEnd in extents:
+        upperEnds.append(max(upperEnds[-1:] + [upperEnd]))
+
+    def keep(signal):
+        center = (signal.location[0] + signal.location[1])/2
+        below = bisect.bisect_left(lowerEnds, center)
+        if below and upperEnds[below-1] > center:
+            return False
+        nearest = bisect.bisect_right(starts, center-100)
+        return nearest < len(starts) and starts[nearest] < center+100
+
+    return filter(keep, signals)
 
 def filterSignals(genes, signals):
     """
@@ -2,8 +2,9 @@
 This module contains classes and functions for predicting promoters in a genome.
 """
 
-import subprocess
 from neofelis import utils
+from neofelis import processes
+from neofelis import trace
 import re
 import os
 
@@ -28,6 +29,7 @@ def writeCoords(fileName, name, genes):
   for gene in genes:
     output.write("gene\t%d\t%d\t%s\n" %  (gene.location[0], gene.location[1], name))
   output.close()
+  trace.wrote(fileName + ".crd")
 
 def parseTransterm(input):
   """
@@ -49,32 +51,22 @@ def parseTransterm(input):
 
   return map(buildTerminator, matches)
 
-def findTerminators(query, name, genes, transterm):
+def findTerminators(context, genes, transterm, pipeline = None):
   """
-  query:     File name of the query.
-  name:      Name of the genome.
+  context:   A context.GenomeContext of the genome.
   genes:     List of Iteration objects.
   transterm: Location of the transterm installation.
+  pipeline:  The pipeline running transterm, if any.
 
   return:    A list of Terminator objects.
 
-  This function runs transterm with the query and the genes and parses the results into the return value.
+  This function runs transterm with the fasta file of the context and the genes and parses the results into the return
+  value.  The genes are written to a .crd file in the workspace of the context.
   """
-  fileName = os.path.splitext(os.path.split(query)[1])[0]
-  writeCoords(fileName, name, genes)
-  output = ""
-  transtermProcess = subprocess.Popen([transterm + "/transterm", "-p", transterm + "/expterm.dat", query, fileName + ".crd"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-  
-  while transtermProcess.poll() == None:
-    output += transtermProcess.stdout.read()
-    transtermProcess.stderr.read()
-    
-  remaining = transtermProcess.stdout.read()
-  
-  while remaining:
-    output += remaining
-    remaining = transtermProcess.stdout.read()
-
+  fileName = context.scratchFile("query")
+  writeCoords(fileName, context.name, genes)
+  output = processes.run("transterm", [transterm + "/transterm", "-p", transterm + "/expterm.dat", context.fastaFile(), fileName + ".crd"], pipeline).output
   result = parseTransterm(output)
+  trace.count("terminators", len(result))
   os.remove(fileName + ".crd")
   return result
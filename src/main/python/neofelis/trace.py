@@ -0,0 +1,297 @@
+"""
+This module writes a trace of a run of the pipeline, one JSON object per line.  A record is written for every stage
+of every genome, for every external program a stage runs, for every genome once it is annotated, and for the whole run
+when it ends.
+
+Stages are traced in the thread that runs them, see Trace.traced, and the functions of this module add counts, bytes
+read and written, and the records of external programs to the stage the current thread is working for, so the code being
+traced doesn't need to know whether it is.  They do nothing in threads that aren't working for a stage.  The cpu time of
+a stage is that of every thread that worked for it, the thread that ran it and any threads it started that entered its
+span, such as the threads that search the chunks of a blast search.
+"""
+
+import os
+import time
+import tempfile
+import threading
+from java.lang.management import ManagementFactory
+
+#Have to make sure that a directory to write the traces of runs to exists.
+if not os.path.isdir("traces"):
+  os.mkdir("traces")
+
+"""Characters of strings that have to be escaped in JSON."""
+escapes = {"\"" : "\\\"", "\\" : "\\\\", "\n" : "\\n", "\r" : "\\r", "\t" : "\\t"}
+
+"""The stage the current thread is working for, if any."""
+current = threading.local()
+
+def quote(text):
+  """
+  Returns text as a JSON string.
+  """
+  result = []
+  for character in text:
+    if character in escapes:
+      result.append(escapes[character])
+    elif ord(character) < 32 or ord(character) > 126:
+      result.append("\\u%04x" % ord(character))
+    else:
+      result.append(character)
+  return "\"" + "".join(result) + "\""
+
+def encode(value):
+  """
+  value:  None, a boolean, a number, a string, or a list, tuple, or dictionary of them.
+
+  return: value as JSON.  The keys of dictionaries are sorted and numbers that JSON can't represent, not a number and
+          infinity, are written as null.  Anything else is written as its string.
+  """
+  if value is None:
+    return "null"
+  elif value is True:
+    return "true"
+  elif value is False:
+    return "false"
+  elif isinstance(value, (int, long)):
+    return str(value)
+  elif isinstance(value, float):
+    if value != value or value - value != 0:
+      return "null"
+    return repr(value)
+  elif isinstance(value, basestring):
+    return quote(value)
+  elif isinstance(value, dict):
+    return "{" + ", ".join([quote(str(key)) + ": " + encode(value[key]) for key in sorted(value.keys())]) + "}"
+  elif isinstance(value, (list, tuple)):
+    return "[" + ", ".join(map(encode, value)) + "]"
+  return quote(str(value))
+
+def threadCpuTime():
+  """
+  Returns the cpu time used by the current thread in seconds, or 0 if the JVM doesn't measure it.
+  """
+  bean = ManagementFactory.getThreadMXBean()
+  if not bean.isCurrentThreadCpuTimeSupported():
+    return 0
+  return max(0, bean.getCurrentThreadCpuTime())/1e9
+
+def throughput(length, wallTime):
+  """
+  Returns the megabase pairs annotated per hour if length base pairs took wallTime seconds, or None if no time was taken.
+  """
+  if wallTime <= 0:
+    return None
+  return length/1e6/(wallTime/3600)
+
+class Span():
+  """
+  The measurements of one stage of one genome while it runs.
+  """
+  def __init__(self, trace, genome, stage):
+    self.trace = trace
+    self.genome = genome
+    self.stage = stage
+    self.start = time.time()
+    self.cpuTime = 0
+    self.bytesRead = 0
+    self.bytesWritten = 0
+    self.toolWallTime = 0
+    self.toolCpuTime = 0
+    self.counters = {}
+
+class Trace():
+  """
+  The trace of one run of the pipeline, written to fileName as records are made.
+  """
+  def __init__(self, fileName):
+    self.fileName = fileName
+    self.output = open(fileName, "w")
+    self.lock = threading.Lock()
+    self.start = time.time()
+    #Maps the names of the genomes that have been annotated to their lengths.
+    self.annotated = {}
+    #Maps the names of genomes to the cpu time used for them so far, by the pipeline and by external programs.
+    self.cpuTimes = {}
+
+  def write(self, record):
+    """
+    Writes record, a dictionary, as a line of the trace with the time it was written.
+    """
+    record = dict(record)
+    record["time"] = time.time()
+    self.lock.acquire()
+    try:
+      if not self.output.closed:
+        self.output.write(encode(record) + "\n")
+        self.output.flush()
+    finally:
+      self.lock.release()
+
+  def traced(self, function, stage, genome):
+    """
+    function: The function of a stage.
+    stage:    Name of the stage.
+    genome:   Name of the genome the stage is for.
+
+    return:   A function that calls function and writes a record of the call, how long it took, the cpu time the
+              threads working for the stage and any external programs used, the bytes read and written, and any
+              counts, see count.
+    """
+    def tracedFunction(*arguments):
+      span = Span(self, genome, stage)
+      enter(span)
+      status = "failed"
+      try:
+        result = function(*arguments)
+        status = "finished"
+        return result
+      finally:
+        enter(None)
+        self.finishSpan(span, status)
+    return tracedFunction
+
+  def finishSpan(self, span, status):
+    """
+    Writes the record of span, whose stage ended with status.
+    """
+    self.lock.acquire()
+    try:
+      cpuTime = span.cpuTime
+      self.cpuTimes[span.genome] = self.cpuTimes.get(span.genome, 0) + cpuTime + span.toolCpuTime
+      counters = dict(span.counters)
+    finally:
+      self.lock.release()
+    self.write({"type" : "stage", "genome" : span.genome, "stage" : span.stage, "status" : status,
+                "wallTime" : time.time() - span.start, "cpuTime" : cpuTime,
+                "toolWallTime" : span.toolWallTime, "toolCpuTime" : span.toolCpuTime,
+                "bytesRead" : span.bytesRead, "bytesWritten" : span.bytesWritten, "counters" : counters})
+
+  def restored(self, stage, genome):
+    """
+    Writes a record of a stage that was restored from its checkpoint instead of being run.
+    """
+    self.write({"type" : "stage", "genome" : genome, "stage" : stage, "status" : "restored"})
+
+  def annotatedGenome(self, genome, length, wallTime):
+    """
+    genome:   Name of a genome.
+    length:   Length of the genome in base pairs.
+    wallTime: Seconds it took to annotate the genome.
+
+    Writes a record of the genome with the cpu time used for it and its throughput in megabase pairs per hour.
+    """
+    self.lock.acquire()
+    try:
+      self.annotated[genome] = length
+      cpuTime = self.cpuTimes.get(genome, 0)
+    finally:
+      self.lock.release()
+    self.write({"type" : "genome", "genome" : genome, "length" : length, "wallTime" : wallTime, "cpuTime" : cpuTime,
+                "mbpPerHour" : throughput(length, wallTime)})
+
+  def close(self, status):
+    """
+    Writes a record of the whole run, which ended with status, with the throughput of every genome annotated
+    since the trace was started and closes the trace.
+    """
+    wallTime = time.time() - self.start
+    length = sum(self.annotated.values())
+    self.write({"type" : "run", "status" : status, "genomes" : len(self.annotated), "length" : length,
+                "wallTime" : wallTime, "cpuTime" : sum(self.cpuTimes.values()), "mbpPerHour" : throughput(length, wallTime)})
+    self.lock.acquire()
+    try:
+      self.output.close()
+    finally:
+      self.lock.release()
+
+def newTrace():
+  """
+  Returns a Trace written to a new file in traces named after the time it was started.
+  """
+  handle, fileName = tempfile.mkstemp(prefix = time.strftime("%Y%m%d-%H%M%S") + ".", suffix = ".jsonl", dir = "traces")
+  os.close(handle)
+  return Trace(fileName)
+
+def currentSpan():
+  """
+  Returns the Span of the stage the current thread is working for, or None.
+  """
+  return getattr(current, "span", None)
+
+def enter(span):
+  """
+  Makes the current thread work for the stage of span, a thread started by a stage has to enter the span of the stage
+  for its work to be counted.  If span is None the thread stops working for any stage.  The cpu time the thread used
+  while it worked for a stage is added to the stage when it stops, so a thread that enters a span has to enter None
+  once it is done.
+  """
+  previous = currentSpan()
+  if previous:
+    cpuTime = threadCpuTime() - current.startCpu
+    previous.trace.lock.acquire()
+    try:
+      previous.cpuTime += cpuTime
+    finally:
+      previous.trace.lock.release()
+  current.span = span
+  if span:
+    current.startCpu = threadCpuTime()
+
+def count(name, amount = 1):
+  """
+  Adds amount to the counter name of the current stage.
+  """
+  span = currentSpan()
+  if span:
+    span.trace.lock.acquire()
+    try:
+      span.counters[name] = span.counters.get(name, 0) + amount
+    finally:
+      span.trace.lock.release()
+
+def read(fileName):
+  """
+  Adds the size of the file fileName to the bytes read by the current stage.
+  """
+  span = currentSpan()
+  if span and os.path.isfile(fileName):
+    span.trace.lock.acquire()
+    try:
+      span.bytesRead += os.path.getsize(fileName)
+    finally:
+      span.trace.lock.release()
+
+def wrote(fileName):
+  """
+  Adds the size of the file fileName to the bytes written by the current stage.
+  """
+  span = currentSpan()
+  if span and os.path.isfile(fileName):
+    span.trace.lock.acquire()
+    try:
+      span.bytesWritten += os.path.getsize(fileName)
+    finally:
+      span.trace.lock.release()
+
+def tool(invocation):
+  """
+  invocation: A processes.Invocation object.
+
+  Writes a record of the run of an external program and adds its times and the bytes it read and wrote to the current stage.
+  """
+  span = currentSpan()
+  if not span:
+    return
+  span.trace.lock.acquire()
+  try:
+    span.toolWallTime += invocation.wallTime
+    span.toolCpuTime += invocation.cpuTime
+    span.bytesRead += invocation.bytesRead
+    span.bytesWritten += invocation.bytesWritten
+  finally:
+    span.trace.lock.release()
+  span.trace.write({"type" : "tool", "genome" : span.genome, "stage" : span.stage, "tool" : invocation.name,
+                    "returnCode" : invocation.returnCode, "wallTime" : invocation.wallTime, "cpuTime" : invocation.cpuTime,
+                    "peakMemory" : invocation.peakMemory, "bytesRead" : invocation.bytesRead, "bytesWritten" : invocation.bytesWritten,
+                    "outputBytes" : len(invocation.output)})
@@ -13,16 +13,23 @@ from org.xml.sax.helpers import DefaultHandler
 from org.xml.sax import SAXParseException
 import os
 import os.path
-import subprocess
+import sys
 import re
+import heapq
+import threading
+import Queue
+import cPickle
+import hashlib
+from neofelis import fasta
+from neofelis import blastcache
+from neofelis import processes
+from neofelis import aligner
+from neofelis import trace
 
 """Start and stop codons."""
 startCodons = ("ATG", "GTG", "TTG")
 stopCodons = ("TGA", "TAA", "TAG")
 
-"""Dictionary containing the complements of Nucleotides"""
-complementDictionary = {"A":"T", "T":"A", "G":"C", "C":"G"}
-
 """Dictionary containing the mappings from codons to proteins"""
 translationDictionary = {"TTT":"F","TTC":"F",
                          "TTA":"L", "TTG":"L", "CTT":"L", "CTC":"L", "CTA":"L", "CTG":"L",
@@ -46,60 +53,6 @@ translationDictionary = {"TTT":"F","TTC":"F",
                          "GAA":"E", "GAG":"E",
                          "GGA":"G", "GGT":"G", "GGG":"G", "GGC":"G"}
 
-def translate(input):
-  """
-  Returns a Neucleotide sequence translated into Proteins.
-  """
-  result = ""
-  for i in xrange(0, len(input)-2, 3):
-    result += translationDictionary[input[i:i+3]]
-  return result
-
-def reverseComplement(input):
-  """
-  Returns the reverse complement of a Neucleotide sequence.
-  """
-  result = map(lambda x: complementDictionary[x], input)
-  result.reverse()
-  return "".join(result)
-
-def loadGenome(fileName):
-  """
-  Loads the genome from a fasta file containing a single genome.
-  """
-  input = open(fileName, "r")
-  result = ""
-  for line in input:
-    match = re.match("([ACGT]+)", line.upper())
-    if match:
-      result += match.group(1)
-  input.close()
-  return result
-
-def getHeader(fileName):
-  input = open(fileName, "r")
-  for line in input:
-    match = re.match(">(.+)", line.upper())
-    if match:
-      input.close()
-      return match.group(1)
-  input.close()
-  return None
-
-def isGenome(fileName):
-  """
-  Returns true if the file represented by fileName is a fasta file containing one genome.
-  """
-  if os.path.isdir(fileName):
-    return False
-  input = open(fileName, "r")
-  if not re.match(">.+", input.next()):
-    return False
-  for line in input:
-    if line.strip() and not re.match("[ACGT]+", line.upper()):
-      return False
-  return True
-
 def getGeneLocations(genes):
   """
   Takes a a map with GeneStructs as values and returns a two Dictionaries.
@@ -117,6 +70,9 @@ def getGeneLocations(genes):
       reverse[k] = [v.location[1]-1, v.location[0]]
   return forward, reverse
 
+"""Number of hits, best first, whose ids are kept in Iteration.hits."""
+keptHits = 10
+
 class Iteration:
   """
   A structure for holding information about a gene's blast result.
@@ -129,6 +85,8 @@ class Iteration:
     self.eValue =          Double.POSITIVE_INFINITY
     self.identity =        0
     self.alignmentLength = 0
+    self.queryFrom =       0
+    self.hits =            []
     self.id =              "None"
     self.title =           "None"
     self.organism =        "None"
@@ -145,6 +103,7 @@ class Iteration:
     result += "EValue = " + str(self.eValue) + ", "
     result += "Identity = " + str(self.identity) + ", "
     result += "AlignmentLength = " + str(self.alignmentLength) + ", "
+    result += "QueryFrom = " + str(self.queryFrom) + ", "
     result += "ID = " + str(self.id) + ", "
     result += "Title = " + str(self.title) + ", "
     result += "Organism = " + str(self.organism) + ", "
@@ -161,6 +120,7 @@ class Hit:
     self.bitScore = 0
     self.identity = 0
     self.alignmentLength = 0
+    self.queryFrom = 0
     self.id = None
     self.title = None
     self.organism = None
@@ -171,6 +131,7 @@ class Hit:
     result += "EValue = " + str(self.eValue) + ", "
     result += "Identity = " + str(self.identity) + ", "
     result += "AlignmentLength = " + str(self.alignmentLength) + ", "
+    result += "QueryFrom = " + str(self.queryFrom) + ", "
     result += "ID = " + str(self.id) + ", "
     result += "Title = " + str(self.title) + ", "
     result += "Organism = " + str(self.organism)
@@ -186,140 +147,725 @@ class Hsp:
     self.bitScore = 0
     self.identity = 0
     self.alignmentLength = 0
+    self.queryFrom = 0
+
+def splitDefinition(text):
+  """
+  text:   The definition of a hit, a title followed by the organism in brackets.
+
+  return: A 2-tuple, the title and the organism, the organism is empty if there isn't one.
+  """
+  match = re.search(r"([^\[]+)\[([^\]]+)", text)
+  if match:
+    return match.group(1).strip(), match.group(2).strip()
+  return text.strip(), ""
 
 class BlastHandler(DefaultHandler):
   """
   A SAX handler for parsing Blast XML output.
+
+  Iterations are handed to callback as soon as their end tag is reached.  Only the best hsp of the current
+  hit and the best hit of the current iteration are kept, and text is only buffered for the tags in textTags,
+  so memory use doesn't grow with the size of the file or with the long alignment strings.
   """
-  def __init__(self):
-    self.iterations = []
-    self.hits = []
-    self.hsps = []
-    self.tag = None
-    self.text = ""
-  
+  textTags = ("Iteration_query-def", "Hit_id", "Hit_def", "Hsp_bit-score", "Hsp_evalue", "Hsp_identity", "Hsp_align-len", "Hsp_query-from")
+
+  def __init__(self, callback):
+    self.callback = callback
+    self.iteration = None
+    self.hit = None
+    self.hsp = None
+    self.numHsps = 0
+    self.text = None
+
   def startElement(self, uri, tag, name, attributes):
     """
-    Records the tag of the current node and generates a new
-    object to store the information in the iteration,
-    hit, and hsp nodes.
+    Generates a new object to store the information in the iteration,
+    hit, and hsp nodes and starts buffering text if the tag is one that
+    is read.
     """
-    if name == "Iteration":
-      self.iterations += [Iteration()]
-    elif name == "Hit":
-      self.hits += [Hit()]
-    elif name == "Hsp":
-      self.hsps += [Hsp()]
-    self.tag, self.text = tag, ""
+    if tag == "Iteration":
+      self.iteration = Iteration()
+    elif tag == "Hit":
+      self.hit = Hit()
+      self.numHsps = 0
+    elif tag == "Hsp":
+      self.hsp = Hsp()
+    self.text = [] if tag in self.textTags else None
 
   def endElement(self, uri, tag, name):
     """
-    Calculates the contents of a Hit structure once the end of a Hit node has been reached,
-    and calculates the contents of a Iteration structure once the end of an Iteration node
-    has been reached.
+    Folds a finished Hsp into the best Hsp of its Hit and a finished Hit into the best Hit of
+    its Iteration.  Once the end of an Iteration node has been reached the iteration is passed
+    to the callback.
     """
-    if tag == "Iteration" and self.hits:
-      bestHit = min(self.hits, key = lambda hit:hit.eValue)
-      self.iterations[-1].eValue = bestHit.eValue
-      self.iterations[-1].bitScore = bestHit.bitScore
-      self.iterations[-1].identity = bestHit.identity
-      self.iterations[-1].alignmentLength = bestHit.alignmentLength
-      self.iterations[-1].id = bestHit.id
-      self.iterations[-1].title = bestHit.title
-      self.iterations[-1].organism = bestHit.organism
-      self.iterations[-1].numHits = len(self.hits)
-      self.hits = []
+    if tag == "Iteration":
+      self.callback(self.iteration)
+      self.iteration = None
     elif tag == "Hit":
-      bestHsp = min(self.hsps, key = lambda hsp:hsp.eValue)
-      self.hits[-1].eValue = bestHsp.eValue
-      self.hits[-1].bitScore = bestHsp.bitScore
-      self.hits[-1].identity = bestHsp.identity
-      self.hits[-1].alignmentLength = bestHsp.alignmentLength
-      self.hsps = []
-    elif self.tag == "Iteration_query-def":
-      self.iterations[-1].query, location = self.text.split(":")
-      self.iterations[-1].location = [int(l) for l in location.split("-")]
-    elif self.tag == "Hit_id":
-      self.hits[-1].id = self.text
-    elif self.tag == "Hit_def":
-      match = re.search(r"([^\[]+)\[([^\]]+)", self.text)
-      if match:
-        self.hits[-1].title, self.hits[-1].organism = match.group(1).strip(), match.group(2).strip()
-      else:
-        self.hits[-1].title, self.hits[-1].organism = self.text.strip(), ""
-    elif self.tag == "Hsp_bit-score":
-      self.hsps[-1].bitScore = float(self.text)
-    elif self.tag == "Hsp_evalue":
-      self.hsps[-1].eValue = float(self.text)
-    elif self.tag == "Hsp_identity":
-      self.hsps[-1].identity = float(self.text)
-    elif self.tag == "Hsp_align-len":
-      self.hsps[-1].alignmentLength = int(self.text)
+      self.iteration.numHits += 1
+      if self.iteration.numHits == 1 or self.hit.eValue < self.iteration.eValue:
+        self.iteration.eValue = self.hit.eValue
+        self.iteration.bitScore = self.hit.bitScore
+        self.iteration.identity = self.hit.identity
+        self.iteration.alignmentLength = self.hit.alignmentLength
+        self.iteration.queryFrom = self.hit.queryFrom
+        self.iteration.id = self.hit.id
+        self.iteration.title = self.hit.title
+        self.iteration.organism = self.hit.organism
+      if len(self.iteration.hits) < keptHits:
+        self.iteration.hits.append(self.hit.id)
+    elif tag == "Hsp":
+      self.numHsps += 1
+      if self.numHsps == 1 or self.hsp.eValue < self.hit.eValue:
+        self.hit.eValue = self.hsp.eValue
+        self.hit.bitScore = self.hsp.bitScore
+        self.hit.identity = self.hsp.identity
+        self.hit.alignmentLength = self.hsp.alignmentLength
+        self.hit.queryFrom = self.hsp.queryFrom
+    elif self.text is not None:
+      text = "".join(self.text)
+      if tag == "Iteration_query-def":
+        self.iteration.query, location = text.split(":")
+        self.iteration.location = [int(l) for l in location.split("-")]
+      elif tag == "Hit_id":
+        self.hit.id = text
+      elif tag == "Hit_def":
+        self.hit.title, self.hit.organism = splitDefinition(text)
+      elif tag == "Hsp_bit-score":
+        self.hsp.bitScore = float(text)
+      elif tag == "Hsp_evalue":
+        self.hsp.eValue = float(text)
+      elif tag == "Hsp_identity":
+        self.hsp.identity = float(text)
+      elif tag == "Hsp_align-len":
+        self.hsp.alignmentLength = int(text)
+      elif tag == "Hsp_query-from":
+        self.hsp.queryFrom = int(text)
+    self.text = None
 
   def characters(self, raw, start, length):
     """
-    Pulls the character information from the current node depending on the
-    tag of the parent.
+    Buffers the character information of the current node if it is one that is read.
     """
-    self.text += raw[start:start+length].tostring()
+    if self.text is not None:
+      self.text.append(raw[start:start+length].tostring())
 
   def resolveEntity(self, publicId, systemId):
     return InputSource(ClassLoader.getSystemResourceAsStream("dtds/" + os.path.split(systemId)[1]))
 
-def parseBlast(fileName):
+def streamBlast(fileName, callback):
   """
-  A function for parsing XML blast output.
+  fileName: Name of a blast XML file.
+  callback: Function that is called with each Iteration as soon as it has been parsed.
+
+  Parses XML blast output without holding more than one iteration in memory.
   """
   reader = XMLReaderFactory.createXMLReader()
-  reader.entityResolver = reader.contentHandler = BlastHandler()
+  reader.entityResolver = reader.contentHandler = BlastHandler(callback)
   reader.parse(fileName)
 
-  return dict(map(lambda iteration: (iteration.query, iteration), reader.getContentHandler().iterations))
+def parseBlast(fileName):
+  """
+  A function for parsing XML blast output.
+
+  return: A dictionary that maps query names to Iteration objects.
+  """
+  result = {}
+  def addIteration(iteration):
+    result[iteration.query] = iteration
+  streamBlast(fileName, addIteration)
+  return result
+
+"""Version of the parsed blast sidecar format, bump it whenever the fields stored change."""
+parsedBlastVersion = 3
+
+"""Fields of an Iteration that are stored in a parsed blast sidecar."""
+parsedBlastFields = ("query", "location", "numHits", "bitScore", "eValue", "identity", "alignmentLength", "queryFrom", "hits", "id", "title", "organism")
 
-def cachedBlast(fileName, blastLocation, database, eValue, query, pipeline, force = False):
+def blastSignature(fileName):
   """
-  Performs a blast search using the blastp executable and database in blastLocation on
-  the query with the eValue.  The result is an XML file saved to fileName.  If fileName
-  already exists the search is skipped.
+  fileName: Name of a blast XML file.
+
+  return:   A tuple identifying the current contents of the file, its size and modification time.
   """
-  if not os.path.isfile(fileName) or force:
-    output = open(fileName, "w")
-    command = [blastLocation + "/bin/blastp",
-               "-evalue", str(eValue),
-               "-outfmt", "5",
-               "-query", os.getcwd() + "/" + query,
-               "-num_threads", str(Runtime.getRuntime().availableProcessors()),
-               "-db", os.path.split(database)[1]]
-
-    blastProcess = subprocess.Popen(command,
-                                    stdout = subprocess.PIPE,
-                                    cwd = database)
-    while blastProcess.poll() == None:
-      output.write(blastProcess.stdout.read())
-      if pipeline.exception:
-        psProcess = subprocess.Popen(["ps", "aux"], stdout = subprocess.PIPE)
-        awkProcess = subprocess.Popen(["awk", "/" + " ".join(command).replace("/", "\\/") + "/"], stdin = psProcess.stdout, stdout = subprocess.PIPE)
-        for line in awkProcess.stdout:
-          subprocess.Popen(["kill", "-9", re.split(r"\s+", line)[1]])
-        output.close()
-        raise pipeline.exception
-    remaining = blastProcess.stdout.read()
-    while remaining:
-      output.write(remaining)
-      remaining = blastProcess.stdout.read()
+  status = os.stat(fileName)
+  return (parsedBlastVersion, status.st_size, status.st_mtime)
 
-    output.close()
+def saveParsedBlast(fileName, iterations):
+  """
+  fileName:   Name of the blast XML file that was parsed.
+  iterations: A dictionary that maps query names to Iteration objects, the result of parsing fileName.
 
+  Writes the iterations to fileName + ".parsed" along with the signature of fileName so the sidecar
+  can be recognized as stale if the XML file changes.
+  """
+  rows = [tuple([getattr(iteration, field) for field in parsedBlastFields]) for iteration in iterations.values()]
+  output = open(fileName + ".parsed", "wb")
+  cPickle.dump((blastSignature(fileName), rows), output, 2)
+  output.close()
+
+def loadParsedBlast(fileName):
+  """
+  fileName: Name of a blast XML file.
+
+  return:   A dictionary that maps query names to Iteration objects read from the sidecar of fileName,
+            or None if there is no sidecar or it doesn't match the current contents of fileName.
+  """
+  if not os.path.isfile(fileName + ".parsed"):
+    return None
+  input = open(fileName + ".parsed", "rb")
   try:
+    signature, rows = cPickle.load(input)
+  except Exception:
+    input.close()
+    return None
+  input.close()
+  if signature != blastSignature(fileName):
+    return None
+  result = {}
+  for row in rows:
+    iteration = Iteration()
+    for field, value in zip(parsedBlastFields, row):
+      setattr(iteration, field, value)
+    result[iteration.query] = iteration
+  return result
+
+def readBlast(fileName, backend = None):
+  """
+  fileName: Name of a file of search results.
+  backend:  The SearchBackend that wrote the file, if None then it is a blast XML file.
+
+  return:   A dictionary that maps query names to Iteration objects.
+
+  The file is only parsed if its sidecar is missing or stale, after parsing a new sidecar is written.  The hits of
+  the results are counted as hitsParsed in the trace of the run either way.
+  """
+  result = loadParsedBlast(fileName)
+  if result is None:
+    trace.read(fileName)
+    result = (backend or searchBackends["xml"]).parse(fileName)
+    saveParsedBlast(fileName, result)
+  else:
+    trace.read(fileName + ".parsed")
+  trace.count("hitsParsed", sum([len(iteration.hits) for iteration in result.values()]))
+  return result
+
+def defaultBlastLayout():
+  """
+  return: A 2-tuple, the number of blastp processes to run at once and the number of threads each
+          should use.  blastp's own threading doesn't scale well past a few threads so the available
+          processors are split between several processes of at most four threads each.
+  """
+  processors = Runtime.getRuntime().availableProcessors()
+  threads = min(4, processors)
+  return max(1, processors/threads), threads
+
+def writeProteins(fileName, records):
+  """
+  fileName: Name of the fasta file to write.
+  records:  A list of 2-tuples, the header and sequence of each protein.
+  """
+  output = open(fileName, "w")
+  for header, sequence in records:
+    output.write(">" + header + "\n")
+    for i in xrange(0, len(sequence), 50):
+      output.write(sequence[i:i+50] + "\n")
+  output.close()
+  trace.wrote(fileName)
+
+def shardQueries(records, count):
+  """
+  records: A list of 2-tuples, the header and sequence of each protein.
+  count:   Number of shards to split records into.
+
+  return:  A list of at most count non-empty lists of records.  Proteins are handed out longest first to
+           the shard with the fewest residues so far, so every shard has about the same total length.
+           Within a shard the proteins keep their original order.
+  """
+  heap = [(0, shard) for shard in xrange(min(count, len(records)))]
+  shards = [[] for entry in heap]
+  for index in sorted(xrange(len(records)), key = lambda i: len(records[i][1]), reverse = True):
+    length, shard = heapq.heappop(heap)
+    shards[shard].append(index)
+    heapq.heappush(heap, (length + len(records[index][1]), shard))
+  return [[records[index] for index in sorted(shard)] for shard in shards]
+
+"""Number of times cachedBlast will search for proteins that still have no results before giving up."""
+blastAttempts = 3
+
+"""Number of residues in each chunk of proteins searched by one blastp process."""
+chunkLength = 50000
+
+class BlastError(Exception):
+  """
+  Raised when blastp or another blast program fails or proteins are left without results.
+  """
+  pass
+
+def runBlastProgram(name, command, pipeline, cwd = None):
+  """
+  name:     Name of the program, see processes.run.
+  command:  The command to run.
+  pipeline: The pipeline running the program.
+  cwd:      Directory to run the program in.
+
+  return:   The processes.Invocation of the program.  A BlastError is raised if it doesn't exit with 0.
+  """
+  invocation = processes.run(name, command, pipeline, cwd = cwd)
+  if invocation.returnCode != 0:
+    raise BlastError(name + " exited with " + str(invocation.returnCode) + ": " + invocation.errors.strip())
+  return invocation
+
+def runBlast(blastLocation, database, eValue, query, fileName, pipeline, threads = 1, outputFormat = "5", searchSize = None):
+  """
+  blastLocation: Location of the blast installation.
+  database:      The database to search.
+  eValue:        The e value to use.
+  query:         Name of a fasta file of proteins.
+  fileName:      Name of the file to write the results to.
+  pipeline:      The pipeline running the search, the search is abandoned if it has an exception.
+  threads:       Number of threads blastp should use.
+  outputFormat:  The -outfmt argument of blastp.
+  searchSize:    The -dbsize argument of blastp, if None then the size of database is used.
+
+  Runs blastp on query through the processes module and writes its output to fileName.
+  """
+  command = [blastLocation + "/bin/blastp",
+             "-evalue", str(eValue),
+             "-outfmt", outputFormat,
+             "-query", os.path.abspath(query),
+             "-out", os.path.abspath(fileName),
+             "-num_threads", str(threads),
+             "-db", os.path.split(database)[1]]
+  if searchSize:
+    command += ["-dbsize", str(searchSize)]
+  invocation = processes.run("blastp", command, pipeline, cwd = database)
+  if invocation.returnCode != 0:
+    raise BlastError("blastp exited with " + str(invocation.returnCode) + ": " + invocation.errors.strip())
+
+class SearchBackend():
+  """
+  Searches with blastp and reads the full XML output, the default backend and the interface cachedBlast searches
+  through.  A backend runs a search for a fasta file of proteins, splits its output into the records of single queries
+  so they can be cached, joins cached records back into one file, and parses that file into Iteration objects.
+  extension is the extension of the files it writes and parseErrors are the exceptions parse raises for a file that is
+  incomplete.  Other backends override what they do differently.  The XML is the only output the alignment report can
+  be made from.
+  """
+  name = "xml"
+  extension = ".xml"
+  parseErrors = (SAXParseException,)
+
+  def settings(self, database, eValue, searchSize = None):
+    """
+    Returns a string describing every setting that affects the results of a search, see blastcache.searchSettings.
+    """
+    return blastcache.searchSettings(database, eValue, "5", searchSize)
+
+  def search(self, blastLocation, database, eValue, query, fileName, pipeline, threads = 1, searchSize = None):
+    """
+    Searches database for the proteins in the fasta file query and writes the results to fileName, see runBlast.
+    """
+    runBlast(blastLocation, database, eValue, query, fileName, pipeline, threads, "5", searchSize)
+
+  def split(self, fileName):
+    """
+    Returns a generator of 2-tuples, the query definition and the text of every complete record in fileName.
+    """
+    return blastcache.splitIterations(fileName)
+
+  def assemble(self, fileName, queries, database, eValue):
+    """
+    Writes a file of results with one record for each query from the cache, see blastcache.assemble.
+    """
+    blastcache.assemble(fileName, queries, database, eValue)
+
+  def parse(self, fileName):
+    """
+    Returns a dictionary that maps query names to Iteration objects.
+    """
     return parseBlast(fileName)
-  except SAXParseException:
-    return cachedBlast(fileName, blastLocation, database, eValue, query, pipeline, True)
 
-def getGCContent(genome):
+class TabularError(Exception):
+  """
+  Raised when a tabular search result is incomplete.
+  """
+  def __init__(self, fileName):
+    Exception.__init__(self, fileName + " is not a complete tabular search result")
+
+class TabularBackend(SearchBackend):
+  """
+  Searches with blastp writing commented tabular output, -outfmt 7, with only the fields an Iteration keeps.
+  Every query gets a record that starts with a "# BLASTP" line, names the query in a "# Query:" line, and gives
+  the number of hits in a "# N hits found" line followed by one line per hsp.  A record is complete once all of
+  its lines, including the newline of the last one, have been read.  The output is a fraction of the size of the
+  XML and is read line by line.  Blast rounds the scores in tabular output, otherwise the Iterations are the same
+  as those read from XML.
+  """
+  name = "tabular"
+  extension = ".tab"
+  parseErrors = (TabularError,)
+  fields = "qseqid sseqid evalue bitscore nident length qstart stitle"
+  hitsPattern = re.compile(r"# (\d+) hits found")
+
+  def settings(self, database, eValue, searchSize = None):
+    return blastcache.searchSettings(database, eValue, "7 " + self.fields, searchSize)
+
+  def search(self, blastLocation, database, eValue, query, fileName, pipeline, threads = 1, searchSize = None):
+    runBlast(blastLocation, database, eValue, query, fileName, pipeline, threads, "7 " + self.fields, searchSize)
+
+  def split(self, fileName):
+    input = open(fileName, "r")
+    lines, queryDef, remaining = None, None, None
+    for line in input:
+      if not line.endswith("\n"):
+        break
+      if line.startswith("# BLASTP"):
+        lines, queryDef, remaining = [], None, None
+      if lines is None:
+        continue
+      lines.append(line)
+      if remaining is not None and not line.startswith("#"):
+        remaining -= 1
+      elif line.startswith("# Query: "):
+        queryDef = line[len("# Query: "):].strip()
+      elif self.hitsPattern.match(line):
+        remaining = int(self.hitsPattern.match(line).group(1))
+      if remaining == 0:
+        yield queryDef, "".join(lines)
+        lines = None
+    input.close()
+
+  def assemble(self, fileName, queries, database, eValue):
+    output = open(fileName, "w")
+    for queryDef, key in queries:
+      for line in blastcache.load(key).splitlines(True):
+        output.write("# Query: " + queryDef + "\n" if line.startswith("# Query: ") else line)
+    output.write("# BLAST processed " + str(len(queries)) + " queries\n")
+    output.close()
+
+  def parse(self, fileName):
+    input = open(fileName, "r")
+    input.seek(max(0, os.path.getsize(fileName)-1024))
+    lines = input.read().splitlines()
+    input.close()
+    if not lines or not lines[-1].startswith("# BLAST processed"):
+      raise TabularError(fileName)
+    result = {}
+    for queryDef, record in self.split(fileName):
+      iteration = Iteration()
+      iteration.query, location = queryDef.split(":")
+      iteration.location = [int(l) for l in location.split("-")]
+      subjects, best = {}, None
+      for line in record.splitlines():
+        if line.startswith("#"):
+          continue
+        fields = line.split("\t")
+        if fields[1] not in subjects and len(iteration.hits) < keptHits:
+          iteration.hits.append(fields[1])
+        subjects[fields[1]] = True
+        if best is None or float(fields[2]) < float(best[2]):
+          best = fields
+      iteration.numHits = len(subjects)
+      if best:
+        iteration.id = best[1]
+        iteration.eValue, iteration.bitScore, iteration.identity = float(best[2]), float(best[3]), float(best[4])
+        iteration.alignmentLength, iteration.queryFrom = int(best[5]), int(best[6])
+        iteration.title, iteration.organism = splitDefinition(best[7] if len(best) > 7 else "")
+      result[iteration.query] = iteration
+    return result
+
+class LocalBackend(TabularBackend):
+  """
+  Searches with the aligner module instead of blastp, for testing without a blast installation.  The database is a
+  fasta file of proteins, see localDatabase.
+  """
+  name = "local"
+
+  def settings(self, database, eValue, searchSize = None):
+    settings = ["aligner", "-db", database, "-evalue", str(eValue)]
+    if searchSize:
+      settings += ["-dbsize", str(searchSize)]
+    return " ".join(settings)
+
+  def search(self, blastLocation, database, eValue, query, fileName, pipeline, threads = 1, searchSize = None):
+    if pipeline and pipeline.exception:
+      raise pipeline.exception
+    aligner.search(query, localDatabase(database), eValue, fileName, searchSize)
+
+def localDatabase(database):
+  """
+  database: A database as given to cachedBlast.
+
+  return:   Name of the fasta file of the database, database itself or, if it is a directory, the file in it with
+            the same name and a .fas extension.
+  """
+  if os.path.isdir(database):
+    return os.path.join(database, os.path.split(database)[1] + ".fas")
+  return database
+
+"""Search backends by name."""
+searchBackends = {SearchBackend.name : SearchBackend(), TabularBackend.name : TabularBackend(), LocalBackend.name : LocalBackend()}
+
+"""Stages that search, a backend can be chosen for each of them, see stageBackend."""
+searchStages = ("initial", "extension", "intergenic")
+
+def stageBackend(pipeline, stage):
+  """
+  pipeline: The pipeline running a search.
+  stage:    Name of the stage running the search, initial, extension, or intergenic.
+
+  return:   The SearchBackend pipeline.searchBackends names for stage, the XML SearchBackend if it names none.
+  """
+  return searchBackends[pipeline.searchBackends.get(stage, "xml")]
+
+def storeChunk(chunkQuery, chunkOutput, settings, backend):
   """
-  A function for calculating the GC content of a genome.
+  chunkQuery:  Name of the fasta file of a chunk of proteins.
+  chunkOutput: Name of the file the results of the chunk were written to, complete or not.
+  settings:    The settings the chunk was searched with.
+  backend:     The SearchBackend the chunk was searched with.
+
+  Caches every complete record in chunkOutput and removes both files.
+  """
+  if os.path.isfile(chunkOutput):
+    keys = {}
+    for header, sequence in fasta.readFasta(chunkQuery, fasta.proteinPattern):
+      keys[header] = blastcache.proteinKey(sequence, settings)
+    blastcache.storeIterations(chunkOutput, keys, backend.split)
+    os.remove(chunkOutput)
+  os.remove(chunkQuery)
+
+def salvageChunks(chunkDirectory, settings, backend):
+  """
+  chunkDirectory: Directory the chunks of a search are written to.
+  settings:       The settings of the current search.
+  backend:        The SearchBackend of the current search.
+
+  Caches the complete iterations of any chunks left behind by an interrupted search with the same settings,
+  and clears out chunks searched with any other settings.
   """
-  return reduce(lambda x, y: x+int(y in ("G", "C")), genome, 0)/float(len(genome))*100
+  if not os.path.isdir(chunkDirectory):
+    os.mkdir(chunkDirectory)
+  settingsFile = os.path.join(chunkDirectory, "settings")
+  sameSettings = False
+  if os.path.isfile(settingsFile):
+    input = open(settingsFile, "r")
+    sameSettings = input.read() == settings
+    input.close()
+  for chunk in filter(lambda x: x.endswith(".fas"), os.listdir(chunkDirectory)):
+    chunkQuery = os.path.join(chunkDirectory, chunk)
+    chunkOutput = chunkQuery[:-len(".fas")] + backend.extension
+    if sameSettings:
+      storeChunk(chunkQuery, chunkOutput, settings, backend)
+    else:
+      os.remove(chunkQuery)
+      if os.path.isfile(chunkOutput):
+        os.remove(chunkOutput)
+  output = open(settingsFile, "w")
+  output.write(settings)
+  output.close()
+
+def searchChunks(chunkDirectory, records, settings, blastLocation, database, eValue, pipeline, backend, searchSize = None):
+  """
+  chunkDirectory: Directory to write the chunks to.
+  records:        A list of 2-tuples, the header and sequence of each protein to search for.
+  settings:       The settings of the search.
+  blastLocation:  Location of the blast installation.
+  database:       The database to search.
+  eValue:         The e value to use.
+  pipeline:       The pipeline running the search.
+  backend:        The SearchBackend to search with.
+  searchSize:     Number of residues e values are calculated for, if None then the size of database.
+
+  return:         A list of the exc_info of every chunk that failed.
+
+  The proteins are split into chunks of about chunkLength residues, with at least one chunk for every
+  process, that have about the same total length.  pipeline.blastProcesses threads take chunks from
+  a queue and search them with pipeline.blastThreads threads each.  Each chunk is cached as soon as it
+  finishes, so completed work is kept however the search ends, and even a chunk that fails has its
+  complete records cached.  The threads work for the stage in the trace of the run that started the search.
+  """
+  span = trace.currentSpan()
+  totalLength = sum([len(sequence) for header, sequence in records])
+  chunks = shardQueries(records, max(pipeline.blastProcesses, totalLength/chunkLength))
+  queue = Queue.Queue()
+  for chunk in xrange(len(chunks)):
+    chunkQuery = os.path.join(chunkDirectory, str(chunk) + ".fas")
+    writeProteins(chunkQuery, chunks[chunk])
+    queue.put(chunkQuery)
+
+  failures = []
+  def work():
+    trace.enter(span)
+    try:
+      while not pipeline.exception:
+        try:
+          chunkQuery = queue.get_nowait()
+        except Queue.Empty:
+          return
+        chunkOutput = chunkQuery[:-len(".fas")] + backend.extension
+        try:
+          backend.search(blastLocation, database, eValue, chunkQuery, chunkOutput, pipeline, pipeline.blastThreads, searchSize)
+        except:
+          failures.append(sys.exc_info())
+        storeChunk(chunkQuery, chunkOutput, settings, backend)
+    finally:
+      trace.enter(None)
+
+  workers = [threading.Thread(target = work) for i in xrange(min(pipeline.blastProcesses, len(chunks)))]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  return failures
+
+def buildBlast(fileName, blastLocation, database, eValue, records, pipeline, backend, searchSize = None):
+  """
+  fileName:      Name of the file of results to write.
+  blastLocation: Location of the blast installation.
+  database:      The database to search.
+  eValue:        The e value to use.
+  records:       A list of 2-tuples, the header and sequence of each query protein.
+  pipeline:      The pipeline running the search.
+  backend:       The SearchBackend to search with.
+  searchSize:    Number of residues e values are calculated for, if None then the size of database.
+
+  Searches for every protein in records that isn't already cached and then assembles fileName from the cache.
+  Chunks left behind by an interrupted search are cached first, and proteins whose chunks failed are searched
+  again up to blastAttempts times in all.
+  """
+  settings = backend.settings(database, eValue, searchSize)
+  chunkDirectory = fileName + ".chunks"
+  salvageChunks(chunkDirectory, settings, backend)
+  queries = queryKeys(records, settings)
+
+  def findUncached():
+    uncached, submitted = [], {}
+    for (header, sequence), (header, key) in zip(records, queries):
+      if key not in submitted and not blastcache.isCached(key):
+        uncached.append((header, sequence))
+        submitted[key] = True
+    return uncached
+
+  uncached, failures, attempt = findUncached(), [], 0
+  while uncached:
+    if attempt == blastAttempts:
+      if failures:
+        raise failures[0][0], failures[0][1], failures[0][2]
+      raise BlastError(str(len(uncached)) + " proteins in " + fileName + " have no results after " + str(attempt) + " searches")
+    attempt += 1
+    trace.count("blastQueriesSubmitted", len(uncached))
+    failures = searchChunks(chunkDirectory, uncached, settings, blastLocation, database, eValue, pipeline, backend, searchSize)
+    if pipeline.exception:
+      raise pipeline.exception
+    uncached = findUncached()
+
+  backend.assemble(fileName + ".tmp", queries, database, eValue)
+  if os.path.isfile(fileName):
+    os.remove(fileName)
+  os.rename(fileName + ".tmp", fileName)
+  os.remove(os.path.join(chunkDirectory, "settings"))
+  os.rmdir(chunkDirectory)
+
+def queryKeys(records, settings):
+  """
+  records:  A list of 2-tuples, the header and sequence of each query protein.
+  settings: The search settings, see SearchBackend.settings.
+
+  return:   A list of 2-tuples, the header of each query and the key its results have in the blastcache module.
+  """
+  return [(header, blastcache.proteinKey(sequence, settings)) for header, sequence in records]
+
+def resultsKey(queries):
+  """
+  queries: A list of 2-tuples as returned by queryKeys.
+
+  return:  The hash of the headers of the queries and the keys they have in the blastcache module, which changes
+           whenever a query or a setting does.
+  """
+  return hashlib.sha1("\n".join([header + "\t" + key for header, key in queries])).hexdigest()
+
+def readKey(fileName):
+  """
+  Returns the key saved for the file fileName by writeKey, or None if there isn't one.
+  """
+  if not os.path.isfile(fileName + ".key"):
+    return None
+  input = open(fileName + ".key", "r")
+  key = input.readline().strip()
+  input.close()
+  return key
+
+def readQueryKeys(fileName):
+  """
+  Returns a dictionary that maps the header of every query in the file of blast results fileName to the key its
+  results were cached under when fileName was made, as saved by writeKey, or None if fileName has no key.
+  """
+  if not os.path.isfile(fileName + ".key"):
+    return None
+  input = open(fileName + ".key", "r")
+  input.readline()
+  result = dict([line.rstrip("\n").rsplit("\t", 1) for line in input if "\t" in line])
+  input.close()
+  return result
+
+def writeKey(fileName, key, queries = ()):
+  """
+  Saves key as the key of the file fileName, in fileName + ".key", followed by the header and key of each of
+  queries, 2-tuples as returned by queryKeys, one to a line.
+  """
+  output = open(fileName + ".key", "w")
+  output.write(key + "\n")
+  for header, queryKey in queries:
+    output.write(header + "\t" + queryKey + "\n")
+  output.close()
+
+def cachedBlast(fileName, blastLocation, database, eValue, query, pipeline, force = False, backend = None, searchSize = None):
+  """
+  Performs a blast search using the blastp executable and database in blastLocation on
+  the query with the eValue.  The result is saved to fileName, an XML file unless another
+  SearchBackend is given.  If fileName already exists the search is skipped, and if it has
+  already been parsed the parsed results are read from its sidecar instead.
+
+  Only proteins that aren't in the blastcache module's cache are submitted to blastp, their results
+  are cached and fileName is then assembled from the cache in the order of the queries.  The uncached
+  proteins are searched in chunks by pipeline.blastProcesses concurrent blastp processes using
+  pipeline.blastThreads threads each, see buildBlast.  If an existing fileName can't be parsed its
+  complete records are cached and it is rebuilt once, only the queries missing from it are searched.
+  If searchSize is given e values are calculated as if database had that many residues.
+
+  The key of the queries and settings fileName was made with is saved in fileName + ".key", if it doesn't
+  match the current queries and settings fileName is stale and is built again, see resultsKey.  Before a stale
+  fileName is rebuilt its records are cached under the keys saved with it, so only the queries that changed are
+  searched again.  A fileName with no saved key was made before keys were saved and, as it was used as it is then,
+  its records are cached under the keys of the current queries and settings.
+  """
+  backend = backend or searchBackends["xml"]
+  records = fasta.readFasta(query, fasta.proteinPattern) if os.path.getsize(query) else []
+  trace.count("blastQueries", len(records))
+  queries = queryKeys(records, backend.settings(database, eValue, searchSize))
+  key = resultsKey(queries)
+  if not os.path.isfile(fileName) or force or readKey(fileName) != key:
+    if os.path.isfile(fileName + ".parsed"):
+      os.remove(fileName + ".parsed")
+    if os.path.isfile(fileName) and not force:
+      savedKeys = readQueryKeys(fileName)
+      if savedKeys is None:
+        savedKeys = dict(queries)
+      blastcache.storeIterations(fileName, savedKeys, backend.split)
+    buildBlast(fileName, blastLocation, database, eValue, records, pipeline, backend, searchSize)
+    writeKey(fileName, key, queries)
+
+  try:
+    return readBlast(fileName, backend)
+  except backend.parseErrors:
+    settings = backend.settings(database, eValue, searchSize)
+    keys = dict(queryKeys(records, settings))
+    blastcache.storeIterations(fileName, keys, backend.split)
+    buildBlast(fileName, blastLocation, database, eValue, records, pipeline, backend, searchSize)
+    return readBlast(fileName, backend)
 
 def isNaN(number):
   """